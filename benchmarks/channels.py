@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Compare the per-call cost of a Channel with Provider.send_sensor.
+
+The provider is marked ready and its emit executor has no workers, so
+only the cost of building and queueing each packet is measured. The
+queue is drained between rounds.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--calls', type=int, default=100000)
+parser.add_argument('-r', '--repeat', type=int, default=5)
+args = parser.parse_args()
+
+provider = Provider('token', executor=EmitExecutor(workers=0))
+provider.ready = True
+imu = provider.channel('sensor', 'imu')
+data = {'accel': [0.1, 0.2, 9.8], 'gyro': [0.01, 0.02, 0.03]}
+
+
+def drain():
+    for queue in provider._emit_lanes.itervalues():
+        queue.clear()
+
+
+senders = [
+    ('send_sensor', lambda: provider.send_sensor('imu', data)),
+    ('channel.send', lambda: imu.send(data)),
+]
+for name, send in senders:
+    best = min(
+        timeit.timeit(send, setup=drain, number=args.calls)
+        for _ in range(args.repeat)
+    )
+    print '%-14s %6.2fus per call' % (name, best / args.calls * 1e6)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Measure how ClusterClient throughput grows with the number of nodes.
+
+Each node is a local stand-in server process that reads the packets sent
+to it over TCP and spends a fixed time per packet, so a node can only
+take so many packets per second. Providers are placed on the nodes by
+the cluster client and send sensor packets as fast as the nodes take
+them. The stand-ins model a node's capacity with a sleep rather than
+real work, so the numbers show how well the load is spread, not what
+an actual server can sustain.
+"""
+import argparse
+import json
+import os
+import select
+import socket
+import sys
+import time
+from functools import partial
+from multiprocessing import Process, Queue
+from urlparse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor
+from heimdallr_client.cluster import ClusterClient
+
+
+def serve(service_time, ports, counts):
+    """ Stand-in node: count packets, taking ``service_time`` for each. """
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+    ports.put(server.getsockname()[1])
+    connections = [server]
+    received = 0
+    reported = time.time()
+    while True:
+        readable, _, _ = select.select(connections, [], [], 0.05)
+        for sock in readable:
+            if sock is server:
+                connections.append(server.accept()[0])
+                continue
+            data = sock.recv(65536)
+            if not data:
+                connections.remove(sock)
+                continue
+            packets = data.count('\n')
+            time.sleep(packets * service_time)
+            received += packets
+        if time.time() - reported > 0.05:
+            counts.put(received)
+            received = 0
+            reported = time.time()
+
+
+class StandInIO(object):
+    """ Writes emitted packets to a stand-in node as JSON lines. """
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.sock = socket.create_connection((parsed.hostname, parsed.port))
+        self.connected = True
+
+    def emit(self, event, *args, **kwargs):
+        self.sock.sendall(json.dumps([event] + list(args)) + '\n')
+
+    def disconnect(self):
+        self.sock.close()
+        self.connected = False
+
+
+class StandInProvider(Provider):
+    def _open(self, url, **kwargs):
+        if self.connection._io and self.connection._io.connected:
+            self.connection._io.disconnect()
+        self.connection._io = StandInIO(url)
+        self.ready = True
+        while self.ready_callbacks:
+            self.ready_callbacks.pop(0)()
+
+
+def run(nodes, providers, packets, service_time):
+    ports, counts = Queue(), Queue()
+    servers = [
+        Process(target=serve, args=(service_time, ports, counts))
+        for _ in range(nodes)
+    ]
+    for process in servers:
+        process.daemon = True
+        process.start()
+    urls = ['http://127.0.0.1:%d' % ports.get() for _ in servers]
+
+    executor = EmitExecutor(workers=2 * nodes)
+    cluster = ClusterClient(
+        'token', urls,
+        provider_factory=partial(StandInProvider, executor=executor)
+    )
+    clients = [cluster.provider('provider-%d' % i) for i in range(providers)]
+    data = {'accel': [0.1, 0.2, 9.8], 'gyro': [0.01, 0.02, 0.03]}
+
+    start = time.time()
+    for _ in range(packets):
+        for provider in clients:
+            provider.send_sensor('imu', data)
+    received = 0
+    total = packets * providers
+    while received < total:
+        received += counts.get()
+    elapsed = time.time() - start
+
+    per_node = sorted(
+        stats['providers'] for stats in cluster.stats().itervalues()
+    )
+    cluster.close()
+    executor.close()
+    for process in servers:
+        process.terminate()
+    print '%d node(s)  providers per node: %-16s %8.0f packets/s' % (
+        nodes, per_node, total / elapsed
+    )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-N', '--nodes', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('-p', '--providers', type=int, default=32)
+parser.add_argument('-n', '--packets', type=int, default=100,
+                    help='Packets per provider')
+parser.add_argument('-s', '--service-time', type=float, default=0.0005,
+                    help='Seconds a node spends per packet')
+args = parser.parse_args()
+
+for nodes in args.nodes:
+    run(nodes, args.providers, args.packets, args.service_time)
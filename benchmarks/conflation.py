@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Compare packet staleness with and without a conflating inbox.
+
+A producer thread pushes sensor packets from several providers into a
+queue that stands in for the socket receive buffer, faster than a slow
+listener can handle them. Without conflation the listener works through
+the backlog; with it the listener always gets the newest packet of each
+source. Reports how old packets are when the listener sees them and how
+large the backlog grows.
+"""
+import argparse
+import os
+import sys
+import time
+from Queue import Queue
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Consumer, EmitExecutor, Histogram
+
+
+def run(conflate, providers, rate, work, seconds):
+    kwargs = {'conflate': ['sensor']} if conflate else {}
+    consumer = Consumer('token', executor=EmitExecutor(workers=0), **kwargs)
+    age = Histogram()
+    backlog = [0]
+    received = Queue()
+
+    @consumer.on('sensor')
+    def on_sensor(packet):
+        age.record(time.time() - packet['data'])
+        time.sleep(work)
+
+    def produce():
+        end = time.time() + seconds
+        while time.time() < end:
+            for i in range(providers):
+                received.put({
+                    'provider': 'provider-%d' % i, 'subtype': 'imu',
+                    'data': time.time()
+                })
+            time.sleep(1.0 / rate)
+        received.put(None)
+
+    producer = Thread(target=produce)
+    producer.start()
+    dispatch = consumer.connection._find_packet_callback('sensor')
+    while True:
+        backlog[0] = max(backlog[0], received.qsize())
+        packet = received.get()
+        if packet is None:
+            break
+        dispatch(packet)
+    producer.join()
+    consumer.close()
+
+    snapshot = age.snapshot()
+    print '%-12s delivered: %6d  age p50: %8.1fms  p99: %8.1fms  ' \
+        'max backlog: %6d' % (
+            'conflated' if conflate else 'direct', snapshot['count'],
+            snapshot['p50'] * 1e3, snapshot['p99'] * 1e3,
+            backlog[0] + len(consumer.inbox)
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-p', '--providers', type=int, default=10)
+parser.add_argument('-r', '--rate', type=float, default=100,
+                    help='Packets per second per provider')
+parser.add_argument('-w', '--work', type=float, default=0.002,
+                    help='Seconds the listener spends per packet')
+parser.add_argument('-s', '--seconds', type=float, default=3)
+args = parser.parse_args()
+
+for conflate in [False, True]:
+    run(conflate, args.providers, args.rate, args.work, args.seconds)
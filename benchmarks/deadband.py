@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Measure the bandwidth a deadband saves on slowly changing telemetry.
+
+Battery, temperature and joint position samples are generated as noisy
+random walks and offered to a provider with and without deadbands. The
+JSON size of every packet that reaches the emit queue is summed to
+estimate the bytes that would go over the wire.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor, Deadband
+
+
+def telemetry(samples, joints):
+    battery = 100.0
+    temperature = 40.0
+    positions = [0.0] * joints
+    for _ in range(samples):
+        battery -= random.uniform(0, 0.002)
+        temperature += random.gauss(0, 0.05)
+        positions = [p + random.gauss(0, 0.001) for p in positions]
+        yield {
+            'battery': round(battery, 3),
+            'temperature': {'cpu': temperature, 'motor': temperature - 5},
+            'joints': positions
+        }
+
+
+def run(name, deadbands, samples, joints, baseline=None):
+    random.seed(0)
+    provider = Provider(
+        'token', executor=EmitExecutor(workers=0), deadbands=deadbands
+    )
+    provider.ready = True
+    data = list(telemetry(samples, joints))
+
+    start = time.time()
+    for sample in data:
+        provider.send_sensor('telemetry', sample)
+    elapsed = time.time() - start
+
+    queue = provider._emit_lanes['sensor']
+    sent = sum(len(json.dumps(args[1])) for args, _, _ in queue)
+    print '%-10s packets: %6d/%6d  bytes: %9d (%5.1f%% saved)  ' \
+        '%6.1f us/sample' % (
+            name, len(queue), samples, sent,
+            100 - 100.0 * sent / (baseline or sent), elapsed / samples * 1e6
+        )
+    return sent
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--samples', type=int, default=10000)
+parser.add_argument('-j', '--joints', type=int, default=6)
+args = parser.parse_args()
+
+baseline = run('none', {}, args.samples, args.joints)
+run('deadband', {
+    'telemetry': Deadband(
+        fields={
+            'battery': 0.5,
+            'temperature': {'absolute': 0.5},
+            'joints': {'absolute': 0.01}
+        },
+        max_silence=5
+    )
+}, args.samples, args.joints, baseline)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compare sending with the shared emit executor against a thread per client.
+
+Each mode runs in its own interpreter so peak memory is not shared. The
+clients never connect; their socket.io emit is replaced with a no-op so
+only the cost of queueing and scheduling is measured.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor
+
+
+def run(mode, clients, packets):
+    sent = []
+
+    def emit(*args):
+        sent.append(args)
+
+    providers = []
+    for _ in range(clients):
+        if mode == 'shared':
+            provider = Provider('token')
+        else:
+            provider = Provider('token', executor=EmitExecutor(workers=1))
+        provider.connection.emit = emit
+        provider.ready = True
+        providers.append(provider)
+
+    threads = threading.active_count()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    for i in range(packets):
+        for provider in providers:
+            provider.send_sensor('bench', i)
+    while len(sent) < clients * packets:
+        time.sleep(0.001)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    print '%-10s threads: %5d  max rss: %8d KB  ' \
+        'context switches: %8d  packets/s: %10.0f' % (
+            mode,
+            threads,
+            after.ru_maxrss,
+            (after.ru_nvcsw + after.ru_nivcsw) -
+            (before.ru_nvcsw + before.ru_nivcsw),
+            clients * packets / elapsed
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-c', '--clients', type=int, default=500)
+parser.add_argument('-p', '--packets', type=int, default=100)
+parser.add_argument('--mode', choices=['shared', 'per-client'])
+args = parser.parse_args()
+
+if args.mode:
+    run(args.mode, args.clients, args.packets)
+else:
+    for mode in ['shared', 'per-client']:
+        subprocess.check_call([
+            sys.executable, __file__, '--mode', mode,
+            '-c', str(args.clients), '-p', str(args.packets)
+        ])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Measure how long sensor packets wait behind a large event.
+
+A provider sends sensor packets at a steady rate to a local stand-in
+server process over a socket, which reports how long each took to
+arrive. Halfway through, a large map event is sent. Without
+fragmentation the emit executor writes the whole event before the
+sensor packets queued behind it; with it, the fragments are sent in
+between them.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return dict(
+        ('p%d' % p, samples[min(len(samples) * p // 100, len(samples) - 1)])
+        for p in [50, 99, 100]
+    )
+
+
+def serve(count, ports, results):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    ports.put(server.getsockname()[1])
+    sock = server.accept()[0].makefile('r')
+    latency = []
+    while len(latency) < count:
+        event, packet = json.loads(sock.readline())
+        if event == 'sensor':
+            latency.append(time.time() - packet['data'])
+    results.put(percentiles(latency))
+
+
+class StandInIO(object):
+    """ Writes packets to the stand-in server as JSON lines. """
+
+    connected = True
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+
+    def emit(self, event, *args, **kwargs):
+        self.sock.sendall(json.dumps([event] + list(args)) + '\n')
+
+    def disconnect(self):
+        self.sock.close()
+
+
+def run(fragment_size, count, rate, size):
+    ports, results = Queue(), Queue()
+    server = Process(target=serve, args=(count, ports, results))
+    server.start()
+
+    executor = EmitExecutor()
+    provider = Provider('token', executor=executor,
+                        fragment_size=fragment_size)
+    provider.connection._io = StandInIO(ports.get())
+    provider.ready = True
+    grid = {'cells': [[x % 7 for x in range(1000)]] * (size // 2000)}
+
+    for i in range(count):
+        if i == count // 2:
+            provider.send_event('map', grid)
+        provider.send_sensor('imu', time.time())
+        time.sleep(1.0 / rate)
+    latency = results.get()
+    server.join()
+    provider.close()
+    executor.close()
+
+    print '%-16s sensor arrival p50: %7.1fus  p99: %8.1fus  ' \
+        'max: %8.1fus' % (
+            'whole' if fragment_size is None else
+            '%d KiB fragments' % (fragment_size // 1024),
+            latency['p50'] * 1e6, latency['p99'] * 1e6,
+            latency['p100'] * 1e6
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--packets', type=int, default=2000)
+parser.add_argument('-r', '--rate', type=float, default=1000,
+                    help='Sensor packets per second')
+parser.add_argument('-s', '--size', type=int, default=8 * 1024 * 1024,
+                    help='Approximate size of the map event in bytes')
+parser.add_argument('-f', '--fragment-size', type=int, default=64 * 1024)
+args = parser.parse_args()
+
+for fragment_size in [None, args.fragment_size]:
+    run(fragment_size, args.packets, args.rate, args.size)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure the handoff latency from a Gateway to LocalConsumer processes.
+
+The gateway process dispatches sensor packets stamped with the time they
+were received into its consumer, and each reader process reports how
+long the packets took to reach its listener.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Consumer, EmitExecutor, Histogram
+from heimdallr_client.gateway import Gateway, LocalConsumer
+
+NAME = 'benchmark-%d' % os.getpid()
+
+
+def read(count, ready, results):
+    latency = Histogram()
+    local = LocalConsumer(NAME)
+
+    @local.on('sensor')
+    def on_sensor(packet):
+        latency.record(time.time() - packet['data']['sent'])
+
+    ready.put(True)
+    while latency.count < count:
+        local.run(seconds=0.1)
+    results.put(latency.snapshot())
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-r', '--readers', type=int, default=2)
+parser.add_argument('-n', '--packets', type=int, default=10000)
+parser.add_argument('--rate', type=float, default=1000,
+                    help='Packets per second')
+args = parser.parse_args()
+
+consumer = Consumer('token', executor=EmitExecutor(workers=0))
+with Gateway(consumer, NAME):
+    ready, results = Queue(), Queue()
+    readers = [
+        Process(target=read, args=(args.packets, ready, results))
+        for _ in range(args.readers)
+    ]
+    for process in readers:
+        process.start()
+    for process in readers:
+        ready.get()
+
+    dispatch = consumer.connection._find_packet_callback('sensor')
+    for i in range(args.packets):
+        dispatch(json.loads(json.dumps({
+            'provider': 'provider', 'subtype': 'imu',
+            'data': {'sent': time.time(), 'accel': [0.1, 0.2, 9.8]}
+        })))
+        time.sleep(1 / args.rate)
+
+    for process in readers:
+        snapshot = results.get()
+        print 'reader  p50: %7.1fus  p99: %7.1fus  max: %7.1fus' % (
+            snapshot['p50'] * 1e6, snapshot['p99'] * 1e6,
+            snapshot['max'] * 1e6
+        )
+    for process in readers:
+        process.join()
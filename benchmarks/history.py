@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compare PacketHistory with keeping received packets in a list of dicts.
+
+Each mode runs in its own interpreter and reports the growth in peak RSS
+after recording the packets, plus the time to answer range queries.
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Consumer, EmitExecutor, PacketHistory
+from heimdallr_client.utils import parse_timestamp
+
+START = 1436201088
+
+
+def packets(count):
+    for i in range(count):
+        t = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(START + i // 10))
+        yield {
+            'provider': 'c7528fa8-0a7b-4486-bbdc-460905ffa035',
+            'subtype': 'pose',
+            't': t,
+            'data': {
+                'x': random.random(),
+                'y': random.random(),
+                'heading': random.random()
+            }
+        }
+
+
+def run(mode, count, queries):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    uuid = 'c7528fa8-0a7b-4486-bbdc-460905ffa035'
+
+    if mode == 'dicts':
+        store = []
+        for packet in packets(count):
+            store.append(packet)
+
+        def query(since, until):
+            return [
+                p for p in store
+                if p['provider'] == uuid and p['subtype'] == 'pose' and
+                since <= parse_timestamp(p['t']) <= until
+            ]
+    else:
+        consumer = Consumer('token', executor=EmitExecutor(workers=0))
+        store = PacketHistory(consumer, max_packets=count)
+        for packet in packets(count):
+            store.add(packet)
+
+        def query(since, until):
+            return store.history(uuid, 'pose', since, until)
+
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for _ in range(queries):
+        since = START + random.randint(0, count // 10)
+        query(since, since + 10)
+    elapsed = time.time() - start
+
+    print '%-8s memory: %8d KB  query: %10.1f us' % (
+        mode, after - before, elapsed / queries * 1e6
+    )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--packets', type=int, default=200000)
+parser.add_argument('-q', '--queries', type=int, default=20)
+parser.add_argument('--mode', choices=['dicts', 'history'])
+args = parser.parse_args()
+
+if args.mode:
+    run(args.mode, args.packets, args.queries)
+else:
+    for mode in ['dicts', 'history']:
+        subprocess.check_call([
+            sys.executable, __file__, '--mode', mode,
+            '-n', str(args.packets), '-q', str(args.queries)
+        ])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Measure how long ``import heimdallr_client`` takes in a fresh interpreter.
+
+The cost of starting an empty interpreter is measured the same way and
+subtracted so that only the package's own import time is reported. Pass
+``--budget`` to exit with a non-zero status when the import gets slower
+than the given number of milliseconds.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HEAVY_MODULES = [
+    'requests', 'socketIO_client', 'pkg_resources', 'uuid',
+    'heimdallr_client.channels', 'heimdallr_client.controls',
+    'heimdallr_client.fragments', 'heimdallr_client.monitor',
+    'heimdallr_client.streams', 'heimdallr_client.tracing'
+]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_statement(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], cwd=ROOT)
+        timings.append((time.time() - start) * 1000)
+    return median(timings)
+
+
+def loaded_heavy_modules():
+    output = subprocess.check_output([
+        sys.executable,
+        '-c',
+        'import sys, heimdallr_client; print " ".join(sorted(sys.modules))'
+    ], cwd=ROOT)
+    modules = set(output.split())
+    return [name for name in HEAVY_MODULES if name in modules]
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--repeat', type=int, default=20)
+parser.add_argument(
+    '--budget',
+    type=float,
+    help='Fail if the import takes longer than this many milliseconds'
+)
+args = parser.parse_args()
+
+baseline = time_statement('pass', args.repeat)
+total = time_statement('import heimdallr_client', args.repeat)
+cost = max(total - baseline, 0)
+heavy = loaded_heavy_modules()
+
+print 'interpreter startup: %7.2f ms' % baseline
+print 'import heimdallr_client: %7.2f ms' % cost
+print 'heavy modules loaded: %s' % (', '.join(heavy) or 'none')
+
+if heavy or (args.budget is not None and cost > args.budget):
+    sys.exit(1)
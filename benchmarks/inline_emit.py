@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Compare send latency of queued and inline emits.
+
+A provider sends sensor packets stamped with the time ``send_sensor`` was
+called to a local stand-in server process over a socket, which reports
+how long each packet took to arrive. Queued emits hand every packet to
+the emit executor's threads; inline emits write it on the calling
+thread.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from multiprocessing import Process, Queue
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Provider, EmitExecutor
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return dict(
+        ('p%d' % p, samples[min(len(samples) * p // 100, len(samples) - 1)])
+        for p in [50, 99]
+    )
+
+
+def serve(count, ports, results):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    ports.put(server.getsockname()[1])
+    sock = server.accept()[0].makefile('r')
+    latency = []
+    for _ in range(count):
+        packet = json.loads(sock.readline())
+        latency.append(time.time() - packet[1]['data'])
+    results.put(percentiles(latency))
+
+
+class StandInIO(object):
+    """ Writes packets to the stand-in server like a websocket would. """
+
+    _opened = True
+    connected = True
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._transport_instance = self._connection = self
+        self.lock = None
+
+    def emit(self, event, *args, **kwargs):
+        with self.lock:
+            self.sock.sendall(json.dumps([event] + list(args)) + '\n')
+
+    def disconnect(self):
+        self.sock.close()
+
+
+def run(inline, count, rate):
+    ports, results = Queue(), Queue()
+    server = Process(target=serve, args=(count, ports, results))
+    server.start()
+
+    executor = EmitExecutor()
+    provider = Provider('token', executor=executor, inline_emit=inline)
+    io = StandInIO(ports.get())
+    # Replaced by the provider's write lock in inline mode
+    io.lock = Lock()
+    provider.connection._io = io
+    provider.ready = True
+
+    call = []
+    for _ in range(count):
+        start = time.time()
+        provider.send_sensor('imu', start)
+        call.append(time.time() - start)
+        time.sleep(1.0 / rate)
+    call = percentiles(call)
+    arrival = results.get()
+    server.join()
+    provider.close()
+    executor.close()
+
+    print '%-7s send call p50: %6.1fus  p99: %6.1fus  ' \
+        'arrival p50: %6.1fus  p99: %7.1fus' % (
+            'inline' if inline else 'queued',
+            call['p50'] * 1e6, call['p99'] * 1e6,
+            arrival['p50'] * 1e6, arrival['p99'] * 1e6
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--packets', type=int, default=5000)
+parser.add_argument('-r', '--rate', type=float, default=1000,
+                    help='Packets per second')
+args = parser.parse_args()
+
+for inline in [False, True]:
+    run(inline, args.packets, args.rate)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compare eager and lazy decoding of received sensor packets.
+
+Eager decoding is what socketIO_client does for every event: the whole
+frame is parsed into dicts. Lazy decoding parses the envelope and leaves
+the data as text until it is read. CPU time is measured for a listener
+that only reads the envelope and one that also reads the data. Memory is
+the growth in peak RSS from keeping the packets, measured in a separate
+interpreter per mode.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client.clients import _split_event, _PACKET_CLASSES
+from heimdallr_client.packets import decode_packet
+from socketIO_client.parsers import parse_socketIO_packet
+
+
+def frame(points):
+    packet = {
+        'provider': 'c7528fa8-0a7b-4486-bbdc-460905ffa035',
+        'subtype': 'scan',
+        't': '2015-07-06T16:44:48Z',
+        'data': {
+            'ranges': [random.random() for _ in range(points)],
+            'intensities': [random.randint(0, 255) for _ in range(points)],
+            'frame': 'laser'
+        }
+    }
+    return '2/consumer,' + json.dumps(
+        ['sensor', packet], separators=(',', ':')
+    )
+
+
+def eager(raw):
+    return parse_socketIO_packet(raw).args[1]
+
+
+def lazy(raw):
+    message_name, text = _split_event(raw, '/consumer')
+    return decode_packet(_PACKET_CLASSES[message_name], text)
+
+
+MODES = {'eager': eager, 'lazy': lazy}
+
+
+def cpu(count, points):
+    raw = frame(points)
+    for name in sorted(MODES):
+        decode = MODES[name]
+        for reads_data in [False, True]:
+            start = time.clock()
+            for _ in range(count):
+                packet = decode(raw)
+                packet['subtype']
+                if reads_data:
+                    packet['data']
+            elapsed = time.clock() - start
+            print '%-6s %-14s %8.2f us/packet' % (
+                name, 'data' if reads_data else 'envelope only',
+                elapsed / count * 1e6
+            )
+
+
+def memory(mode, count, points):
+    raws = [frame(points) for _ in range(100)]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    decode = MODES[mode]
+    kept = [decode(raws[i % 100]) for i in range(count)]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%-6s memory for %d packets: %8d KB' % (mode, len(kept),
+                                                   after - before)
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--packets', type=int, default=20000)
+parser.add_argument('-p', '--points', type=int, default=90,
+                    help='Points per scan in each packet')
+parser.add_argument('--memory', choices=sorted(MODES))
+args = parser.parse_args()
+
+if args.memory:
+    memory(args.memory, args.packets, args.points)
+else:
+    cpu(args.packets, args.points)
+    for mode in sorted(MODES):
+        subprocess.check_call([
+            sys.executable, __file__, '--memory', mode,
+            '-n', str(args.packets), '-p', str(args.points)
+        ])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Measure how long ``Provider.completed`` waits behind bulk stream data.
+
+A backlog of stream chunks is queued before a single ``completed``
+packet. Sending is simulated with a fixed cost per byte so the numbers
+don't depend on a server. The same workload is run with the default
+priority lanes and with every packet in a single FIFO lane.
+"""
+import argparse
+import os
+import sys
+import time
+from threading import Event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Client, Provider, EmitExecutor
+
+
+class FifoProvider(Provider):
+    _lanes = [('fifo', 1)]
+
+    def _emit(self, *args, **kwargs):
+        kwargs['lane'] = 'fifo'
+        Client._emit(self, *args, **kwargs)
+
+
+def run(cls, chunks, chunk_size, bandwidth):
+    done = Event()
+    completed = {}
+
+    def emit(message, packet):
+        if message == 'stream':
+            time.sleep(len(packet) / bandwidth)
+        elif packet['subtype'] == 'completed':
+            completed['sent'] = time.time()
+        if chunks == emit.count:
+            done.set()
+        emit.count += 1
+    emit.count = 0
+
+    with EmitExecutor(workers=1) as executor:
+        provider = cls('token', executor=executor)
+        provider.connection.emit = emit
+        provider.ready = True
+        chunk = '\x00' * chunk_size
+        for _ in range(chunks):
+            provider.send_stream(chunk)
+        queued = time.time()
+        provider.completed('uuid')
+        done.wait()
+
+    print '%-12s completed waited %8.2f ms' % (
+        cls.__name__, (completed['sent'] - queued) * 1000
+    )
+    for lane, histogram in sorted(provider.lane_latency.items()):
+        if histogram.count:
+            print '    %-8s lane p50 %8.2f ms  p99 %8.2f ms' % (
+                lane,
+                histogram.percentile(50) * 1000,
+                histogram.percentile(99) * 1000
+            )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-c', '--chunks', type=int, default=200)
+parser.add_argument('-s', '--chunk-size', type=int, default=64 * 1024)
+parser.add_argument(
+    '-b', '--bandwidth', type=float, default=100e6,
+    help='Simulated bytes per second'
+)
+args = parser.parse_args()
+
+for cls in [Provider, FifoProvider]:
+    run(cls, args.chunks, args.chunk_size, args.bandwidth)
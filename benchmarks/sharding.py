@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Measure how ShardedConsumer throughput scales with worker processes.
+
+Workers use a consumer that makes up sensor packets for its subscribed
+providers instead of connecting to a server, and a listener that does a
+fixed amount of CPU work per packet, so the numbers show how packet
+handling scales across cores.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import cpu_count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client import Consumer
+from heimdallr_client.sharding import ShardedConsumer
+
+PACKET = json.dumps({
+    'subtype': 'imu',
+    't': '2015-07-06T16:44:48Z',
+    'data': {'accel': [0.1, 0.2, 9.8], 'gyro': [0.01, 0.02, 0.03]}
+})
+
+
+class SyntheticConsumer(Consumer):
+    def connect(self, **kwargs):
+        self.subscriptions = set()
+
+        def emit(message_name, packet):
+            if message_name == 'subscribe':
+                self.subscriptions.add(packet['provider'])
+            elif message_name == 'unsubscribe':
+                self.subscriptions.discard(packet['provider'])
+
+        self.connection.emit = emit
+        self.ready = True
+        while self.ready_callbacks:
+            self.ready_callbacks.pop(0)()
+        return self
+
+    def run(self, seconds=None, **kwargs):
+        dispatch = self.connection._find_packet_callback('sensor')
+        end = time.time() + seconds
+        while time.time() < end:
+            for uuid in list(self.subscriptions):
+                packet = json.loads(PACKET)
+                packet['provider'] = uuid
+                dispatch(packet)
+        return self
+
+
+def setup(consumer, report):
+    counter = {'count': 0}
+
+    def on_sensor(packet):
+        accel = packet['data']['accel']
+        sum(a * a for a in accel * 20)
+        counter['count'] += 1
+        if counter['count'] == 1000:
+            report(1000)
+            counter['count'] = 0
+
+    consumer.on('sensor', on_sensor)
+
+
+def run(workers, providers, seconds):
+    with ShardedConsumer(
+        'token', setup, workers=workers, consumer_factory=SyntheticConsumer,
+        poll_interval=0.05
+    ) as sharded:
+        for i in range(providers):
+            sharded.add_provider('provider-%d' % i)
+        time.sleep(0.5)
+        while not sharded.results.empty():
+            sharded.results.get()
+
+        count = 0
+        end = time.time() + seconds
+        while time.time() < end:
+            count += sharded.results.get(timeout=seconds)
+        return count / float(seconds)
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-w', '--max-workers', type=int, default=cpu_count())
+parser.add_argument('-p', '--providers', type=int, default=1000)
+parser.add_argument('-s', '--seconds', type=float, default=3)
+args = parser.parse_args()
+
+single = None
+for workers in range(1, args.max_workers + 1):
+    rate = run(workers, args.providers, args.seconds)
+    single = single or rate
+    print 'workers: %2d  packets/s: %10.0f  speedup: %5.2fx  ' \
+        'per core: %5.2f' % (workers, rate, rate / single,
+                             rate / single / workers)
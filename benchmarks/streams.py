@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Compare the stream codecs that are installed.
+
+Each codec compresses and decompresses chunks of log-like text and of
+point-cloud-like packed floats, and the compression ratio and the
+throughput of both directions are reported per codec and kind of data.
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from heimdallr_client.streams import encode_chunk, decode_chunk, \
+    available_codecs
+
+
+def log_chunk(size):
+    levels = ['DEBUG', 'INFO', 'INFO', 'INFO', 'WARNING']
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        lines.append(
+            '2016-05-04T12:%02d:%02dZ %-7s drive.motor%d: current=%.3fA '
+            'temp=%.1fC\n' % (
+                random.randint(0, 59), random.randint(0, 59),
+                random.choice(levels), random.randint(0, 3),
+                random.uniform(0, 5), random.uniform(20, 60)
+            )
+        )
+    return ''.join(lines)[:size]
+
+
+def point_cloud_chunk(size):
+    # Points on a few surfaces, quantized like a lidar would report them
+    points = []
+    for _ in range(size // 12):
+        x = round(random.uniform(-5, 5), 2)
+        y = round(random.uniform(-5, 5), 2)
+        z = round(random.choice([0.0, 1.5, 2.4]), 2)
+        points.append(struct.pack('<fff', x, y, z))
+    return ''.join(points)[:size]
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-s', '--size', type=int, default=65536,
+                    help='Chunk size in bytes')
+parser.add_argument('-n', '--chunks', type=int, default=50)
+args = parser.parse_args()
+
+random.seed(0)
+chunks = [('log', log_chunk(args.size)),
+          ('point cloud', point_cloud_chunk(args.size))]
+megabytes = args.size * args.chunks / 1e6
+for kind, chunk in chunks:
+    for codec in available_codecs():
+        framed = encode_chunk(chunk, codec)
+        encode = min(timeit.repeat(
+            lambda: encode_chunk(chunk, codec), number=args.chunks, repeat=3
+        ))
+        decode = min(timeit.repeat(
+            lambda: decode_chunk(framed), number=args.chunks, repeat=3
+        ))
+        print '%-11s %-4s  ratio: %5.2f  compress: %7.1f MB/s  ' \
+            'decompress: %7.1f MB/s' % (
+                kind, codec, float(len(chunk)) / len(framed),
+                megabytes / encode, megabytes / decode
+            )
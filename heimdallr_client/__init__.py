@@ -1,6 +1,15 @@
-from pkg_resources import get_distribution
-
 from clients import *
+from emitter import *
+from endpoints import *
 from exceptions import *
+from futures import *
+from history import *
+from inbox import *
+from packets import *
+from policies import *
+from recording import *
+from stats import *
 
-__version__ = get_distribution('py-heimdallr-client').version
+# Kept static so importing the package doesn't have to scan every installed
+# distribution with pkg_resources. setup.py reads the version from here.
+__version__ = '0.0.2'
@@ -0,0 +1,221 @@
+"""
+Windowed statistics over the sensor packets a consumer receives.
+
+This module needs NumPy, which is an optional dependency. Install it
+with ``pip install py-heimdallr-client[aggregation]``.
+"""
+import warnings
+from numbers import Number
+from threading import Event, Lock, Thread
+
+import numpy
+
+__all__ = ['SensorAggregator']
+
+
+def _flatten(data, prefix=''):
+    """ Yield ``(path, value)`` for every number in ``data``. """
+
+    if isinstance(data, dict):
+        for key, value in data.iteritems():
+            for item in _flatten(value, '%s%s.' % (prefix, key)):
+                yield item
+    elif isinstance(data, (list, tuple)):
+        for i, value in enumerate(data):
+            for item in _flatten(value, '%s%s.' % (prefix, i)):
+                yield item
+    elif isinstance(data, Number) and not isinstance(data, bool):
+        yield prefix[:-1] or 'value', data
+
+
+class _RingBuffer(object):
+    """ The last ``size`` samples of one provider's sensor subtype.
+
+    Room for ``width`` fields is allocated up front. A field beyond that
+    doubles the room, so samples whose fields don't change never
+    reallocate.
+    """
+
+    def __init__(self, size, width):
+        self.columns = {}
+        self.values = numpy.full((size, max(width, 1)), numpy.nan)
+        self.index = 0
+        self.count = 0
+        self.dirty = False
+
+    def append(self, fields):
+        row = self.index
+        self.values[row] = numpy.nan
+        for path, value in fields:
+            column = self.columns.get(path)
+            if column is None:
+                column = self.columns[path] = len(self.columns)
+                if column == self.values.shape[1]:
+                    values = numpy.full(
+                        (self.values.shape[0], 2 * column), numpy.nan
+                    )
+                    values[:, :column] = self.values
+                    self.values = values
+            self.values[row, column] = value
+        self.index = (row + 1) % self.values.shape[0]
+        self.count = min(self.count + 1, self.values.shape[0])
+        self.dirty = True
+
+
+class SensorAggregator(object):
+    """
+    Rolling statistics of the numeric fields in sensor packets.
+
+    The aggregator listens for ``sensor`` packets on ``consumer`` and
+    keeps the last ``window`` samples of every (provider, subtype) pair
+    in a preallocated NumPy array, one column per numeric field. Nested
+    fields are named by their dotted path, e.g. ``'position.x'`` or
+    ``'joints.0'``. Instead of a callback per packet, ``callback`` is
+    called at most once every ``interval`` seconds for each pair that
+    received packets since the last call, with statistics computed over
+    the whole window at once.
+
+    Statistics are delivered on a thread of the aggregator's own, so the
+    last window is delivered even when packets stop arriving. Call
+    :meth:`close` to stop listening and stop the thread.
+
+    Args:
+        consumer (:class:`Consumer <heimdallr_client.clients.Consumer>`):
+            Consumer whose sensor packets are aggregated
+        callback (function): Called with the provider UUID, the subtype and
+            the statistics returned by :meth:`stats`
+        window (int): Number of samples kept per provider and subtype
+        interval (float): Seconds between deliveries
+        percentiles (list): Percentiles to compute for every field
+        fields (list): Only aggregate these field paths
+
+    **Usage:**
+
+    .. code-block:: python
+
+        def on_stats(uuid, subtype, stats):
+            print uuid, subtype, stats['fields']['battery']['mean']
+
+        SensorAggregator(consumer, on_stats, window=1000, interval=5)
+    """
+
+    def __init__(self, consumer, callback, window=100, interval=1.0,
+                 percentiles=(50, 90, 99), fields=None):
+        self.consumer = consumer
+        self.callback = callback
+        self.window = window
+        self.interval = interval
+        self.percentiles = list(percentiles)
+        self.fields = set(fields) if fields else None
+        self._buffers = {}
+        self._lock = Lock()
+        self._closed = Event()
+        self._thread = Thread(target=self._run, name='heimdallr-aggregation')
+        self._thread.daemon = True
+        self._thread.start()
+        consumer.on('sensor', self.add)
+
+    def close(self):
+        """ Stop aggregating the consumer's sensor packets. """
+
+        self.consumer.remove_listener('sensor', self.add)
+        self._closed.set()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print 'HeimdallrClient aggregation callback failed: %s' % e
+
+    def add(self, packet):
+        """ Add a sensor packet to its window.
+
+        Called for every sensor packet the consumer receives.
+
+        Args:
+            packet (dict): Sensor packet with ``provider``, ``subtype``
+                and ``data`` fields
+        """
+
+        fields = _flatten(packet.get('data'))
+        if self.fields is not None:
+            fields = [item for item in fields if item[0] in self.fields]
+
+        key = (packet.get('provider'), packet.get('subtype'))
+        with self._lock:
+            buffer_ = self._buffers.get(key)
+            if buffer_ is None:
+                fields = list(fields)
+                buffer_ = self._buffers[key] = _RingBuffer(
+                    self.window,
+                    len(self.fields) if self.fields else len(fields)
+                )
+            buffer_.append(fields)
+
+    def flush(self):
+        """ Deliver statistics for every window that changed.
+
+        Called every ``interval`` seconds by the aggregator's thread.
+        """
+
+        with self._lock:
+            windows = []
+            for key, buffer_ in self._buffers.iteritems():
+                if buffer_.dirty:
+                    buffer_.dirty = False
+                    windows.append((key, self._snapshot(buffer_)))
+        for (uuid, subtype), window in windows:
+            self.callback(uuid, subtype, self._summarize(*window))
+
+    def stats(self, uuid, subtype):
+        """ Compute statistics over the window of a provider's subtype.
+
+        Fields missing from some samples are ignored in those samples.
+
+        Args:
+            uuid (str): UUID of the provider
+            subtype (str): The sensor packet subtype
+
+        Returns:
+            dict: The number of samples in the window as ``count`` and,
+            under ``fields``, the ``mean``, ``min``, ``max`` and
+            percentiles (e.g. ``p50``) of each field. ``None`` if no
+            packets have been received for the pair.
+        """
+
+        with self._lock:
+            buffer_ = self._buffers.get((uuid, subtype))
+            if buffer_ is None:
+                return None
+            window = self._snapshot(buffer_)
+        return self._summarize(*window)
+
+    @staticmethod
+    def _snapshot(buffer_):
+        values = buffer_.values[:buffer_.count, :len(buffer_.columns)].copy()
+        return values, buffer_.columns.items()
+
+    def _summarize(self, values, columns):
+        fields = {}
+        if columns:
+            with warnings.catch_warnings():
+                # All-NaN columns (fields missing from the whole window)
+                warnings.simplefilter('ignore', RuntimeWarning)
+                summary = {
+                    'mean': numpy.nanmean(values, axis=0),
+                    'min': numpy.nanmin(values, axis=0),
+                    'max': numpy.nanmax(values, axis=0)
+                }
+                percentiles = numpy.nanpercentile(
+                    values, self.percentiles, axis=0
+                )
+            for percent, row in zip(self.percentiles, percentiles):
+                summary['p%s' % percent] = row
+            for path, column in columns:
+                fields[path] = dict(
+                    (name, float(row[column]))
+                    for name, row in summary.iteritems()
+                )
+
+        return {'count': len(values), 'fields': fields}
@@ -0,0 +1,78 @@
+from time import gmtime, strftime, time
+
+__all__ = ['Channel']
+
+
+class Channel(object):
+    """
+    A sender bound to one packet type and subtype of a provider.
+
+    Created with :meth:`Provider.channel
+    <heimdallr_client.clients.Provider.channel>`. Once the provider is
+    authorized, :meth:`send` queues the packet directly, copying a
+    prebuilt packet and reusing the timestamp while the second hasn't
+    changed, instead of going through the readiness wrapper of
+    ``send_*``. Before that, and for sensor subtypes with a deadband or
+    rate policy, it falls back to ``send_*``. Event channels don't
+    fragment large data; send it with ``send_event``.
+
+    Args:
+        provider (:class:`Provider <heimdallr_client.clients.Provider>`):
+            Provider to send with
+        packet_type (str): ``'sensor'`` or ``'event'``
+        subtype (str): The packet subtype
+
+    **Usage:**
+
+    .. code-block:: python
+
+        imu = provider.channel('sensor', 'imu')
+        while True:
+            imu.send(read_imu())
+    """
+
+    __slots__ = ('provider', 'packet_type', 'subtype', '_template',
+                 '_fallback', '_policed', '_second', '_stamp')
+
+    def __init__(self, provider, packet_type, subtype):
+        if packet_type not in ('sensor', 'event'):
+            raise ValueError('No channels for %s packets' % packet_type)
+        self.provider = provider
+        self.packet_type = packet_type
+        self.subtype = subtype
+        self._template = {'subtype': subtype, 'data': None, 't': None}
+        self._fallback = getattr(provider, 'send_%s' % packet_type)
+        self._policed = packet_type == 'sensor'
+        self._second = None
+        self._stamp = None
+
+    def __repr__(self):
+        return 'Channel(%r, %r)' % (self.packet_type, self.subtype)
+
+    def send(self, data=None):
+        """ Send a packet with ``data``.
+
+        Args:
+            data: The packet data
+        """
+
+        provider = self.provider
+        if not provider.ready or self._policed and (
+                self.subtype in provider.rate_policies or
+                self.subtype in provider.deadbands):
+            self._fallback(self.subtype, data)
+            return
+
+        now = time()
+        second = int(now)
+        if second != self._second:
+            self._stamp = strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(second))
+            self._second = second
+        packet = self._template.copy()
+        packet['data'] = data
+        packet['t'] = self._stamp
+        if provider.trace:
+            packet['traceSent'] = now
+        provider._emit(self.packet_type, packet)
+
+    __call__ = send
@@ -1,16 +1,62 @@
-from Queue import Queue
-from threading import _Event, Thread
+from collections import deque
+from threading import _Event, Event, Lock, RLock, Timer, current_thread
+from time import time
 from urlparse import urlparse
 from functools import partial
-from socketIO_client import SocketIO, SocketIONamespace, EngineIONamespace
 
-from exceptions import HeimdallrClientException
-from utils import timestamp, for_own_methods, on_ready
-from settings import AUTH_SOURCE, URL
+from emitter import default_executor
+from endpoints import EndpointPool
+from exceptions import HeimdallrClientException, HeimdallrTimeoutError
+from inbox import ConflatingInbox
+from packets import EventPacket, SensorPacket, ControlPacket, Packet, \
+    decode_packet
+from recording import RECEIVED, SENT
+from stats import Histogram
+from utils import timestamp, for_own_methods, on_ready, immediate, \
+    lazy_import
+from settings import AUTH_SOURCE, URL, MAX_IN_FLIGHT, EMIT_LANES, \
+    CLOCK_SYNC_SUBTYPE, CONTROL_TIMEOUT, AUTH_TIMEOUT, FRAGMENT_SIZE, \
+    FRAGMENT_SUBTYPE, LOOP_STOP_TIMEOUT
+
+socketIO_client = lazy_import('socketIO_client')
+# uuid loads ctypes, which is slow to import
+uuids = lazy_import('uuid')
+# Only loaded by the clients that use them
+channels = lazy_import('heimdallr_client.channels')
+controls = lazy_import('heimdallr_client.controls')
+fragments = lazy_import('heimdallr_client.fragments')
+streams = lazy_import('heimdallr_client.streams')
+# Unix only, like the gateway
+receive_loop = lazy_import('heimdallr_client.loop')
 
 
 __all__ = ['Client', 'Provider', 'Consumer']
 
+# Messages that aren't listed here are control-related and go in the
+# 'control' lane
+_LANE_BY_MESSAGE = {'event': 'event', 'sensor': 'sensor', 'stream': 'stream'}
+# Received messages that can be delivered as lazily decoded packets
+_PACKET_CLASSES = {
+    'event': EventPacket,
+    'sensor': SensorPacket,
+    'control': ControlPacket
+}
+
+
+class _NoLock(object):
+    """ Stands in for the write lock of clients that only emit from the
+    emit executor.
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_LOCK = _NoLock()
+
 
 def _init(self, io):
     self._io = io
@@ -19,17 +65,86 @@ def _init(self, io):
     self.initialize()
 
 
-EngineIONamespace.__init__ = _init
+def _split_event(data, path):
+    """ Find the name and raw JSON argument of a socket.io event.
+
+    Only events in namespace ``path`` with a single JSON object argument,
+    no acknowledgement and a name in ``_PACKET_CLASSES`` are recognized.
+    ``data`` is left UTF-8 encoded, which keeps undecoded packets small.
+
+    Returns:
+        tuple: ``(message_name, text)``, or ``None`` if ``data`` isn't
+        such an event
+    """
+
+    prefix = '2' if path == '/' else '2%s,' % path
+    if not data.startswith(prefix) or not data.endswith('}]'):
+        return None
+    for message_name in _PACKET_CLASSES:
+        head = '%s["%s",{' % (prefix, message_name)
+        if data.startswith(head):
+            return message_name, data[len(head) - 1:-1]
+    return None
+
+
+_socketio_classes = {}
 
 
-class _SocketIO(SocketIO):
-    def _should_stop_waiting(self, **kwargs):
-        event = kwargs.pop('event', None)
-        event_set = False
-        if isinstance(event, _Event):
-            event_set = event.is_set()
-        return super(_SocketIO, self)._should_stop_waiting(**kwargs) or \
-            event_set
+def _socketio():
+    """ Import socketIO_client and build the classes that depend on it.
+
+    socketIO_client is only imported the first time a client is
+    created so that importing this package stays fast.
+
+    Returns:
+        dict: ``SocketIO`` and ``SocketIONamespace`` classes to use
+    """
+
+    if not _socketio_classes:
+        socketIO_client.EngineIONamespace.__init__ = _init
+
+        class _SocketIO(socketIO_client.SocketIO):
+            # Namespace whose packets are delivered lazily decoded
+            _lazy_path = None
+            # Set when the client connects again, to end waits on this
+            _replaced = False
+
+            def _process_packet(self, packet):
+                packet_type, data = packet
+                if packet_type == 4 and self._lazy_path is not None and \
+                        not self.placeholder:
+                    event = _split_event(data, self._lazy_path)
+                    if event is not None:
+                        message_name, text = event
+                        try:
+                            args = (decode_packet(
+                                _PACKET_CLASSES[message_name], text
+                            ),)
+                        except ValueError:
+                            args = ()
+                        self.get_namespace()._find_packet_callback(
+                            'message'
+                        )(data)
+                        self.get_namespace(self._lazy_path) \
+                            ._find_packet_callback(message_name)(*args)
+                        return
+                return super(_SocketIO, self)._process_packet(packet)
+
+            def _should_stop_waiting(self, **kwargs):
+                event = kwargs.pop('event', None)
+                event_set = False
+                if isinstance(event, _Event):
+                    event_set = event.is_set()
+                return super(_SocketIO, self)._should_stop_waiting(
+                    **kwargs
+                ) or event_set or self._replaced
+
+        _socketio_classes.update(
+            SocketIO=_SocketIO,
+            SocketIONamespace=socketIO_client.SocketIONamespace
+        )
+
+    return _socketio_classes
 
 
 class Client():
@@ -43,29 +158,135 @@ class Client():
     callback for errors. The default error handler can be
     removed by ``client.remove_listener('err')``.
 
+    Outgoing packets are queued on the client and sent by an
+    :class:`EmitExecutor <heimdallr_client.emitter.EmitExecutor>`,
+    which by default is shared by every client in the process. Call
+    :meth:`close` (or use the client as a context manager) when the
+    client is no longer needed.
+
+    Packets sent with ``ack=True`` ask the server to acknowledge them.
+    At most ``max_in_flight`` of them are left unacknowledged at a time;
+    later acknowledged packets wait in the queue until the window has
+    room. The time until each acknowledgement arrives is recorded in
+    :attr:`ack_latency`, a :class:`Histogram
+    <heimdallr_client.stats.Histogram>` per socket.io message name.
+
+    Queued packets are split into priority lanes (``control``,
+    ``event``, ``sensor`` and ``stream``) so that latency-critical
+    packets like ``authorize`` or :meth:`Provider.completed` don't wait
+    behind bulk data. Lanes are drained highest priority first, each
+    taking up to its weight in packets per round, so lower lanes still
+    make progress under load. Packets in the same lane are sent in
+    order. The time packets spend queued is recorded per lane in
+    :attr:`lane_latency`.
+
+    With ``inline_emit``, a packet is sent right away on the thread
+    calling ``send_*`` instead of being handed to the emit executor,
+    saving a thread handoff per packet. That happens when the client is
+    authorized over a websocket, nothing is queued ahead of the packet
+    in its lane and, for acknowledged packets, the in-flight window has
+    room; otherwise the packet is queued as usual. Every write to the
+    socket, including heartbeats, then goes through one lock.
+
+    With ``lazy_packets``, received ``event``, ``sensor`` and ``control``
+    packets are delivered as :class:`Packet
+    <heimdallr_client.packets.Packet>` objects instead of dicts. Their
+    envelope is parsed on arrival but their data is only decoded when a
+    listener reads it.
+
+    Messages listed in ``conflate`` go through a :class:`ConflatingInbox
+    <heimdallr_client.inbox.ConflatingInbox>` (:attr:`inbox`) and their
+    listeners run on its delivery thread. When listeners are slower than
+    the packets arrive, only the newest packet of each provider and
+    subtype is delivered instead of a growing backlog. Don't conflate
+    messages whose every packet matters, like ``control``.
+
+    The server is given by ``url`` and ``auth_source``. With
+    ``endpoints``, :meth:`connect` instead picks the candidate server
+    that connected and authorized fastest, and fails over to the next
+    one when it can't get in. See :meth:`connect`.
+
     Args:
         token (str): Authentication token
+        executor (:class:`~heimdallr_client.emitter.EmitExecutor`):
+            Executor that sends this client's packets. Defaults to the
+            process-wide executor.
+        max_in_flight (int): Maximum number of unacknowledged packets
+        lazy_packets (bool): Whether to deliver lazily decoded packets
+        conflate (list): Message names, like ``'sensor'``, to deliver
+            through a conflating inbox
+        url (str): URL of the Heimdallr server
+        auth_source (str): Authentication source of the token
+        endpoints (list): Candidate servers, as URLs, ``(url,
+            auth_source)`` pairs or an :class:`EndpointPool
+            <heimdallr_client.endpoints.EndpointPool>`
+        auth_timeout (float): Seconds an endpoint has to authorize the
+            client
+        inline_emit (bool): Whether to send packets on the calling thread
+            when possible
     """
 
     _url = URL
     _auth_source = AUTH_SOURCE
     _namespace = '/'
     _safe = True
-
-    def __init__(self, token):
+    _lanes = EMIT_LANES
+    # Only consumers receive fragmented events
+    fragments = None
+
+    def __init__(self, token, executor=None, max_in_flight=MAX_IN_FLIGHT,
+                 lazy_packets=False, conflate=(), url=None, auth_source=None,
+                 endpoints=None, auth_timeout=AUTH_TIMEOUT,
+                 inline_emit=False):
         self.ready = False
+        self.closed = False
         self.ready_callbacks = []
         self.callbacks = {}
+        self.subtype_callbacks = {}
         self.token = token
-        self.connection = SocketIONamespace(None, self._namespace)
+        self.max_in_flight = max_in_flight
+        self.lazy_packets = lazy_packets
+        self.conflate = frozenset(conflate)
+        self.inbox = ConflatingInbox(self._call_callbacks)
+        self.ack_latency = {}
+        self.lane_latency = dict(
+            (lane, Histogram()) for lane, _ in self._lanes
+        )
+        self.connection = _socketio()['SocketIONamespace'](
+            None, self._namespace
+        )
 
         # Handle sending packets asynchronously
-        self._emit_queue = Queue()
-        self._emit_worker = Thread(target=self._emit_task)
-        self._emit_worker.daemon = True
-        self._emit_worker.start()
-
-        emit = self.connection.emit
+        self._emit_lanes = dict((lane, deque()) for lane, _ in self._lanes)
+        self._executor = executor or default_executor()
+        self._in_flight = set()
+        self._in_flight_lock = Lock()
+        self._recorder = None
+        self._tracer = None
+        self.trace = False
+        self._subtype_dispatchers = {}
+        self._loop = None
+        self._url = url or self._url
+        # Log with the URL this client connects to
+        self.connection._log_name = self._url
+        self._auth_source = auth_source or self._auth_source
+        if endpoints is not None and not isinstance(endpoints, EndpointPool):
+            endpoints = EndpointPool(endpoints)
+        self.endpoints = endpoints
+        self.endpoint = None
+        self.auth_timeout = auth_timeout
+        self.inline_emit = inline_emit
+        self._write_lock = RLock() if inline_emit else _NO_LOCK
+        self._authorized = Event()
+        # Held while connecting, so that run() doesn't wait on a socket
+        # that is being replaced
+        self._connect_lock = RLock()
+        self._run_thread = None
+        self._run_interrupted = False
+        self._run_done = Event()
+        self._run_done.set()
+
+        emit = self._raw_emit = self.connection.emit
 
         def safe_emit(*args, **kwargs):
             try:
@@ -89,21 +310,49 @@ class Client():
         @self.on('auth-success')
         def fn(*args):
             self.ready = True
+            self._authorized.set()
             while self.ready_callbacks:
                 self.ready_callbacks.pop(0)()
 
         def on_connect(*args):
-            self._emit_queue.put((
+            self._emit(
                 'authorize',
                 {'token': self.token, 'authSource': self._auth_source}
-            ))
+            )
 
         self.on('connect', on_connect)
         self.on('reconnect', on_connect)
 
-    def __del__(self):
-        # Cleanup thread
-        self._emit_worker._Thread__stop()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Disconnect from the Heimdallr server and stop sending packets.
+
+        Packets that are still queued are dropped and packets sent
+        afterwards are ignored until :meth:`connect` is called again. The
+        shared emit executor keeps running for the other clients. Packets
+        waiting in the :attr:`inbox` are dropped too.
+
+        :returns: :class:`Client <Client>`
+        """
+
+        self.closed = True
+        self._executor.discard(self)
+        for queue in self._emit_lanes.itervalues():
+            queue.clear()
+        self._fail_in_flight('Client was closed')
+        self.inbox.close()
+        self._closing()
+        self.stop(LOOP_STOP_TIMEOUT)
+        io = self.connection._io
+        if io and io.connected:
+            io.disconnect()
+
+        return self
 
     def connect(self, **kwargs):
         """ Connect to the Heimdallr server.
@@ -111,33 +360,176 @@ class Client():
         The ``connect`` method blocks until the the socket connection
         to the server has been established.
 
+        With :attr:`endpoints`, every healthy endpoint that hasn't been
+        measured yet is first probed with a separate connection, and the
+        endpoints are then tried fastest first. ``connect`` waits until
+        an endpoint has authorized the client, which updates the
+        endpoint's measured time. An endpoint that doesn't authorize
+        within :attr:`auth_timeout` seconds, or fails, is skipped until
+        its cooldown has passed. The endpoint connected to is kept in
+        :attr:`endpoint`.
+
+        A client that was started with :meth:`start` is taken off its
+        receive loop while it connects, so the loop doesn't read the
+        socket that is being replaced, and put back afterwards. Likewise,
+        when ``connect`` is called from another thread while :meth:`run`
+        is waiting, the wait is interrupted first and :meth:`run` goes on
+        waiting on the new socket once it is connected.
+
         Args:
             **kwargs: Passed to underlying SocketIO constructor
 
         :returns: :class:`Client <Client>`
         """
 
+        with self._connect_lock:
+            self.closed = False
+            self.inbox.open()
+            loop = self._loop
+            if loop is not None:
+                self.stop(LOOP_STOP_TIMEOUT)
+            io = self._interrupt_run()
+            try:
+                self._connect(kwargs)
+            finally:
+                if io is not None and io is self.connection._io:
+                    io._replaced = False
+                if loop is not None and not self.closed:
+                    self.start(loop)
+
+        return self
+
+    def _interrupt_run(self):
+        """ End the wait of a :meth:`run` in another thread.
+
+        Returns:
+            The socket that was waited on, or ``None`` if :meth:`run`
+            wasn't waiting
+        """
+
+        io = self.connection._io
+        if io is None or self._run_thread in (None, current_thread()):
+            return None
+        io._replaced = True
+        self._run_interrupted = True
+        # The wait checks for it at least once a second
+        self._run_done.wait(LOOP_STOP_TIMEOUT)
+        return io
+
+    def _connect(self, kwargs):
+        if self.endpoints is None:
+            try:
+                self._open(self._url, **kwargs)
+            except Exception as e:
+                if not self._safe:
+                    raise e
+
+                print 'HeimdallrClient failed to connect: %s' % e.message
+
+            return
+
+        for endpoint in self.endpoints.unmeasured():
+            self._probe(endpoint, kwargs)
+
+        error = None
+        for endpoint in self.endpoints.candidates():
+            try:
+                self._open_endpoint(endpoint, kwargs)
+            except Exception as e:
+                error = e
+                print 'HeimdallrClient failed to connect to %s: %s' % (
+                    endpoint.url, e
+                )
+                continue
+
+            self.endpoint = endpoint
+            return
+
+        self.endpoint = None
+        if not self._safe:
+            raise error
+
+    def failover(self, **kwargs):
+        """ Give up on the current endpoint and connect to the next best.
+
+        Useful when the connection is up but unhealthy, e.g. as the
+        ``on_degraded`` callback of a :class:`LinkMonitor
+        <heimdallr_client.monitor.LinkMonitor>`.
+
+        Args:
+            **kwargs: Passed to :meth:`connect`
+
+        :returns: :class:`Client <Client>`
+        """
+
+        if self.endpoint is not None:
+            self.endpoints.failed(self.endpoint)
+        return self.connect(**kwargs)
+
+    def _open(self, url, **kwargs):
+        """ Replace the socket connection with one to ``url``. """
+
+        parsed = urlparse(url)
+        if self.connection._io and self.connection._io.connected:
+            self.connection.disconnect()
+        self._fail_in_flight('Connection was reset')
+        self._authorized.clear()
+        self.connection._io = _socketio()['SocketIO'](
+            '%s://%s' % (parsed.scheme, parsed.hostname),
+            parsed.port,
+            **kwargs
+        )
+        io = self.connection._io
+        if self.lazy_packets:
+            io._lazy_path = self._namespace
+        io._namespace = self.connection
+        io._namespace_by_path[self._namespace] = self.connection
+        io.connect(self._namespace)
+        io.wait(for_connect=True)
+        self._writable()
+
+    def _open_endpoint(self, endpoint, kwargs):
+        """ Connect to ``endpoint`` and wait until it authorizes the client.
+        """
+
+        start = time()
+        self._url = self.connection._log_name = endpoint.url
+        self._auth_source = endpoint.auth_source or self._auth_source
         try:
-            parsed = urlparse(self._url)
-            if self.connection._io and self.connection._io.connected:
-                self.connection.disconnect()
-            self.connection._io = _SocketIO(
-                '%s://%s' % (parsed.scheme, parsed.hostname),
-                parsed.port,
-                **kwargs
-            )
-            io = self.connection._io
-            io._namespace = self.connection
-            io._namespace_by_path[self._namespace] = self.connection
-            io.connect(self._namespace)
-            io.wait(for_connect=True)
-        except Exception as e:
-            if not self._safe:
-                raise e
+            self._open(endpoint.url, **kwargs)
+            if not self._authorized.is_set():
+                self.connection._io.wait(
+                    seconds=self.auth_timeout, event=self._authorized
+                )
+            if not self._authorized.is_set():
+                raise HeimdallrTimeoutError(
+                    'Not authorized within %s seconds' % self.auth_timeout
+                )
+        except Exception:
+            self.endpoints.failed(endpoint)
+            raise
+        self.endpoints.succeeded(endpoint, time() - start)
 
-            print 'HeimdallrClient failed to connect: %s' % e.message
+    def _probe(self, endpoint, kwargs):
+        """ Measure ``endpoint`` with a throwaway client of the same kind.
 
-        return self
+        The probe doesn't share this client's listeners or queued
+        packets, so nothing is sent to an endpoint that isn't chosen.
+        """
+
+        probe = self.__class__(
+            self.token,
+            executor=self._executor,
+            auth_source=self._auth_source,
+            endpoints=self.endpoints,
+            auth_timeout=self.auth_timeout
+        )
+        try:
+            probe._open_endpoint(endpoint, kwargs)
+        except Exception as e:
+            print 'HeimdallrClient failed to probe %s: %s' % (endpoint.url, e)
+        finally:
+            probe.close()
 
     def run(self, seconds=None, **kwargs):
         """ Main loop for a client.
@@ -155,7 +547,7 @@ class Client():
             event (:py:class:`threading.Event`): Triggers the exit of the run
                 loop when the flag is set
             for_connect (bool): Run until the SocketIO connect event
-            for_callback (bool): Run until the server has acknowledged all
+            for_callbacks (bool): Run until the server has acknowledged all
                 emits
 
         :returns: :class:`Client <Client>`
@@ -171,15 +563,230 @@ class Client():
             client.run()  # Loops forever
         """
 
+        deadline = None if seconds is None else time() + seconds
         kwargs['seconds'] = seconds
-        self.connection._io.wait(**kwargs)
+        while True:
+            with self._connect_lock:
+                io = self.connection._io
+                self._run_thread = current_thread()
+                self._run_done.clear()
+            try:
+                io.wait(**kwargs)
+            finally:
+                self._run_thread = None
+                self._run_done.set()
+            # Keep waiting, on the new socket, if connect() interrupted
+            # the wait. The lock is held until it has connected.
+            with self._connect_lock:
+                interrupted, self._run_interrupted = \
+                    self._run_interrupted, False
+            if self.closed or not interrupted:
+                break
+            if deadline is not None:
+                kwargs['seconds'] = deadline - time()
+                if kwargs['seconds'] <= 0:
+                    break
 
         return self
 
-    def _emit_task(self):
-        while True:
-            args = self._emit_queue.get()
+    def start(self, loop=None):
+        """ Receive packets in the background.
+
+        Instead of blocking in :meth:`run`, the client is handed to a
+        :class:`ReceiveLoop <heimdallr_client.loop.ReceiveLoop>`, whose
+        thread waits for packets on many clients at once and calls their
+        listeners. By default the process-wide loop is used, so all
+        started clients share one thread. Unix only.
+
+        Args:
+            loop (:class:`ReceiveLoop <heimdallr_client.loop.ReceiveLoop>`):
+                Loop to receive packets on
+
+        :returns: :class:`Client <Client>`
+
+        **Usage:**
+
+        .. code-block:: python
+
+            provider.connect().start()
+            consumer.connect().start()  # Shares the provider's thread
+            ...
+            consumer.stop()  # Returns within milliseconds
+        """
+
+        self.stop()
+        self._loop = loop or receive_loop.default_loop()
+        self._loop.add(self)
+
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop receiving packets in the background.
+
+        The loop is woken right away and, unless ``stop`` is called from
+        a listener, it returns once the loop is done with the client, so
+        no listener is called by the loop afterwards. The connection is
+        left open.
+
+        Args:
+            timeout (float): Seconds to wait for the loop to let go
+
+        :returns: :class:`Client <Client>`
+        """
+
+        loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.remove(self, timeout)
+
+        return self
+
+    def _emit(self, *args, **kwargs):
+        """ Queue a socket.io message to be sent by the emit executor.
+
+        Args:
+            args: Arguments for ``SocketIONamespace.emit``
+            ack (:class:`Future <heimdallr_client.futures.Future>`):
+                Resolved with the server's acknowledgement of the message
+            lane (str): Priority lane to queue the message in. Defaults
+                to the lane for the message name.
+        """
+
+        ack = kwargs.get('ack')
+        if self.closed:
+            if ack is not None:
+                ack.set_exception(
+                    HeimdallrClientException('Client was closed')
+                )
+            return
+        lane = kwargs.get('lane') or _LANE_BY_MESSAGE.get(args[0], 'control')
+        if self.inline_emit and \
+                (ack is None or len(self._in_flight) < self.max_in_flight):
+            with self._write_lock:
+                if not self._emit_lanes[lane] and self._writable():
+                    self._send(lane, args, ack, time())
+                    return
+        self._emit_lanes[lane].append((args, ack, time()))
+        self._executor.submit(self)
+
+    def _writable(self):
+        """ Whether packets can be written to the socket on any thread.
+
+        Shares :attr:`_write_lock` with the websocket, which the
+        heartbeat thread also writes to, so frames aren't interleaved.
+        """
+
+        io = self.connection._io
+        if not self.inline_emit or io is None or not io._opened:
+            return False
+        connection = getattr(io._transport_instance, '_connection', None)
+        if getattr(connection, 'lock', None) is None:
+            # Polling transports aren't written to inline
+            return False
+        if connection.lock is not self._write_lock:
+            connection.lock = self._write_lock
+        return self.ready and io.connected
+
+    def _lane_ready(self, queue):
+        try:
+            args, ack, queued = queue[0]
+        except IndexError:
+            return False
+        return ack is None or len(self._in_flight) < self.max_in_flight
+
+    def _emit_pending(self):
+        for queue in self._emit_lanes.itervalues():
+            if self._lane_ready(queue):
+                return True
+        return False
+
+    def _emit_task(self, limit):
+        """ Send up to ``limit`` queued messages.
+
+        Called by the emit executor from one of its worker threads.
+        Each round takes up to a lane's weight in messages from every
+        lane, highest priority first. A lane is skipped when its next
+        message needs an acknowledgement and the in-flight window is
+        full.
+
+        Args:
+            limit (int): Maximum number of messages to send
+        """
+
+        sent = 0
+        while sent < limit:
+            sent_in_round = 0
+            for lane, weight in self._lanes:
+                queue = self._emit_lanes[lane]
+                for _ in range(min(weight, limit - sent - sent_in_round)):
+                    if not self._lane_ready(queue):
+                        break
+                    # Held until the packet is written, so an inline
+                    # emit can't overtake it
+                    with self._write_lock:
+                        try:
+                            args, ack, queued = queue.popleft()
+                        except IndexError:
+                            break
+                        self._send(lane, args, ack, queued)
+                    sent_in_round += 1
+            if not sent_in_round:
+                return
+            sent += sent_in_round
+
+    def _send(self, lane, args, ack, queued):
+        now = time()
+        self.lane_latency[lane].record(now - queued)
+        if self.trace and isinstance(args[-1], dict) and \
+                'traceSent' in args[-1]:
+            args[-1]['traceEmitted'] = now
+        if self._recorder is not None:
+            self._recorder.record(SENT, args[0], args[1:])
+        if ack is None:
             self.connection.emit(*args)
+        else:
+            self._emit_with_ack(args, ack)
+
+    def _emit_with_ack(self, args, ack):
+        sent = time()
+
+        def on_ack(*response):
+            with self._in_flight_lock:
+                if ack not in self._in_flight:
+                    return
+                self._in_flight.remove(ack)
+            histogram = self.ack_latency.get(args[0])
+            if histogram is None:
+                histogram = self.ack_latency.setdefault(args[0], Histogram())
+            histogram.record(time() - sent)
+            ack.set_result(response[0] if response else None)
+            if self._emit_pending() and not self.closed:
+                self._executor.submit(self)
+
+        with self._in_flight_lock:
+            self._in_flight.add(ack)
+        try:
+            self._raw_emit(*(args + (on_ack,)))
+        except Exception as e:
+            with self._in_flight_lock:
+                self._in_flight.discard(ack)
+            ack.set_exception(e)
+            if not self._safe:
+                raise
+
+    def _fail_in_flight(self, message):
+        """ Fail every acknowledgement that is still outstanding.
+
+        Acknowledgements can't arrive over a new connection, so this
+        frees up the in-flight window when the old one goes away.
+
+        Args:
+            message (str): Message for the exception the futures fail with
+        """
+
+        with self._in_flight_lock:
+            in_flight, self._in_flight = self._in_flight, set()
+        for ack in in_flight:
+            ack.set_exception(HeimdallrClientException(message))
 
     def __trigger_callbacks(self, message_name, *args):
         """ Call all of the callbacks for a socket.io message.
@@ -194,6 +801,30 @@ class Client():
             args: Data sent with message
         """
 
+        if self._recorder is not None:
+            self._recorder.record(RECEIVED, message_name, args)
+        if message_name == 'stream' and args:
+            try:
+                args = (streams.decode_chunk(args[0]),) + args[1:]
+            except ValueError as e:
+                print 'HeimdallrClient dropped a stream chunk: %s' % e
+                return
+        elif message_name == 'event' and args and \
+                self.fragments is not None:
+            packet = self.fragments.feed(args[0])
+            if packet is None:
+                return
+            args = (packet,) + args[1:]
+        if self._tracer is not None:
+            self._tracer.received(message_name, args)
+        if message_name in self.conflate:
+            self.inbox.put(message_name, *args)
+        else:
+            self._call_callbacks(message_name, *args)
+
+    def _call_callbacks(self, message_name, *args):
+        if self._tracer is not None:
+            self._tracer.dispatched(message_name, args)
         callbacks = self.callbacks.get(message_name, [])
         for callback in callbacks:
             callback(*args)
@@ -220,7 +851,7 @@ class Client():
             partial(self.__trigger_callbacks, message_name)
         )
 
-    def on(self, message_name, callback=None):
+    def on(self, message_name, callback=None, subtype=None, provider=None):
         """ Add a socket.io message listener.
 
         The ``on`` method will add a callback for socket.io messages
@@ -229,11 +860,20 @@ class Client():
         in the order in which they were added. This method can be
         called outright or it can be used as a decorator.
 
+        For Heimdallr packets, ``subtype`` and ``provider`` restrict the
+        callback to packets with that ``subtype`` and/or from that
+        provider. A :class:`Consumer <Consumer>` can derive its filters
+        from these listeners.
+
         Args:
             message_name (str): Name of the socket.io message to listen for
             callback (function): Callback to run when the socket.io
                 message is heard
-                
+            subtype (str): Only call ``callback`` for packets of this
+                subtype
+            provider (str): Only call ``callback`` for packets from the
+                provider with this UUID. Requires ``subtype``.
+
         :returns: :class:`Client <Client>`
 
         **Usage:**
@@ -248,43 +888,103 @@ class Client():
             @client.on('myMessage')
             def second(*args):
                 print 'SECOND'
+
+            @client.on('sensor', subtype='imu')
+            def third(packet):
+                print packet['data']
         """
 
         # Decorator syntax
         if callback is None:
             def decorator(fn):
-                self.__on(message_name, fn)
+                self.on(message_name, fn, subtype, provider)
             return decorator
 
-        # SocketIO-Client syntax
-        self.__on(message_name, callback)
+        if subtype is None:
+            # SocketIO-Client syntax
+            self.__on(message_name, callback)
+        else:
+            if message_name not in self._subtype_dispatchers:
+                dispatcher = partial(self._dispatch_subtype, message_name)
+                self._subtype_dispatchers[message_name] = dispatcher
+                self.__on(message_name, dispatcher)
+            self.subtype_callbacks.setdefault(
+                (message_name, subtype), []
+            ).append((provider, callback))
+        self._listeners_changed(message_name, provider)
 
         return self
 
-    def remove_listener(self, message_name, callback=None):
+    def remove_listener(self, message_name, callback=None, subtype=None,
+                        provider=None):
         """ Remove listener for socket.io message.
 
         If ``callback`` is specified, only the callbacks registered
         for ``message_name`` that match ``callback`` will be removed.
         If only ``message_name`` is specified, all of the callbacks
-        will be removed.
+        will be removed. Callbacks added with a ``subtype`` are only
+        removed individually when the same ``subtype`` (and
+        ``provider``) is given.
 
         Args:
             message_name (str): Name of the socket.io message to remove
             callback (function): Specific callback to remove
+            subtype (str): Subtype the callback was added for
+            provider (str): Provider the callback was added for
 
         :returns: :class:`Client <Client>`
         """
 
-        if callback:
+        if subtype is not None:
+            key = (message_name, subtype)
+            self.subtype_callbacks[key] = [
+                (uuid, fn) for uuid, fn in self.subtype_callbacks.get(key, [])
+                if (callback is not None and fn != callback) or
+                uuid != provider
+            ]
+            if not self.subtype_callbacks[key]:
+                del self.subtype_callbacks[key]
+        elif callback:
             while callback in self.callbacks.get(message_name, []):
                 self.callbacks[message_name].remove(callback)
         else:
             self.callbacks.pop(message_name, None)
             self.connection._callback_by_event.pop(message_name, None)
+            self._subtype_dispatchers.pop(message_name, None)
+            for key in self.subtype_callbacks.keys():
+                if key[0] == message_name:
+                    del self.subtype_callbacks[key]
+        self._listeners_changed(message_name, provider)
 
         return self
 
+    def _dispatch_subtype(self, message_name, packet=None, *args):
+        """ Call the subtype listeners that match a packet. """
+
+        if not isinstance(packet, (dict, Packet)):
+            return
+        callbacks = self.subtype_callbacks.get(
+            (message_name, packet.get('subtype')), []
+        )
+        for provider, callback in list(callbacks):
+            if provider is None or provider == packet.get('provider'):
+                callback(packet, *args)
+
+    def _listeners_changed(self, message_name, provider):
+        """ Called after listeners for ``message_name`` are added or removed.
+
+        Args:
+            message_name (str): Message whose listeners changed
+            provider (str): Provider the listener was restricted to, if any
+        """
+
+        pass
+
+    def _closing(self):
+        """ Called when the client is closed. """
+
+        pass
+
 
 @for_own_methods(on_ready)
 class Provider(Client):
@@ -293,51 +993,200 @@ class Provider(Client):
     It inherits most of its functionality but it also
     automatically connects to the provider namespace and
     provides some convenience functions.
+
+    High-rate sensor subtypes can be thinned out before their packets
+    are queued by giving a :class:`RatePolicy
+    <heimdallr_client.policies.RatePolicy>` per subtype. Samples that
+    barely change can be suppressed with a :class:`Deadband
+    <heimdallr_client.policies.Deadband>` per subtype, which is applied
+    to the samples the rate policy lets through. Each policy counts the
+    samples it sent and shed.
+
+    With ``trace``, event and sensor packets carry the times they were
+    passed to ``send_*`` and sent by the emit executor, and ``clockSync``
+    controls are answered, for a consumer's :class:`LatencyTracer
+    <heimdallr_client.tracing.LatencyTracer>`.
+
+    With ``stream_codec``, every chunk passed to :meth:`send_stream` is
+    compressed on its own and framed with a header naming the codec (see
+    :mod:`heimdallr_client.streams`). Consumers decompress it before
+    their ``stream`` listeners see it, and drop chunks they can't
+    decompress, so every consumer needs the codec installed. Only
+    ``zlib`` is always available.
+
+    With ``fragment_size``, event data whose JSON is longer than that
+    many characters is sent in fragments (see
+    :mod:`heimdallr_client.fragments`) that are queued one by one, so
+    controls and sensor packets are sent in between them. Consumers put
+    the event back together before their ``event`` listeners see it.
+    This changes what goes on the wire, so only turn it on when the
+    provider's schema allows ``fragment`` events and every consumer of
+    the provider reassembles them.
+
+    Args:
+        token (str): Authentication token
+        rate_policies (dict): Rate policy for each sensor subtype
+        deadbands (dict): Deadband for each sensor subtype
+        trace (bool): Whether to add trace timestamps to packets
+        stream_codec (str): ``'zlib'``, ``'lz4'`` or ``'zstd'`` to
+            compress stream data with
+        fragment_size (int): Most characters of JSON per event.
+            Defaults to ``None``, which never fragments events.
+        **kwargs: Passed to :class:`Client <Client>`
+
+    **Usage:**
+
+    .. code-block:: python
+
+        from heimdallr_client.policies import Latest, TokenBucket, Deadband
+
+        provider = Provider(
+            token,
+            rate_policies={
+                'imu': Latest(0.05),  # The newest sample every 50 ms
+                'log': TokenBucket(10, burst=50)
+            },
+            deadbands={'battery': Deadband(absolute=0.5, max_silence=60)}
+        )
+        provider.rate_policies['imu'].stats()  # {'sent': 20, 'shed': 980}
     """
 
     _namespace = '/provider'
 
-    def send_event(self, subtype, data=None):
+    def __init__(self, token, rate_policies=None, deadbands=None,
+                 trace=False, stream_codec=None, fragment_size=FRAGMENT_SIZE,
+                 **kwargs):
+        if stream_codec is not None:
+            # Fail early if the codec's package isn't installed
+            streams.encode_chunk('', stream_codec)
+        Client.__init__(self, token, **kwargs)
+        self.rate_policies = dict(rate_policies or {})
+        self.deadbands = dict(deadbands or {})
+        self.trace = trace
+        self.stream_codec = stream_codec
+        self.fragment_size = fragment_size
+        if trace:
+            self.on(
+                'control', self._answer_clock_sync,
+                subtype=CLOCK_SYNC_SUBTYPE
+            )
+
+    def _packet(self, subtype, data):
+        packet = {'subtype': subtype, 'data': data, 't': timestamp()}
+        if self.trace:
+            packet['traceSent'] = time()
+        return packet
+
+    def _answer_clock_sync(self, packet):
+        """ Answer a consumer's clock sync with the time it arrived.
+
+        The time the answer is sent is added as ``traceEmitted`` when the
+        emit executor sends it.
+        """
+
+        data = packet.get('data') or {}
+        self._emit(
+            'event',
+            {
+                'subtype': CLOCK_SYNC_SUBTYPE,
+                'data': {'t0': data.get('t0'), 't1': time()},
+                't': timestamp(),
+                'traceSent': time()
+            },
+            lane='control'
+        )
+
+    @immediate
+    def channel(self, packet_type, subtype):
+        """ Get a sender for packets of one type and subtype.
+
+        Sending through a :class:`Channel
+        <heimdallr_client.channels.Channel>` costs less per packet than
+        :meth:`send_sensor` or :meth:`send_event`, which helps providers
+        sending thousands of packets per second.
+
+        Args:
+            packet_type (str): ``'sensor'`` or ``'event'``
+            subtype (str): The packet subtype
+
+        :returns: :class:`Channel <heimdallr_client.channels.Channel>`
+        """
+
+        return channels.Channel(self, packet_type, subtype)
+
+    def send_event(self, subtype, data=None, ack=False):
         """ Emit a Heimdallr event packet.
 
         This will send a Heimdallr event packet to the
         Heimdallr server where it will be rebroadcast.
         ``data`` must adhere to the provider's schema for
-        the given ``subtype``.
+        the given ``subtype``. Large data is sent in fragments,
+        and with ``ack`` the future is resolved when the last
+        fragment is acknowledged.
 
         Args:
             subtype (str): The event packet subtype
             data: The event packet data
+            ack (bool): Whether the server should acknowledge the packet
 
-        :returns: :class:`Provider <Provider>`
+        :returns: :class:`Provider <Provider>` or a :class:`Future
+            <heimdallr_client.futures.Future>` if ``ack`` is ``True``
         """
 
-        self._emit_queue.put((
-            'event',
-            {'subtype': subtype, 'data': data, 't': timestamp()}
-        ))
+        pieces = None
+        if self.fragment_size is not None and \
+                isinstance(data, (dict, list, tuple, basestring)):
+            pieces = fragments.split_event(subtype, data, self.fragment_size)
+        if pieces is None:
+            self._emit('event', self._packet(subtype, data), ack=ack or None)
+            return
+
+        last = len(pieces) - 1
+        for index, fragment in enumerate(pieces):
+            self._emit(
+                'event', self._packet(FRAGMENT_SUBTYPE, fragment),
+                ack=(ack or None) if index == last else None
+            )
 
-    def send_sensor(self, subtype, data=None):
+    def send_sensor(self, subtype, data=None, ack=False):
         """ Emit a Heimdallr sensor packet.
 
         This will send a Heimdallr sensor packet to the
         Heimdallr server where it will be rebroadcast.
         ``data`` must adhere to the provider's schema for
-        the given ``subtype``.
+        the given ``subtype``. If there is a deadband or rate
+        policy for ``subtype`` the packet may be dropped or
+        delayed, unless ``ack`` is ``True``.
 
         Args:
             subtype (str): The sensor packet subtype
             data: The sensor packet data
+            ack (bool): Whether the server should acknowledge the packet
 
-        :returns: :class:`Provider <Provider>`
+        :returns: :class:`Provider <Provider>` or a :class:`Future
+            <heimdallr_client.futures.Future>` if ``ack`` is ``True``
         """
 
-        self._emit_queue.put((
-            'sensor',
-            {'subtype': subtype, 'data': data, 't': timestamp()}
-        ))
+        policy = self.rate_policies.get(subtype)
+        deadband = self.deadbands.get(subtype)
+        if ack or (policy is None and deadband is None):
+            self._send_sensor(subtype, data, ack)
+            return
+
+        # The deadband sees only the samples that go out, so it always
+        # compares with the last one that was actually sent
+        send = partial(self._send_sensor, subtype)
+        if deadband is not None:
+            send = partial(deadband.admit, send=send)
+        if policy is not None:
+            policy.admit(data, send)
+        else:
+            send(data)
+
+    def _send_sensor(self, subtype, data, ack=False):
+        self._emit('sensor', self._packet(subtype, data), ack=ack or None)
 
-    def send_stream(self, data):
+    def send_stream(self, data, codec=None):
         """ Send binary data to the Heimdallr server.
 
         This should only be used when the Heimdallr server
@@ -348,14 +1197,19 @@ class Provider(Client):
 
         Args:
             data: The binary data to be sent.
+            codec (str): Codec to compress the data with. Defaults to the
+                provider's ``stream_codec``.
 
         :returns: :class:`Provider <Provider>`
         """
 
-        self._emit_queue.put((
+        codec = codec or self.stream_codec
+        if codec is not None:
+            data = streams.encode_chunk(data, codec)
+        self._emit(
             'stream',
             bytearray(data)
-        ))
+        )
 
     def completed(self, uuid):
         """ Signal the Heimdallr server that a control has been completed.
@@ -370,10 +1224,11 @@ class Provider(Client):
         :returns: :class:`Provider <Provider>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'event',
-            {'subtype': 'completed', 'data': uuid, 't': timestamp()}
-        ))
+            {'subtype': 'completed', 'data': uuid, 't': timestamp()},
+            lane='control'
+        )
 
 
 @for_own_methods(on_ready)
@@ -383,11 +1238,138 @@ class Consumer(Client):
     It inherits most of its functionality but it also
     automatically connects to the consumer namespace and
     provides some convenience functions.
+
+    With ``auto_filter`` the consumer sets the filter of every provider
+    it subscribes to from its listeners, so the server only sends the
+    ``event`` and ``sensor`` subtypes that something listens for.
+    Listeners added with a ``subtype`` (see :meth:`Client.on
+    <Client.on>`) contribute their subtype, for all providers or just
+    the one they are restricted to. A packet type without any listeners
+    is filtered out completely and one with a listener for every subtype
+    isn't filtered. When listeners change, the filters that changed as a
+    result are sent again after ``filter_delay`` seconds, so a burst of
+    changes is sent as one batch. Providers whose filter is set with
+    :meth:`set_filter` are left alone. Once nothing is left to filter, a
+    filter without any packet types is sent to lift the last one. The
+    filters that were last sent are kept in :attr:`auto_filters`.
+
+    Controls sent with ``completion=True`` are tracked in
+    :attr:`controls`, a :class:`ControlTable
+    <heimdallr_client.controls.ControlTable>`, until the provider
+    completes them. The table also keeps the time the provider took to
+    complete them per subtype.
+
+    Fragmented events are put back together by :attr:`fragments`, a
+    :class:`Reassembler <heimdallr_client.fragments.Reassembler>`.
+    Filters set with :meth:`set_filter` have to let ``fragment`` events
+    through for large events to arrive.
+
+    Args:
+        token (str): Authentication token
+        auto_filter (bool): Whether to derive filters from the listeners
+        filter_delay (float): Seconds to wait for more listener changes
+            before sending changed filters
+        kwargs: Passed to :class:`Client <Client>`
     """
 
     _namespace = '/consumer'
+    _filtered = ('event', 'sensor')
+
+    def __init__(self, token, auto_filter=False, filter_delay=0.05,
+                 **kwargs):
+        self.auto_filter = auto_filter
+        self.filter_delay = filter_delay
+        self.auto_filters = {}
+        self._subscribed = set()
+        self._manual_filters = set()
+        self._dirty_filters = set()
+        self._filter_lock = Lock()
+        self._filter_timer = None
+        self.controls = controls.ControlTable()
+        self._completed_listener = False
+        self.fragments = fragments.Reassembler(
+            lazy_packets=kwargs.get('lazy_packets', False)
+        )
+        Client.__init__(self, token, **kwargs)
+
+    def _derive_filter(self, uuid):
+        """ Build the smallest filter that serves the listeners of ``uuid``.
+
+        Returns:
+            dict: ``setFilter`` payload, or ``None`` if no packet type
+            can be filtered
+        """
 
-    def send_control(self, uuid, subtype, data=None, persistent=False):
+        filter_ = {}
+        for packet_type in self._filtered:
+            dispatcher = self._subtype_dispatchers.get(packet_type)
+            if any(callback is not dispatcher
+                   for callback in self.callbacks.get(packet_type, [])):
+                continue
+            filter_[packet_type] = sorted(set(
+                subtype
+                for (message_name, subtype), listeners
+                in self.subtype_callbacks.iteritems()
+                if message_name == packet_type and
+                any(provider in (None, uuid) for provider, _ in listeners)
+            ))
+        if filter_.get('event'):
+            # Large events arrive in fragments
+            filter_['event'] = sorted(
+                set(filter_['event']) | set([FRAGMENT_SUBTYPE])
+            )
+        if not filter_:
+            return None
+        filter_['provider'] = uuid
+        return filter_
+
+    def _listeners_changed(self, message_name, provider):
+        if not self.auto_filter or message_name not in self._filtered:
+            return
+        with self._filter_lock:
+            if provider is None:
+                self._dirty_filters.update(self._subscribed)
+            elif provider in self._subscribed:
+                self._dirty_filters.add(provider)
+            self._schedule_filters()
+
+    def _schedule_filters(self):
+        if self._filter_timer is None and self._dirty_filters:
+            self._filter_timer = Timer(self.filter_delay, self._push_filters)
+            self._filter_timer.daemon = True
+            self._filter_timer.start()
+
+    def _push_filters(self):
+        """ Send the derived filters that changed since they were last sent.
+        """
+
+        with self._filter_lock:
+            self._filter_timer = None
+            dirty, self._dirty_filters = self._dirty_filters, set()
+            changed = []
+            for uuid in sorted(dirty):
+                if uuid not in self._subscribed or \
+                        uuid in self._manual_filters:
+                    continue
+                filter_ = self._derive_filter(uuid)
+                if filter_ is None:
+                    # Lift a filter that was sent before, leaving out every
+                    # packet type
+                    if self.auto_filters.pop(uuid, None) is not None:
+                        changed.append({'provider': uuid})
+                    continue
+                if filter_ == self.auto_filters.get(uuid):
+                    continue
+                self.auto_filters[uuid] = filter_
+                changed.append(filter_)
+
+        if self.closed:
+            return
+        for filter_ in changed:
+            self._emit('setFilter', dict(filter_))
+
+    def send_control(self, uuid, subtype, data=None, persistent=False,
+                     ack=False, completion=False, timeout=CONTROL_TIMEOUT):
         """ Emit a Heimdallr control packet.
 
         This will send a control to the provider specified by
@@ -398,24 +1380,69 @@ class Consumer(Client):
         provider signals the Heimdallr server that it has
         completed the control.
 
+        With ``completion`` the control is made persistent under a
+        generated id, which the provider passes to :meth:`Provider.completed
+        <Provider.completed>`, and the returned future is resolved with the
+        ``completed`` event packet. If the control isn't completed within
+        ``timeout`` seconds the future fails with
+        :class:`HeimdallrTimeoutError
+        <heimdallr_client.exceptions.HeimdallrTimeoutError>`, and if the
+        consumer is closed first it fails with
+        :class:`HeimdallrClientException
+        <heimdallr_client.exceptions.HeimdallrClientException>`.
+
         Args:
             uuid (str): UUID of the provider to send the control packet to
             subtype (str): The control packet subtype
             data: The control packet data
             persistent (bool): Whether or not the control should persist
-            
-        :returns: :class:`Consumer <Consumer>`
+            ack (bool): Whether the server should acknowledge the packet
+            completion (bool): Whether to wait for the provider to complete
+                the control
+            timeout (float): Seconds to wait for the provider to complete
+                the control, or ``None`` to wait forever
+
+        :returns: :class:`Consumer <Consumer>` or a :class:`Future
+            <heimdallr_client.futures.Future>` if ``ack`` or ``completion``
+            is ``True``, or an ``(ack, completion)`` tuple of futures if
+            both are
+
+        **Usage:**
+
+        .. code-block:: python
+
+            from threading import Event
+            event = Event()
+            done = consumer.send_control(uuid, 'move', {'x': 1},
+                                         completion=True, timeout=10)
+            done.add_done_callback(lambda future: event.set())
+            consumer.run(event=event)
+            done.result()  # The provider's 'completed' event packet
         """
 
-        self._emit_queue.put((
+        if completion:
+            persistent = uuids.uuid4().hex
+            if not self._completed_listener:
+                self._completed_listener = True
+                self.on('event', self._on_completed, subtype='completed')
+            self.controls.add(persistent, completion, uuid, subtype, timeout)
+
+        self._emit(
             'control',
             {
                 'provider': uuid,
                 'subtype': subtype,
                 'data': data,
                 'persistent': persistent
-            }
-        ))
+            },
+            ack=ack or None
+        )
+
+    def _on_completed(self, packet):
+        self.controls.complete(packet.get('data'), packet)
+
+    def _closing(self):
+        self.controls.fail_all('Client was closed')
 
     def subscribe(self, uuid):
         """ Subscribe to a provider.
@@ -430,10 +1457,16 @@ class Consumer(Client):
         :returns: :class:`Consumer <Consumer>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'subscribe',
             {'provider': uuid}
-        ))
+        )
+        if self.auto_filter:
+            with self._filter_lock:
+                self._subscribed.add(uuid)
+                self.auto_filters.pop(uuid, None)
+                self._dirty_filters.add(uuid)
+                self._schedule_filters()
 
     def unsubscribe(self, uuid):
         """ Unsubscribe from a provider.
@@ -450,10 +1483,13 @@ class Consumer(Client):
         :returns: :class:`Consumer <Consumer>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'unsubscribe',
             {'provider': uuid}
-        ))
+        )
+        with self._filter_lock:
+            self._subscribed.discard(uuid)
+            self.auto_filters.pop(uuid, None)
 
     def set_filter(self, uuid, filter_):
         """ Control which event and sensor subtypes to hear from provider.
@@ -462,7 +1498,8 @@ class Consumer(Client):
         `filter` should be a dictionary with the keys `event` and/or
         `sensor`. The value of those fields should be an array of
         strings of the subtypes that you want to hear for the
-        provider given by `uuid`.
+        provider given by `uuid`. With ``auto_filter``, filters are no
+        longer derived for this provider.
 
         Args:
             uuid (str): UUID of the provider to filter packets from
@@ -473,10 +1510,13 @@ class Consumer(Client):
         """
 
         filter_['provider'] = uuid
-        self._emit_queue.put((
+        with self._filter_lock:
+            self._manual_filters.add(uuid)
+            self.auto_filters.pop(uuid, None)
+        self._emit(
             'setFilter',
             filter_
-        ))
+        )
 
     def get_state(self, uuid, subtypes):
         """ Get the current state of a provider.
@@ -492,10 +1532,10 @@ class Consumer(Client):
         :returns: :class:`Consumer <Consumer>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'getState',
             {'provider': uuid, 'subtypes': subtypes}
-        ))
+        )
 
     def join_stream(self, uuid):
         """ Join binary data stream from a provider.
@@ -503,6 +1543,9 @@ class Consumer(Client):
         If this is the first consumer to join the stream of
         a provider, the Heimdallr server will send a
         ``{'stream': 'start'}`` control packet to the provider.
+        Stream data the provider compressed is decompressed before
+        ``stream`` listeners are called. Chunks that can't be
+        decompressed here are dropped.
 
         Args:
             uuid (str): UUID of the provider to join the stream of
@@ -510,10 +1553,10 @@ class Consumer(Client):
         :returns: :class:`Consumer <Consumer>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'joinStream',
             {'provider': uuid}
-        ))
+        )
 
     def leave_stream(self, uuid):
         """ Leave binary data stream for a provider.
@@ -530,7 +1573,7 @@ class Consumer(Client):
         :returns: :class:`Consumer <Consumer>`
         """
 
-        self._emit_queue.put((
+        self._emit(
             'leaveStream',
             {'provider': uuid}
-        ))
\ No newline at end of file
+        )
\ No newline at end of file
@@ -0,0 +1,410 @@
+from threading import RLock
+
+from clients import Provider, Consumer
+from exceptions import HeimdallrClientException
+from hashring import HashRing
+from settings import CLUSTER_MAX_CONSUMERS, CLUSTER_PROVIDERS_PER_CONSUMER
+
+__all__ = ['ClusterClient']
+
+
+class _Node(object):
+    """ The connections a :class:`ClusterClient` has open to one node. """
+
+    def __init__(self, url):
+        self.url = url
+        self.providers = {}
+        # Subscribed provider UUIDs by consumer
+        self.consumers = {}
+
+
+class ClusterClient(object):
+    """
+    Spreads provider and consumer connections across Heimdallr nodes.
+
+    Every provider UUID is placed on one of the server ``nodes`` by
+    consistent hashing. :meth:`provider` opens the provider's own
+    connection on its node and :meth:`subscribe` subscribes to it through
+    a consumer connection on that node. The consumers of a node form a
+    pool of at most ``max_consumers`` connections; a subscription goes
+    to the least loaded one, and a new connection is only opened once
+    every open one carries ``providers_per_consumer`` providers.
+
+    When nodes join or leave with :meth:`add_node` and :meth:`remove_node`
+    only the providers whose hash segment changes owner move: their
+    provider connection is reconnected to the new node, keeping its
+    listeners and queued packets, and their subscription, with its
+    filter, moves to a consumer there. Consumers left without
+    subscriptions are closed.
+
+    Listeners added with :meth:`on` are added to every consumer, current
+    and future. After :meth:`start` every connection receives packets on
+    a :class:`ReceiveLoop <heimdallr_client.loop.ReceiveLoop>`.
+
+    Args:
+        token (str): Authentication token of the consumers, and of the
+            providers unless they are given their own
+        nodes (list): URLs of the server nodes
+        max_consumers (int): Consumer connections per node
+        providers_per_consumer (int): Subscriptions a consumer takes
+            before another one is opened on its node
+        replicas (int): Positions per node on the hash ring
+        connect_kwargs (dict): Passed to each client's :meth:`connect
+            <heimdallr_client.clients.Client.connect>`
+        provider_factory (function): Creates a provider from a token and
+            ``url``
+        consumer_factory (function): Creates a consumer from a token and
+            ``url``
+
+    **Usage:**
+
+    .. code-block:: python
+
+        with ClusterClient(token, ['https://a:3000', 'https://b:3000']) \\
+                as cluster:
+            cluster.on('sensor', handle)
+            for uuid in uuids:
+                cluster.subscribe(uuid, {'sensor': ['imu']})
+            cluster.start()
+            cluster.add_node('https://c:3000')  # Moves about a third
+    """
+
+    def __init__(self, token, nodes, max_consumers=CLUSTER_MAX_CONSUMERS,
+                 providers_per_consumer=CLUSTER_PROVIDERS_PER_CONSUMER,
+                 replicas=100, connect_kwargs=None, provider_factory=Provider,
+                 consumer_factory=Consumer):
+        self.token = token
+        self.max_consumers = max_consumers
+        self.providers_per_consumer = providers_per_consumer
+        self.connect_kwargs = connect_kwargs or {}
+        self.provider_factory = provider_factory
+        self.consumer_factory = consumer_factory
+        self.ring = HashRing(replicas=replicas)
+        self.nodes = {}
+        self._filters = {}
+        self._consumer_by_provider = {}
+        self._listeners = []
+        self._loop = None
+        self._started = False
+        self._lock = RLock()
+        for node in nodes:
+            self.add_node(node)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def node_for(self, uuid):
+        """ Find the node a provider is placed on.
+
+        Args:
+            uuid (str): UUID of the provider
+
+        Returns:
+            str: URL of the node
+        """
+
+        return self.ring.get(uuid)
+
+    def provider(self, uuid, token=None, **kwargs):
+        """ Get the connection of a provider, opening it on its node.
+
+        Args:
+            uuid (str): UUID of the provider
+            token (str): Token of the provider. Defaults to the cluster's.
+            **kwargs: Passed to ``provider_factory``
+
+        Returns:
+            :class:`Provider <heimdallr_client.clients.Provider>`: The
+            connected provider
+        """
+
+        with self._lock:
+            node = self._node(uuid)
+            provider = node.providers.get(uuid)
+            if provider is None:
+                provider = node.providers[uuid] = self.provider_factory(
+                    token or self.token, url=node.url, **kwargs
+                )
+                self._open(provider)
+            return provider
+
+    def remove_provider(self, uuid):
+        """ Close the connection of a provider.
+
+        Args:
+            uuid (str): UUID of the provider
+        """
+
+        with self._lock:
+            for node in self.nodes.itervalues():
+                provider = node.providers.pop(uuid, None)
+                if provider is not None:
+                    provider.close()
+
+    def subscribe(self, uuid, filter_=None):
+        """ Subscribe to a provider through a consumer on its node.
+
+        Args:
+            uuid (str): UUID of the provider
+            filter_ (dict): Filter to set for the provider, as for
+                :meth:`Consumer.set_filter
+                <heimdallr_client.clients.Consumer.set_filter>`
+
+        Returns:
+            :class:`Consumer <heimdallr_client.clients.Consumer>`: The
+            consumer subscribed to the provider
+        """
+
+        with self._lock:
+            self._filters[uuid] = filter_
+            consumer = self._consumer_by_provider.get(uuid)
+            if consumer is None:
+                consumer = self._place(uuid)
+            elif filter_:
+                consumer.set_filter(uuid, dict(filter_))
+            return consumer
+
+    def unsubscribe(self, uuid):
+        """ Unsubscribe from a provider.
+
+        Args:
+            uuid (str): UUID of the provider
+        """
+
+        with self._lock:
+            self._filters.pop(uuid, None)
+            self._release(uuid)
+
+    def consumer_for(self, uuid):
+        """ Find the consumer subscribed to a provider.
+
+        Args:
+            uuid (str): UUID of the provider
+
+        Returns:
+            :class:`Consumer <heimdallr_client.clients.Consumer>`: The
+            consumer or ``None`` if the provider isn't subscribed to
+        """
+
+        return self._consumer_by_provider.get(uuid)
+
+    def send_control(self, uuid, *args, **kwargs):
+        """ Send a control through the consumer subscribed to a provider.
+
+        Takes the arguments of :meth:`Consumer.send_control
+        <heimdallr_client.clients.Consumer.send_control>`.
+
+        Raises:
+            HeimdallrClientException: If the provider isn't subscribed to
+        """
+
+        consumer = self.consumer_for(uuid)
+        if consumer is None:
+            raise HeimdallrClientException('Not subscribed to %s' % uuid)
+        return consumer.send_control(uuid, *args, **kwargs)
+
+    def on(self, message_name, callback, subtype=None, provider=None):
+        """ Listen on every consumer, as :meth:`Client.on
+        <heimdallr_client.clients.Client.on>` does on one.
+        """
+
+        with self._lock:
+            listener = (message_name, callback, subtype, provider)
+            self._listeners.append(listener)
+            for consumer in self._consumers():
+                consumer.on(*listener)
+
+    def remove_listener(self, message_name, callback=None, subtype=None,
+                        provider=None):
+        """ Stop listening on every consumer, as
+        :meth:`Client.remove_listener
+        <heimdallr_client.clients.Client.remove_listener>` does on one.
+        """
+
+        with self._lock:
+            listener = (message_name, callback, subtype, provider)
+            self._listeners = [l for l in self._listeners if l != listener]
+            for consumer in self._consumers():
+                consumer.remove_listener(*listener)
+
+    def add_node(self, url):
+        """ Add a node and move its share of the providers to it.
+
+        Args:
+            url (str): URL of the node
+
+        Returns:
+            list: UUIDs of the providers that moved
+        """
+
+        with self._lock:
+            if url in self.nodes:
+                return []
+            self.nodes[url] = _Node(url)
+            self.ring.add(url)
+            return self._rebalance()
+
+    def remove_node(self, url):
+        """ Move a node's providers to the other nodes and disconnect it.
+
+        Args:
+            url (str): URL of the node
+
+        Returns:
+            list: UUIDs of the providers that moved
+        """
+
+        with self._lock:
+            if url not in self.nodes:
+                return []
+            self.ring.remove(url)
+            moved = self._rebalance()
+            node = self.nodes.pop(url)
+            # Left behind only when no node is left to move them to
+            for client in node.providers.values() + node.consumers.keys():
+                client.close()
+            return moved
+
+    def start(self, loop=None):
+        """ Receive packets for every connection in the background.
+
+        Args:
+            loop (:class:`ReceiveLoop <heimdallr_client.loop.ReceiveLoop>`):
+                Loop to receive packets on. Defaults to the process-wide
+                loop.
+        """
+
+        with self._lock:
+            self._started = True
+            self._loop = loop
+            for client in self._clients():
+                client.start(loop)
+
+    def stop(self):
+        """ Stop receiving packets in the background. """
+
+        with self._lock:
+            self._started = False
+            for client in self._clients():
+                client.stop()
+
+    def close(self):
+        """ Close every connection. """
+
+        with self._lock:
+            for client in self._clients():
+                client.close()
+            for node in self.nodes.itervalues():
+                node.providers.clear()
+                node.consumers.clear()
+            self._consumer_by_provider.clear()
+
+    def stats(self):
+        """ Summarize the connections.
+
+        Returns:
+            dict: Number of ``providers``, ``consumers`` and
+            ``subscriptions`` by node URL
+        """
+
+        with self._lock:
+            return dict(
+                (url, {
+                    'providers': len(node.providers),
+                    'consumers': len(node.consumers),
+                    'subscriptions': sum(
+                        len(uuids) for uuids in node.consumers.itervalues()
+                    )
+                })
+                for url, node in self.nodes.iteritems()
+            )
+
+    def _node(self, uuid):
+        url = self.ring.get(uuid)
+        if url is None:
+            raise HeimdallrClientException('The cluster has no nodes')
+        return self.nodes[url]
+
+    def _consumers(self):
+        for node in self.nodes.itervalues():
+            for consumer in node.consumers:
+                yield consumer
+
+    def _clients(self):
+        for node in self.nodes.values():
+            for client in node.providers.values() + node.consumers.keys():
+                yield client
+
+    def _open(self, client):
+        client.connect(**self.connect_kwargs)
+        if self._started:
+            client.start(self._loop)
+
+    def _place(self, uuid):
+        """ Subscribe to ``uuid`` on the least loaded consumer of its node.
+        """
+
+        node = self._node(uuid)
+        consumer = None
+        if node.consumers:
+            consumer = min(
+                node.consumers, key=lambda c: len(node.consumers[c])
+            )
+            if len(node.consumers[consumer]) >= \
+                    self.providers_per_consumer and \
+                    len(node.consumers) < self.max_consumers:
+                consumer = None
+        if consumer is None:
+            consumer = self.consumer_factory(self.token, url=node.url)
+            for listener in self._listeners:
+                consumer.on(*listener)
+            node.consumers[consumer] = set()
+            self._open(consumer)
+
+        node.consumers[consumer].add(uuid)
+        self._consumer_by_provider[uuid] = consumer
+        consumer.subscribe(uuid)
+        filter_ = self._filters.get(uuid)
+        if filter_:
+            consumer.set_filter(uuid, dict(filter_))
+        return consumer
+
+    def _release(self, uuid):
+        """ Unsubscribe from ``uuid``, closing its consumer if left idle. """
+
+        consumer = self._consumer_by_provider.pop(uuid, None)
+        if consumer is None:
+            return
+        consumer.unsubscribe(uuid)
+        for node in self.nodes.itervalues():
+            uuids = node.consumers.get(consumer)
+            if uuids is not None:
+                uuids.discard(uuid)
+                if not uuids:
+                    del node.consumers[consumer]
+                    consumer.close()
+
+    def _rebalance(self):
+        moved = set()
+        for node in self.nodes.values():
+            for uuid, provider in node.providers.items():
+                target = self.ring.get(uuid)
+                if target == node.url or target is None:
+                    continue
+                del node.providers[uuid]
+                self.nodes[target].providers[uuid] = provider
+                provider.stop()
+                provider._url = target
+                self._open(provider)
+                moved.add(uuid)
+
+        for uuid, consumer in self._consumer_by_provider.items():
+            if consumer._url != self.ring.get(uuid):
+                self._release(uuid)
+                if self.ring.get(uuid) is not None:
+                    self._place(uuid)
+                moved.add(uuid)
+        return sorted(moved)
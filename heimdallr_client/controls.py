@@ -0,0 +1,363 @@
+import heapq
+import json
+import os
+from collections import OrderedDict
+from functools import partial
+from threading import Condition, Lock, Thread
+from time import time
+
+from exceptions import HeimdallrClientException, HeimdallrTimeoutError
+from futures import Future
+from stats import Histogram
+
+__all__ = ['ControlTable', 'ControlRegistry', 'IN_PROGRESS', 'COMPLETED']
+
+IN_PROGRESS = 'in-progress'
+COMPLETED = 'completed'
+
+
+class ControlTable(object):
+    """
+    Tracks controls that are waiting for their provider to complete them.
+
+    Controls are indexed by id, so completing one costs the same however
+    many are outstanding, and their deadlines are kept in a heap that a
+    single thread works through, so thousands of controls can be in
+    flight without a timer each. The thread stops while no control has a
+    deadline. A control that isn't completed by its
+    deadline fails with :class:`HeimdallrTimeoutError
+    <heimdallr_client.exceptions.HeimdallrTimeoutError>`. The time until
+    each control is completed is recorded per subtype in :attr:`latency`.
+    """
+
+    def __init__(self):
+        self.latency = {}
+        self._pending = {}
+        self._deadlines = []
+        self._condition = Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, control_id):
+        return control_id in self._pending
+
+    def add(self, control_id, future, provider, subtype, timeout=None):
+        """ Start tracking a control.
+
+        Args:
+            control_id (str): Id the provider will complete the control with
+            future (:class:`Future <heimdallr_client.futures.Future>`):
+                Future to resolve when the control is completed
+            provider (str): UUID of the provider the control was sent to
+            subtype (str): The control subtype
+            timeout (float): Seconds to wait for the control to be completed
+        """
+
+        with self._condition:
+            self._pending[control_id] = (future, time(), provider, subtype)
+            if timeout is not None:
+                heapq.heappush(self._deadlines, (time() + timeout, control_id))
+                if self._thread is None:
+                    self._thread = Thread(
+                        target=self._expire, name='heimdallr-controls'
+                    )
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._condition.notify()
+
+    def complete(self, control_id, result=None):
+        """ Resolve a control's future.
+
+        Args:
+            control_id (str): Id of the completed control
+            result: Value to resolve the future with
+
+        Returns:
+            bool: ``False`` if the control wasn't being tracked
+        """
+
+        with self._condition:
+            entry = self._pending.pop(control_id, None)
+            if not self._pending and self._deadlines:
+                # Let the timeout thread stop instead of waiting out the
+                # deadlines of completed controls
+                self._deadlines = []
+                self._condition.notify()
+        if entry is None:
+            return False
+        future, sent, provider, subtype = entry
+        histogram = self.latency.get(subtype)
+        if histogram is None:
+            histogram = self.latency.setdefault(subtype, Histogram())
+        histogram.record(time() - sent)
+        future.set_result(result)
+        return True
+
+    def fail_all(self, message):
+        """ Fail every tracked control.
+
+        Args:
+            message (str): Message of the exception the futures fail with
+        """
+
+        with self._condition:
+            pending, self._pending = self._pending, {}
+            self._deadlines = []
+            self._condition.notify()
+        for future, _, _, _ in pending.itervalues():
+            future.set_exception(HeimdallrClientException(message))
+
+    def pending(self, provider=None):
+        """ List the ids of tracked controls.
+
+        Args:
+            provider (str): Only list controls sent to this provider
+
+        Returns:
+            list: Control ids
+        """
+
+        with self._condition:
+            return [
+                control_id
+                for control_id, entry in self._pending.iteritems()
+                if provider is None or entry[2] == provider
+            ]
+
+    def _expire(self):
+        while True:
+            with self._condition:
+                if not self._deadlines:
+                    self._thread = None
+                    return
+                deadline, control_id = self._deadlines[0]
+                delay = deadline - time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._deadlines)
+                entry = self._pending.pop(control_id, None)
+
+            if entry is not None:
+                entry[0].set_exception(HeimdallrTimeoutError(
+                    'Control %s was not completed in time' % control_id
+                ))
+
+
+class ControlRegistry(object):
+    """
+    Runs each persistent control on a provider once, however often it is
+    delivered.
+
+    The server delivers a persistent control again every time the
+    provider connects until the provider sends :meth:`completed
+    <heimdallr_client.clients.Provider.completed>` for its uuid, so a
+    flapping connection can deliver the same control many times.
+    Handlers registered with :meth:`on` are only called the first time a
+    persistent control is delivered; later deliveries are counted in
+    :attr:`duplicates` and dropped. Once a handler returns, or the
+    :class:`Future <heimdallr_client.futures.Future>` it returns is
+    resolved, the control is marked completed and ``completed`` is sent.
+    A delivery of a control that is already completed sends
+    ``completed`` again, since the server evidently missed it. If the
+    handler raises, or its future fails, the control is forgotten so its
+    next delivery runs it again. Controls that aren't persistent are
+    passed straight to their handler.
+
+    The states of the last ``capacity`` controls are kept in memory.
+    With a ``journal`` path, state changes are also appended to that
+    file and loaded again on start, so controls that completed before a
+    restart aren't run again. Controls that were still in progress are
+    run again, since their handler may not have finished. The journal is
+    compacted once it holds twice as many entries as the registry.
+
+    Args:
+        provider (:class:`Provider <heimdallr_client.clients.Provider>`):
+            Provider whose controls to handle
+        capacity (int): Number of control states kept
+        journal (str): File to keep the completed controls in
+
+    **Usage:**
+
+    .. code-block:: python
+
+        registry = ControlRegistry(provider, journal='controls.journal')
+
+        @registry.on('move')
+        def move(packet):
+            robot.move(**packet['data'])  # Runs once per control
+    """
+
+    def __init__(self, provider, capacity=1024, journal=None):
+        self.provider = provider
+        self.capacity = capacity
+        self.journal = journal
+        self.duplicates = 0
+        self._states = OrderedDict()
+        self._handlers = {}
+        self._lock = Lock()
+        self._journal = None
+        self._entries = 0
+        if journal is not None:
+            self._load()
+            self._compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._states)
+
+    def on(self, subtype, handler=None):
+        """ Handle the controls of ``subtype`` through the registry.
+
+        Can be used as a decorator when ``handler`` is left out.
+
+        Args:
+            subtype (str): The control subtype
+            handler (function): Called with the control packet
+        """
+
+        # Decorator syntax
+        if handler is None:
+            def decorator(fn):
+                self.on(subtype, fn)
+                return fn
+            return decorator
+
+        listener = self._handlers[(subtype, handler)] = partial(
+            self._handle, handler
+        )
+        self.provider.on('control', listener, subtype=subtype)
+
+    def remove_listener(self, subtype, handler):
+        """ Stop handling the controls of ``subtype`` with ``handler``.
+
+        Args:
+            subtype (str): The control subtype
+            handler (function): Handler passed to :meth:`on`
+        """
+
+        listener = self._handlers.pop((subtype, handler), None)
+        if listener is not None:
+            self.provider.remove_listener('control', listener, subtype=subtype)
+
+    def state(self, uuid):
+        """ State of a persistent control.
+
+        Args:
+            uuid (str): UUID of the control
+
+        Returns:
+            str: :data:`IN_PROGRESS`, :data:`COMPLETED` or ``None`` if the
+            control isn't known
+        """
+
+        return self._states.get(uuid)
+
+    def close(self):
+        """ Stop handling controls and close the journal. """
+
+        for subtype, handler in self._handlers.keys():
+            self.remove_listener(subtype, handler)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _handle(self, handler, packet):
+        uuid = packet.get('persistent')
+        if not uuid or not isinstance(uuid, basestring):
+            handler(packet)
+            return
+
+        with self._lock:
+            state = self._states.get(uuid)
+            if state is None:
+                self._set(uuid, IN_PROGRESS)
+            else:
+                self.duplicates += 1
+                self._states[uuid] = self._states.pop(uuid)
+        if state == COMPLETED:
+            self.provider.completed(uuid)
+        if state is not None:
+            return
+
+        try:
+            result = handler(packet)
+        except Exception:
+            self._forget(uuid)
+            raise
+        if isinstance(result, Future):
+            result.add_done_callback(partial(self._resolved, uuid))
+        else:
+            self._complete(uuid)
+
+    def _resolved(self, uuid, future):
+        if future.exception() is None:
+            self._complete(uuid)
+        else:
+            self._forget(uuid)
+
+    def _complete(self, uuid):
+        with self._lock:
+            self._set(uuid, COMPLETED)
+        self.provider.completed(uuid)
+
+    def _forget(self, uuid):
+        with self._lock:
+            if self._states.pop(uuid, None) is not None:
+                self._write(None, uuid)
+
+    def _set(self, uuid, state):
+        self._states.pop(uuid, None)
+        self._states[uuid] = state
+        self._write(state, uuid)
+        if len(self._states) > self.capacity:
+            # Evict the least recently delivered control that isn't running
+            for old, old_state in self._states.iteritems():
+                if old_state == COMPLETED:
+                    del self._states[old]
+                    break
+
+    def _write(self, state, uuid):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps([state, uuid]) + '\n')
+        self._journal.flush()
+        self._entries += 1
+        if self._entries > 2 * self.capacity:
+            self._compact()
+
+    def _load(self):
+        if not os.path.exists(self.journal):
+            return
+        with open(self.journal) as journal:
+            for line in journal:
+                try:
+                    state, uuid = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash
+                    continue
+                self._states.pop(uuid, None)
+                if state == COMPLETED:
+                    self._states[uuid] = state
+        while len(self._states) > self.capacity:
+            self._states.popitem(last=False)
+
+    def _compact(self):
+        if self._journal is not None:
+            self._journal.close()
+        path = self.journal + '.tmp'
+        with open(path, 'w') as journal:
+            for uuid, state in self._states.iteritems():
+                if state == COMPLETED:
+                    journal.write(json.dumps([state, uuid]) + '\n')
+        os.rename(path, self.journal)
+        self._journal = open(self.journal, 'a')
+        self._entries = len(self._states)
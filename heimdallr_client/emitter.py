@@ -0,0 +1,146 @@
+import os
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from exceptions import HeimdallrClientException
+from settings import EMIT_WORKERS, EMIT_QUANTUM
+
+__all__ = ['EmitExecutor', 'default_executor']
+
+
+class EmitExecutor(object):
+    """
+    A fixed pool of threads that sends queued packets for many clients.
+
+    Clients hand themselves to the executor with :meth:`submit` whenever
+    they queue a packet. Clients with pending packets are served round
+    robin: a worker sends at most ``quantum`` packets for a client before
+    moving it to the back of the line, so one busy client can't starve
+    the others. A client is only ever drained by one worker at a time,
+    which keeps its packets in order.
+
+    The executor can be used as a context manager, in which case it is
+    closed on exit.
+
+    Args:
+        workers (int): Number of sending threads
+        quantum (int): Packets sent for a client before the next one is
+            served
+    """
+
+    def __init__(self, workers=EMIT_WORKERS, quantum=EMIT_QUANTUM):
+        self.quantum = quantum
+        self.closed = False
+        self._ready = deque()
+        self._scheduled = set()
+        self._condition = Condition()
+        self._threads = []
+
+        for i in range(workers):
+            thread = Thread(target=self._work, name='heimdallr-emit-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, client):
+        """ Schedule ``client`` to have its queued packets sent.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Client with packets waiting in its emit queue
+        """
+
+        with self._condition:
+            if self.closed:
+                raise HeimdallrClientException('EmitExecutor is closed')
+            if client in self._scheduled:
+                return
+            self._scheduled.add(client)
+            self._ready.append(client)
+            self._condition.notify()
+
+    def discard(self, client):
+        """ Stop serving ``client``.
+
+        Packets that ``client`` still has queued will not be sent.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Client to remove from the schedule
+        """
+
+        with self._condition:
+            self._scheduled.discard(client)
+            try:
+                self._ready.remove(client)
+            except ValueError:
+                pass
+
+    def close(self, timeout=None):
+        """ Send the packets that are already scheduled and stop the workers.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to finish
+        """
+
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self.closed:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                client = self._ready.popleft()
+
+            try:
+                client._emit_task(self.quantum)
+            except Exception as e:
+                print (
+                    'HeimdallrClient failed to send. Original exception: %s'
+                    % e
+                )
+
+            with self._condition:
+                if client not in self._scheduled:
+                    continue
+                if client._emit_pending():
+                    self._ready.append(client)
+                    self._condition.notify()
+                else:
+                    self._scheduled.discard(client)
+
+
+_default = {}
+_default_lock = Lock()
+
+
+def default_executor():
+    """ Get the process-wide :class:`EmitExecutor`.
+
+    The executor is created on first use and recreated if it has been
+    closed or the process has forked, since a child process doesn't
+    inherit the parent's threads.
+
+    Returns:
+        :class:`EmitExecutor`: The shared executor
+    """
+
+    with _default_lock:
+        executor = _default.get('executor')
+        if executor is None or executor.closed or \
+                _default.get('pid') != os.getpid():
+            executor = _default['executor'] = EmitExecutor()
+            _default['pid'] = os.getpid()
+        return executor
@@ -0,0 +1,145 @@
+from threading import Lock
+from time import time
+
+from settings import ENDPOINT_COOLDOWN
+
+__all__ = ['Endpoint', 'EndpointPool']
+
+
+class Endpoint(object):
+    """
+    A Heimdallr server a client can connect to.
+
+    Args:
+        url (str): URL of the server
+        auth_source (str): Authentication source to use with the server,
+            or ``None`` for the client's own
+    """
+
+    def __init__(self, url, auth_source=None):
+        self.url = url
+        self.auth_source = auth_source
+        self.latency = None
+        self.failures = 0
+        self.down_until = 0.0
+
+    def __repr__(self):
+        return 'Endpoint(%r, latency=%r, failures=%r)' % (
+            self.url, self.latency, self.failures
+        )
+
+    @property
+    def healthy(self):
+        """ Whether the endpoint isn't cooling down after a failure. """
+
+        return self.down_until <= time()
+
+
+class EndpointPool(object):
+    """
+    Candidate servers for a client, ranked by how fast they let it in.
+
+    Each endpoint keeps a moving average of the time a connection to it
+    took to connect and authorize, in seconds. An endpoint that fails is
+    left alone for ``cooldown`` seconds, doubled for every failure in a
+    row, unless every endpoint is cooling down.
+
+    Args:
+        endpoints (list): URLs, ``(url, auth_source)`` pairs or
+            :class:`Endpoint` objects
+        cooldown (float): Seconds a failed endpoint isn't tried
+        alpha (float): Weight of a new measurement in the average
+    """
+
+    def __init__(self, endpoints, cooldown=ENDPOINT_COOLDOWN, alpha=0.3):
+        self.endpoints = []
+        for endpoint in endpoints:
+            if isinstance(endpoint, basestring):
+                endpoint = Endpoint(endpoint)
+            elif not isinstance(endpoint, Endpoint):
+                endpoint = Endpoint(*endpoint)
+            self.endpoints.append(endpoint)
+        if not self.endpoints:
+            raise ValueError('At least one endpoint is needed')
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    def unmeasured(self):
+        """ Healthy endpoints that haven't been connected to yet.
+
+        Returns:
+            list: :class:`Endpoint` objects
+        """
+
+        with self._lock:
+            return [
+                endpoint for endpoint in self.endpoints
+                if endpoint.latency is None and endpoint.healthy
+            ]
+
+    def candidates(self):
+        """ Endpoints in the order they should be tried.
+
+        Returns:
+            list: Healthy endpoints, fastest first, followed by the
+            endpoints that are cooling down, soonest available first
+        """
+
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy]
+            down = [e for e in self.endpoints if not e.healthy]
+        healthy.sort(key=lambda e: (e.latency is None, e.latency))
+        down.sort(key=lambda e: e.down_until)
+        return healthy + down
+
+    def succeeded(self, endpoint, seconds):
+        """ Record a connection that was authorized.
+
+        Args:
+            endpoint (:class:`Endpoint`): Endpoint connected to
+            seconds (float): Time to connect and authorize
+        """
+
+        with self._lock:
+            if endpoint.latency is None:
+                endpoint.latency = seconds
+            else:
+                endpoint.latency += self.alpha * (seconds - endpoint.latency)
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+
+    def failed(self, endpoint):
+        """ Record a connection that failed.
+
+        Args:
+            endpoint (:class:`Endpoint`): Endpoint that failed
+        """
+
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.down_until = time() + \
+                self.cooldown * 2 ** min(endpoint.failures - 1, 10)
+
+    def stats(self):
+        """ Summarize the endpoints.
+
+        Returns:
+            dict: ``latency``, ``failures`` and ``healthy`` by URL
+        """
+
+        with self._lock:
+            return dict(
+                (endpoint.url, {
+                    'latency': endpoint.latency,
+                    'failures': endpoint.failures,
+                    'healthy': endpoint.healthy
+                })
+                for endpoint in self.endpoints
+            )
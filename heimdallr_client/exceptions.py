@@ -4,4 +4,9 @@ class HeimdallrClientException(Exception):
     A HeimdallrClientException is raised when an error is received
     from the Heimdallr server.
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class HeimdallrTimeoutError(HeimdallrClientException):
+    """ Raised when waiting on the Heimdallr server took too long. """
+    pass
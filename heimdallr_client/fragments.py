@@ -0,0 +1,221 @@
+import json
+from collections import OrderedDict
+from time import time
+
+from packets import EventPacket, Packet, decode_packet
+from settings import FRAGMENT_SUBTYPE, FRAGMENT_TIMEOUT, \
+    FRAGMENT_MAX_EVENTS, FRAGMENT_MAX_BYTES
+from utils import lazy_import
+
+# uuid loads ctypes, which is slow to import
+uuids = lazy_import('uuid')
+
+__all__ = ['split_event', 'Reassembler']
+
+
+def split_event(subtype, data, size):
+    """ Split the data of an event into fragments.
+
+    The data is encoded as JSON and the text is cut into pieces of at
+    most ``size`` characters. Each fragment is the data of a
+    ``fragment`` event::
+
+        {'id': ..., 'subtype': 'map', 'index': 0, 'count': 3,
+         'size': 150000, 'chunk': '{"cells": [...'}
+
+    Args:
+        subtype (str): Subtype of the event
+        data: Data of the event
+        size (int): Most characters of JSON per fragment
+
+    Returns:
+        list: Data of the fragment events, or ``None`` if the JSON of
+        ``data`` fits in one fragment
+    """
+
+    text = json.dumps(data, separators=(',', ':'))
+    if len(text) <= size:
+        return None
+    id_ = uuids.uuid4().hex
+    count = (len(text) + size - 1) // size
+    return [
+        {
+            'id': id_, 'subtype': subtype, 'index': index, 'count': count,
+            'size': len(text), 'chunk': text[index * size:(index + 1) * size]
+        }
+        for index in range(count)
+    ]
+
+
+def _envelope(packet):
+    """ Get the fields of a packet other than its subtype and data. """
+
+    if isinstance(packet, Packet):
+        envelope = dict(packet.fields or {})
+        for key in ('provider', 't'):
+            if getattr(packet, key) is not None:
+                envelope[key] = getattr(packet, key)
+        return envelope
+    return dict(
+        (key, value) for key, value in packet.iteritems()
+        if key not in ('subtype', 'data')
+    )
+
+
+class _Partial(object):
+    __slots__ = ('started', 'envelope', 'chunks', 'missing', 'size',
+                 'received')
+
+    def __init__(self, started, envelope, count, size):
+        self.started = started
+        self.envelope = envelope
+        self.chunks = [None] * count
+        self.missing = count
+        self.size = size
+        self.received = 0
+
+
+class Reassembler(object):
+    """
+    Puts events that were split with :func:`split_event` back together.
+
+    Fragments are collected per provider and event until all of them
+    have arrived. Buffered events are bounded: an event that isn't
+    complete ``timeout`` seconds after its first fragment arrived is
+    dropped, as are the oldest incomplete events once more than
+    ``max_events`` are buffered or the chunks they hold would exceed
+    ``max_bytes``. Events declared larger than ``max_bytes``, and
+    events whose chunks don't add up to their declared size, are
+    dropped outright. A reassembled event has the envelope of its first
+    fragment, including its trace timestamps, and is a dict unless
+    ``lazy_packets`` is set. Counts of completed and dropped events are
+    kept in :attr:`completed` and :attr:`dropped`.
+
+    Args:
+        timeout (float): Seconds to wait for the rest of an event
+        max_events (int): Most incomplete events to buffer
+        max_bytes (int): Most characters of JSON to buffer
+        lazy_packets (bool): Whether to return reassembled events as
+            lazily decoded :class:`EventPacket
+            <heimdallr_client.packets.EventPacket>` objects
+    """
+
+    def __init__(self, timeout=FRAGMENT_TIMEOUT,
+                 max_events=FRAGMENT_MAX_EVENTS,
+                 max_bytes=FRAGMENT_MAX_BYTES, lazy_packets=False):
+        self.timeout = timeout
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.lazy_packets = lazy_packets
+        self.completed = 0
+        self.dropped = 0
+        self._partial = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._partial)
+
+    def feed(self, packet):
+        """ Take a received event packet.
+
+        Args:
+            packet (dict or :class:`Packet
+                <heimdallr_client.packets.Packet>`): The event packet
+
+        Returns:
+            ``packet`` itself if it isn't a fragment, the reassembled
+            event if it was the last missing fragment of an event,
+            otherwise ``None``
+        """
+
+        now = None
+        if self._partial:
+            now = time()
+            self._expire(now)
+        if not isinstance(packet, (dict, Packet)) or \
+                packet.get('subtype') != FRAGMENT_SUBTYPE:
+            return packet
+
+        fragment = packet.get('data')
+        try:
+            key = (packet.get('provider'), fragment['id'])
+            index = int(fragment['index'])
+            count = int(fragment['count'])
+            size = int(fragment['size'])
+            chunk = fragment['chunk']
+            subtype = fragment['subtype']
+        except (TypeError, KeyError, ValueError):
+            return None
+        # Every fragment holds at least one character of the event
+        if not 0 <= index < count <= size or \
+                not isinstance(chunk, basestring):
+            return None
+
+        partial = self._partial.get(key)
+        if partial is None:
+            if size > self.max_bytes:
+                if index == 0:
+                    self.dropped += 1
+                return None
+            while len(self._partial) >= self.max_events:
+                self._drop(next(iter(self._partial)))
+            partial = self._partial[key] = _Partial(
+                now or time(), None, count, size
+            )
+        elif count != len(partial.chunks) or size != partial.size:
+            return None
+        if partial.envelope is None or index == 0:
+            partial.envelope = _envelope(packet)
+            partial.envelope['subtype'] = subtype
+        if partial.chunks[index] is None:
+            if partial.received + len(chunk) > partial.size:
+                self._drop(key)
+                return None
+            self._make_room(len(chunk), key)
+            partial.chunks[index] = chunk
+            partial.received += len(chunk)
+            self._bytes += len(chunk)
+            partial.missing -= 1
+        if partial.missing:
+            return None
+
+        if partial.received != partial.size:
+            self._drop(key)
+            return None
+        del self._partial[key]
+        self._bytes -= partial.received
+        text = ''.join(partial.chunks)
+        if self.lazy_packets:
+            # The data is left as the JSON text it arrived as
+            packet = decode_packet(EventPacket, '%s,"data":%s}' % (
+                json.dumps(partial.envelope)[:-1], text.encode('utf-8')
+            ))
+        else:
+            try:
+                packet = dict(partial.envelope, data=json.loads(text))
+            except ValueError:
+                self.dropped += 1
+                return None
+        self.completed += 1
+        return packet
+
+    def _expire(self, now):
+        # Events are kept in the order their first fragment arrived
+        while self._partial:
+            key, partial = next(self._partial.iteritems())
+            if partial.started > now - self.timeout:
+                break
+            self._drop(key)
+
+    def _make_room(self, size, keep):
+        # The event being added to fits by itself, since its chunks
+        # never exceed its declared size
+        for key in list(self._partial):
+            if self._bytes + size <= self.max_bytes:
+                break
+            if key != keep:
+                self._drop(key)
+
+    def _drop(self, key):
+        self._bytes -= self._partial.pop(key).received
+        self.dropped += 1
@@ -0,0 +1,120 @@
+from threading import Event, Lock
+
+from exceptions import HeimdallrTimeoutError
+
+__all__ = ['Future']
+
+
+class Future(object):
+    """
+    The eventual result of a packet sent to the Heimdallr server.
+
+    A ``Future`` is resolved from the thread running the client's
+    :meth:`run <heimdallr_client.clients.Client.run>` loop, so waiting on
+    it from that same thread will time out.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self._lock = Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """ Whether the future has a result or an exception.
+
+        Returns:
+            bool: ``True`` once the future has been resolved
+        """
+
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the result of the future.
+
+        Args:
+            timeout (float): Seconds to wait before giving up
+
+        Returns:
+            The result the future was resolved with
+
+        Raises:
+            HeimdallrTimeoutError: If the future wasn't resolved in time
+            Exception: The exception the future failed with
+        """
+
+        if not self._event.wait(timeout):
+            raise HeimdallrTimeoutError('Timed out waiting for result')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the future and return the exception it failed with.
+
+        Args:
+            timeout (float): Seconds to wait before giving up
+
+        Returns:
+            Exception: The exception or ``None`` if the future succeeded
+
+        Raises:
+            HeimdallrTimeoutError: If the future wasn't resolved in time
+        """
+
+        if not self._event.wait(timeout):
+            raise HeimdallrTimeoutError('Timed out waiting for result')
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """ Call ``fn`` with the future once it has been resolved.
+
+        If the future is already resolved ``fn`` is called immediately.
+
+        Args:
+            fn (function): Callback that takes the future as its only
+                argument
+        """
+
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        """ Resolve the future with ``result``.
+
+        Args:
+            result: Value returned by :meth:`result`
+
+        Returns:
+            bool: ``False`` if the future had already been resolved
+        """
+
+        return self._resolve(result, None)
+
+    def set_exception(self, exception):
+        """ Fail the future with ``exception``.
+
+        Args:
+            exception (Exception): Exception raised by :meth:`result`
+
+        Returns:
+            bool: ``False`` if the future had already been resolved
+        """
+
+        return self._resolve(None, exception)
+
+    def _resolve(self, result, exception):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+        return True
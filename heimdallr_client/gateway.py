@@ -0,0 +1,368 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+from functools import partial
+from threading import Lock, _Event
+from time import time, sleep
+
+from packets import _json_default
+from settings import GATEWAY_CAPACITY, GATEWAY_MAX_READERS
+
+__all__ = ['Gateway', 'LocalConsumer']
+
+_MAGIC = 'HDLRSHM2'
+# Magic, data capacity, head (total bytes ever written), reader slots and
+# the end of the record being written, which is published before writing it
+_HEADER = struct.Struct('<8sQQQQ')
+_HEAD_OFFSET = 16
+_RESERVED_OFFSET = 32
+# Cursor and pid of a reader
+_SLOT = struct.Struct('<QQ')
+# Record length (excluding this field), payload kind, message name length
+_RECORD = struct.Struct('<IBH')
+_LENGTH = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_WRAP = 0xFFFFFFFF
+_JSON = 0
+_BINARY = 1
+
+
+def _path(name):
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else \
+        tempfile.gettempdir()
+    return os.path.join(directory, 'heimdallr-%s' % name)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class Gateway(object):
+    """
+    Shares the packets one consumer receives with local processes.
+
+    Instead of every process on a host opening its own connection to
+    the same providers, one process runs a :class:`Consumer
+    <heimdallr_client.clients.Consumer>` with a gateway attached and the
+    others read its packets with :class:`LocalConsumer`. Packets are
+    written once to a ring buffer in shared memory, which each reader
+    follows with its own cursor. The gateway never waits for readers: a
+    reader that falls more than ``capacity`` bytes behind skips ahead to
+    the newest packet and counts the overrun.
+
+    Args:
+        consumer (:class:`Consumer <heimdallr_client.clients.Consumer>`):
+            Consumer whose packets are shared
+        name (str): Name local consumers use to find the gateway
+        capacity (int): Size of the ring buffer in bytes
+        message_names (list): Messages to share
+        max_readers (int): Number of local consumers that can attach
+
+    **Usage:**
+
+    .. code-block:: python
+
+        # In the process with the connection
+        Gateway(consumer, 'robots')
+        consumer.run()
+
+        # In any other process on the host
+        local = LocalConsumer('robots')
+        local.on('sensor', handle_sensor)
+        local.run()
+    """
+
+    def __init__(self, consumer, name, capacity=GATEWAY_CAPACITY,
+                 message_names=('event', 'sensor'),
+                 max_readers=GATEWAY_MAX_READERS):
+        self.consumer = consumer
+        self.name = name
+        self.capacity = capacity
+        self.path = _path(name)
+        self.dropped = 0
+        self._lock = Lock()
+        self._head = 0
+        self._slots = _HEADER.size
+        self._data = self._slots + max_readers * _SLOT.size
+
+        with open(self.path, 'w+b') as f:
+            f.truncate(self._data + capacity)
+            self._map = mmap.mmap(f.fileno(), self._data + capacity)
+        _HEADER.pack_into(self._map, 0, _MAGIC, capacity, 0, max_readers, 0)
+
+        self._listeners = []
+        for message_name in message_names:
+            listener = partial(self.publish, message_name)
+            self._listeners.append((message_name, listener))
+            consumer.on(message_name, listener)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Stop sharing packets and remove the shared memory. """
+
+        for message_name, listener in self._listeners:
+            self.consumer.remove_listener(message_name, listener)
+        self._listeners = []
+        self._map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def publish(self, message_name, *args):
+        """ Write a message to the ring buffer.
+
+        Messages bigger than half the buffer are dropped and counted in
+        ``dropped``.
+
+        Args:
+            message_name (str): Name of the socket.io message
+            args: Data sent with the message
+        """
+
+        if len(args) == 1 and isinstance(args[0], bytearray):
+            kind, payload = _BINARY, str(args[0])
+        else:
+            kind, payload = _JSON, json.dumps(
+                args, separators=(',', ':'), default=_json_default
+            )
+        name = message_name.encode('utf-8')
+        size = _RECORD.size + len(name) + len(payload)
+        if size > self.capacity // 2:
+            self.dropped += 1
+            return
+
+        with self._lock:
+            head = self._head
+            position = head % self.capacity
+            wrap = position + size > self.capacity
+            # Readers check this after copying a record, so they notice
+            # when it was being overwritten
+            _U64.pack_into(
+                self._map, _RESERVED_OFFSET,
+                head + (self.capacity - position if wrap else 0) + size
+            )
+            if wrap:
+                if self.capacity - position >= _LENGTH.size:
+                    _LENGTH.pack_into(
+                        self._map, self._data + position, _WRAP
+                    )
+                head += self.capacity - position
+                position = 0
+            start = self._data + position
+            _RECORD.pack_into(
+                self._map, start, size - _LENGTH.size, kind, len(name)
+            )
+            start += _RECORD.size
+            self._map[start:start + len(name)] = name
+            start += len(name)
+            self._map[start:start + len(payload)] = payload
+            self._head = head + size
+            _U64.pack_into(self._map, _HEAD_OFFSET, self._head)
+
+    def readers(self):
+        """ List the local consumers that are attached.
+
+        Returns:
+            list: ``(pid, lag)`` tuples where ``lag`` is the number of
+            bytes the reader has yet to read
+        """
+
+        readers = []
+        for i in range(_HEADER.unpack_from(self._map, 0)[3]):
+            cursor, pid = _SLOT.unpack_from(
+                self._map, self._slots + i * _SLOT.size
+            )
+            if pid and _alive(pid):
+                readers.append((pid, self._head - cursor))
+        return readers
+
+
+class LocalConsumer(object):
+    """
+    Receives the packets shared by a :class:`Gateway` in another process.
+
+    A local consumer has the same ``on``/``remove_listener``/``run``
+    interface as a :class:`Client <heimdallr_client.clients.Client>`,
+    but reads packets from shared memory instead of a connection. It
+    starts with the packets published after it attached. ``overruns``
+    counts how many times it fell so far behind that packets were lost.
+
+    Args:
+        name (str): Name the gateway was created with
+        poll_interval (float): Longest time to sleep when there are no
+            packets. Shorter sleeps are used first, so packets that
+            follow each other closely are handed off faster.
+    """
+
+    def __init__(self, name, poll_interval=0.0005):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.callbacks = {}
+        self.overruns = 0
+
+        with open(_path(name), 'r+b') as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+            magic, self.capacity, head, max_readers, _ = \
+                _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC:
+                raise ValueError('%s is not a Heimdallr gateway' % name)
+            self._data = _HEADER.size + max_readers * _SLOT.size
+            self._cursor = head
+
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                for i in range(max_readers):
+                    offset = _HEADER.size + i * _SLOT.size
+                    pid = _SLOT.unpack_from(self._map, offset)[1]
+                    if not pid or not _alive(pid):
+                        self._slot = offset
+                        _SLOT.pack_into(
+                            self._map, offset, self._cursor, os.getpid()
+                        )
+                        break
+                else:
+                    raise ValueError('Gateway %s has no free slots' % name)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Detach from the gateway. """
+
+        if self._map is not None:
+            _SLOT.pack_into(self._map, self._slot, 0, 0)
+            self._map.close()
+            self._map = None
+
+    def on(self, message_name, callback=None):
+        """ Add a message listener.
+
+        Works like :meth:`Client.on <heimdallr_client.clients.Client.on>`,
+        including use as a decorator.
+
+        Args:
+            message_name (str): Name of the message to listen for
+            callback (function): Callback to run when the message is read
+
+        :returns: :class:`LocalConsumer <LocalConsumer>`
+        """
+
+        if callback is None:
+            def decorator(fn):
+                self.on(message_name, fn)
+            return decorator
+
+        self.callbacks.setdefault(message_name, []).append(callback)
+        return self
+
+    def remove_listener(self, message_name, callback=None):
+        """ Remove listeners for a message.
+
+        Args:
+            message_name (str): Name of the message to remove
+            callback (function): Specific callback to remove
+
+        :returns: :class:`LocalConsumer <LocalConsumer>`
+        """
+
+        if callback:
+            while callback in self.callbacks.get(message_name, []):
+                self.callbacks[message_name].remove(callback)
+        else:
+            self.callbacks.pop(message_name, None)
+
+        return self
+
+    def run(self, seconds=None, event=None):
+        """ Read and dispatch packets.
+
+        Args:
+            seconds (float): Number of seconds to loop for
+            event (:py:class:`threading.Event`): Triggers the exit of the run
+                loop when the flag is set
+
+        :returns: :class:`LocalConsumer <LocalConsumer>`
+        """
+
+        end = None if seconds is None else time() + seconds
+        delay = self.poll_interval / 16
+        while True:
+            if isinstance(event, _Event) and event.is_set():
+                break
+            if self.read():
+                delay = self.poll_interval / 16
+                continue
+            if end is not None and time() >= end:
+                break
+            sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+        return self
+
+    def read(self):
+        """ Dispatch the packets that are waiting without blocking.
+
+        Returns:
+            int: Number of packets dispatched
+        """
+
+        head = _U64.unpack_from(self._map, _HEAD_OFFSET)[0]
+        count = 0
+        if head - self._cursor > self.capacity:
+            self.overruns += 1
+            self._cursor = head
+
+        while self._cursor < head:
+            position = self._cursor % self.capacity
+            if self.capacity - position < _LENGTH.size or \
+                    _LENGTH.unpack_from(
+                        self._map, self._data + position
+                    )[0] == _WRAP:
+                self._cursor += self.capacity - position
+                continue
+
+            start = self._data + position
+            length, kind, name_length = _RECORD.unpack_from(self._map, start)
+            end = start + _LENGTH.size + length
+            record = self._map[start + _RECORD.size:end]
+
+            # The gateway may have started overwriting the record while we
+            # were copying it
+            reserved = _U64.unpack_from(self._map, _RESERVED_OFFSET)[0]
+            if reserved - self._cursor > self.capacity:
+                self.overruns += 1
+                self._cursor = head = _U64.unpack_from(
+                    self._map, _HEAD_OFFSET
+                )[0]
+                break
+
+            self._cursor += _LENGTH.size + length
+            message_name = record[:name_length].decode('utf-8')
+            if kind == _BINARY:
+                args = (bytearray(record[name_length:]),)
+            else:
+                args = json.loads(record[name_length:])
+            for callback in self.callbacks.get(message_name, []):
+                callback(*args)
+            count += 1
+
+        _U64.pack_into(self._map, self._slot, self._cursor)
+        return count
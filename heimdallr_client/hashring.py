@@ -0,0 +1,82 @@
+import struct
+from bisect import bisect, insort
+from hashlib import md5
+
+__all__ = ['HashRing']
+
+
+def _hash(key):
+    return struct.unpack('>Q', md5(key).digest()[:8])[0]
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys, such as provider UUIDs, onto nodes.
+
+    Every node is placed on the ring ``replicas`` times. A key belongs to
+    the first node at or after its own position, so adding or removing a
+    node only moves the keys of that node's ring segments.
+
+    Args:
+        nodes (list): Initial node names
+        replicas (int): Number of positions each node gets on the ring
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = set()
+        self._points = []
+        self._node_by_point = {}
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add(self, node):
+        """ Place ``node`` on the ring.
+
+        Args:
+            node (str): Name of the node
+        """
+
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash('%s#%s' % (node, i))
+            self._node_by_point[point] = node
+            insort(self._points, point)
+
+    def remove(self, node):
+        """ Take ``node`` off the ring.
+
+        Args:
+            node (str): Name of the node
+        """
+
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for i in range(self.replicas):
+            point = _hash('%s#%s' % (node, i))
+            del self._node_by_point[point]
+            self._points.remove(point)
+
+    def get(self, key):
+        """ Find the node ``key`` belongs to.
+
+        Args:
+            key (str): Key to place, e.g. a provider UUID
+
+        Returns:
+            str: Name of the node or ``None`` if the ring is empty
+        """
+
+        if not self._points:
+            return None
+        i = bisect(self._points, _hash(key)) % len(self._points)
+        return self._node_by_point[self._points[i]]
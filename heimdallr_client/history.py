@@ -0,0 +1,176 @@
+import json
+from array import array
+from threading import Lock
+
+from utils import parse_timestamp
+
+__all__ = ['PacketHistory']
+
+
+class _Series(object):
+    """
+    Timestamps and encoded data of one provider's subtype.
+
+    Timestamps live in an ``array`` of doubles and data as compact JSON
+    strings, in parallel ring buffers that hold at most ``capacity``
+    packets. Timestamps are kept in order so ranges can be found by
+    binary search. A packet that arrives out of order is inserted where
+    its timestamp belongs, which is slower than appending but rare.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d')
+        self.data = []
+        self.start = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, t, data):
+        if self.times and \
+                t < self.times[(self.start - 1) % len(self.times)]:
+            self._insert(t, data)
+            return
+        if len(self.times) < self.capacity:
+            self.times.append(t)
+            self.data.append(data)
+        else:
+            self.times[self.start] = t
+            self.data[self.start] = data
+            self.start = (self.start + 1) % self.capacity
+
+    def _insert(self, t, data):
+        index = self.bisect(t, right=True)
+        times = self.times[self.start:] + self.times[:self.start]
+        values = self.data[self.start:] + self.data[:self.start]
+        times.insert(index, t)
+        values.insert(index, data)
+        if len(times) > self.capacity:
+            # The oldest packet, which may be the late one itself
+            del times[0]
+            del values[0]
+        self.times, self.data, self.start = times, values, 0
+
+    def bisect(self, t, right=False):
+        """ Index of the first packet after (or at, unless ``right``) ``t``.
+        """
+
+        times, start, size = self.times, self.start, len(self.times)
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = times[(start + mid) % size]
+            if value < t or (right and value == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def slice(self, lo, hi):
+        size = len(self.times)
+        for i in range(lo, hi):
+            i = (self.start + i) % size
+            yield self.times[i], self.data[i]
+
+
+class PacketHistory(object):
+    """
+    A memory-bounded, queryable history of received packets.
+
+    The history listens for ``event`` and ``sensor`` packets on
+    ``consumer`` and files them by provider and subtype. Each series keeps
+    the last ``max_packets`` packets as a column of timestamps, parsed
+    from the packets' ``t`` field, and a column of compactly encoded
+    data. This takes a fraction of the memory of keeping the packet
+    dicts. :meth:`history` finds time ranges by binary search.
+
+    Args:
+        consumer (:class:`Consumer <heimdallr_client.clients.Consumer>`):
+            Consumer whose packets are recorded
+        max_packets (int): Packets kept per provider and subtype
+        packet_types (list): Packet types to record
+
+    **Usage:**
+
+    .. code-block:: python
+
+        history = PacketHistory(consumer, max_packets=100000)
+        consumer.run(60)
+        history.history(uuid, 'battery', since='2015-07-06T16:44:00Z')
+    """
+
+    def __init__(self, consumer, max_packets=10000,
+                 packet_types=('event', 'sensor')):
+        self.consumer = consumer
+        self.max_packets = max_packets
+        self.packet_types = list(packet_types)
+        self._series = {}
+        self._lock = Lock()
+        for packet_type in self.packet_types:
+            consumer.on(packet_type, self.add)
+
+    def close(self):
+        """ Stop recording the consumer's packets. """
+
+        for packet_type in self.packet_types:
+            self.consumer.remove_listener(packet_type, self.add)
+
+    def add(self, packet):
+        """ Record a packet.
+
+        Args:
+            packet (dict): Packet with ``provider``, ``subtype``, ``t``
+                and ``data`` fields
+        """
+
+        t = parse_timestamp(packet['t'])
+        data = json.dumps(packet.get('data'), separators=(',', ':'))
+        key = (packet.get('provider'), packet.get('subtype'))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.max_packets)
+            series.append(t, data)
+
+    def series(self):
+        """ List the provider and subtype of everything recorded.
+
+        Returns:
+            list: ``(uuid, subtype)`` tuples
+        """
+
+        with self._lock:
+            return self._series.keys()
+
+    def history(self, uuid, subtype, since=None, until=None):
+        """ Get the recorded packets of a provider's subtype.
+
+        Args:
+            uuid (str): UUID of the provider
+            subtype (str): The packet subtype
+            since (float or str): Earliest time to include, as seconds
+                since the epoch or an ISO 8601 timestamp
+            until (float or str): Latest time to include, as seconds
+                since the epoch or an ISO 8601 timestamp
+
+        Returns:
+            list: ``(time, data)`` tuples in time order where ``time`` is
+            in seconds since the epoch
+        """
+
+        if isinstance(since, basestring):
+            since = parse_timestamp(since)
+        if isinstance(until, basestring):
+            until = parse_timestamp(until)
+
+        with self._lock:
+            series = self._series.get((uuid, subtype))
+            if series is None:
+                return []
+            lo = 0 if since is None else series.bisect(since)
+            hi = len(series) if until is None else \
+                series.bisect(until, right=True)
+            rows = list(series.slice(lo, hi))
+
+        return [(t, json.loads(data)) for t, data in rows]
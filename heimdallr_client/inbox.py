@@ -0,0 +1,133 @@
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+from packets import Packet
+from settings import INBOX_CLOSE_TIMEOUT
+
+__all__ = ['ConflatingInbox']
+
+
+class ConflatingInbox(object):
+    """
+    Hands received packets to a delivery thread, keeping only the newest.
+
+    Packets are keyed by message name, provider and subtype. While a key
+    is waiting to be delivered, a newer packet for it replaces the older
+    one, which is counted in :attr:`skipped`. Keys are delivered in the
+    order they first became pending, so every source gets its turn. The
+    inbox never holds more than one packet per key and a packet is never
+    more than one round of deliveries old, however fast packets arrive.
+
+    The delivery thread is started when the first packet is put in the
+    inbox and stopped by :meth:`close`. Packets put in a closed inbox
+    are dropped until it is opened again with :meth:`open`.
+
+    Args:
+        deliver (function): Called on the delivery thread with the message
+            name and the arguments of each packet
+    """
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self.delivered = 0
+        self.skipped = {}
+        self._pending = {}
+        self._order = deque()
+        self._condition = Condition()
+        self._thread = None
+        self.closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def _key(message_name, args):
+        packet = args[0] if args else None
+        if isinstance(packet, (dict, Packet)):
+            return message_name, packet.get('provider'), packet.get('subtype')
+        return message_name, None, None
+
+    def put(self, message_name, *args):
+        """ Queue a packet, replacing a pending one from the same source.
+
+        Args:
+            message_name (str): Name of the socket.io message
+            args: Data sent with the message
+        """
+
+        key = self._key(message_name, args)
+        with self._condition:
+            if self.closed:
+                return
+            if key in self._pending:
+                self.skipped[key] = self.skipped.get(key, 0) + 1
+            else:
+                self._order.append(key)
+            self._pending[key] = args
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._work, name='heimdallr-inbox'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def open(self):
+        """ Accept packets again after :meth:`close`. """
+
+        with self._condition:
+            self.closed = False
+
+    def close(self, timeout=INBOX_CLOSE_TIMEOUT):
+        """ Drop pending packets and stop the delivery thread.
+
+        Args:
+            timeout (float): Seconds to wait for a delivery in progress,
+                or ``None`` to wait until it is done
+        """
+
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self.closed = True
+            self._pending.clear()
+            self._order.clear()
+            self._condition.notify_all()
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout)
+
+    def stats(self):
+        """ Summarize the inbox.
+
+        Returns:
+            dict: ``delivered`` count, ``pending`` count and ``skipped``
+            counts by ``(message_name, provider, subtype)``
+        """
+
+        with self._condition:
+            return {
+                'delivered': self.delivered,
+                'pending': len(self._pending),
+                'skipped': dict(self.skipped)
+            }
+
+    def _work(self):
+        thread = current_thread()
+        while True:
+            with self._condition:
+                # The inbox may have been closed and opened again, with
+                # another thread, while this one was delivering
+                while not self._order and self._thread is thread:
+                    self._condition.wait()
+                if self._thread is not thread:
+                    return
+                key = self._order.popleft()
+                args = self._pending.pop(key)
+                self.delivered += 1
+
+            try:
+                self.deliver(key[0], *args)
+            except Exception as e:
+                print (
+                    'HeimdallrClient listener failed. Original exception: %s'
+                    % e
+                )
@@ -0,0 +1,292 @@
+import errno
+import fcntl
+import os
+import select
+from threading import Condition, Lock, Thread, current_thread
+from time import time
+
+from utils import lazy_import
+from settings import LOOP_INTERVAL
+
+socketIO_client = lazy_import('socketIO_client')
+
+__all__ = ['ReceiveLoop', 'default_loop']
+
+
+def _socket(io):
+    """ The socket a connection's packets arrive on, if it can be selected.
+    """
+
+    connection = getattr(io._transport_instance, '_connection', None)
+    return getattr(connection, 'sock', None)
+
+
+class ReceiveLoop(object):
+    """
+    A thread that receives packets for many clients.
+
+    Clients are added with :meth:`Client.start
+    <heimdallr_client.clients.Client.start>`. The loop waits on the
+    sockets of all its clients at once, together with a self-pipe that
+    wakes it whenever its clients change, so a client that is stopped or
+    closed is let go within milliseconds instead of when a receive times
+    out. Packets are received and their listeners called on the loop
+    thread, one client at a time.
+
+    Only the websocket transport has a socket to wait on. Clients on a
+    polling transport are served on every round and block the loop for
+    as long as their transport takes to answer, like :meth:`Client.run
+    <heimdallr_client.clients.Client.run>` does. Clients whose
+    connection dropped are skipped while a thread of their own
+    reconnects them, so a server that is down doesn't hold up the
+    other clients.
+
+    The thread is started when the first client is added and stops when
+    the last one is removed.
+
+    Args:
+        interval (float): Longest time in seconds between two rounds when
+            no packets arrive
+    """
+
+    def __init__(self, interval=LOOP_INTERVAL):
+        self.interval = interval
+        self.clients = []
+        self.closed = False
+        self._condition = Condition()
+        self._active = None
+        self._thread = None
+        self._reconnecting = set()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, client):
+        """ Start receiving packets for ``client``.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Connected client
+        """
+
+        with self._condition:
+            if self.closed:
+                raise ValueError('ReceiveLoop is closed')
+            if client not in self.clients:
+                self.clients.append(client)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='heimdallr-loop')
+                self._thread.daemon = True
+                self._thread.start()
+        self.wake()
+
+    def remove(self, client, timeout=None):
+        """ Stop receiving packets for ``client``.
+
+        Unless it is called from a listener on the loop thread, this
+        waits until the loop is done with the client, so its listeners
+        aren't called by the loop after it returns.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Client to remove
+            timeout (float): Seconds to wait for the loop to let go
+
+        Returns:
+            bool: ``False`` if the loop was still busy with the client
+        """
+
+        with self._condition:
+            if client in self.clients:
+                self.clients.remove(client)
+            self.wake()
+            if current_thread() is self._thread:
+                return True
+            deadline = None if timeout is None else time() + timeout
+            while self._active is client:
+                if deadline is None:
+                    self._condition.wait()
+                elif deadline > time():
+                    self._condition.wait(deadline - time())
+                else:
+                    return False
+        return True
+
+    def wake(self):
+        """ Make the loop look at its clients again right away. """
+
+        if self.closed and self._thread is None:
+            return
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError as e:
+            # A full pipe will wake the loop anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self, timeout=None):
+        """ Remove every client and stop the thread.
+
+        Args:
+            timeout (float): Seconds to wait for the thread to stop
+        """
+
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.clients = []
+            thread = self._thread
+        self.wake()
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                return
+        with self._condition:
+            self._thread = None
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _drain(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _wait(self, clients):
+        """ Wait for packets and return the clients that have some. """
+
+        sockets = {}
+        ready = []
+        for client in clients:
+            io = client.connection._io
+            if io is None:
+                continue
+            if not io._opened:
+                self._reconnect(client, io)
+                continue
+            sock = _socket(io)
+            if sock is None:
+                ready.append(client)
+            elif getattr(sock, 'pending', None) and sock.pending():
+                # Decrypted data waiting in the SSL layer doesn't show up
+                # in select
+                ready.append(client)
+            else:
+                sockets[sock] = client
+
+        try:
+            readable, _, _ = select.select(
+                [self._wakeup_r] + list(sockets), [], [],
+                0 if ready else self.interval
+            )
+        except (select.error, ValueError, IOError):
+            # A socket was closed under us; look at the clients again
+            return ready
+        if self._wakeup_r in readable:
+            self._drain()
+        return ready + [
+            sockets[sock] for sock in readable if sock in sockets
+        ]
+
+    def _reconnect(self, client, io):
+        """ Reconnect ``io`` on a thread of its own, unless it already is.
+        """
+
+        with self._condition:
+            if io in self._reconnecting or client.closed or self.closed:
+                return
+            self._reconnecting.add(io)
+        thread = Thread(
+            target=self._run_reconnect, args=(io,),
+            name='heimdallr-reconnect'
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _run_reconnect(self, io):
+        try:
+            # Blocks until the server is back unless the connection was
+            # opened with wait_for_connection=False
+            io._transport
+        except Exception as e:
+            print 'HeimdallrClient could not reconnect: %s' % e
+        finally:
+            with self._condition:
+                self._reconnecting.discard(io)
+        if not self.closed:
+            self.wake()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self.clients = [c for c in self.clients if not c.closed]
+                if self.closed or not self.clients:
+                    self._thread = None
+                    return
+                clients = list(self.clients)
+
+            for client in self._wait(clients):
+                with self._condition:
+                    if client not in self.clients:
+                        continue
+                    self._active = client
+                try:
+                    self._receive(client)
+                finally:
+                    with self._condition:
+                        self._active = None
+                        self._condition.notify_all()
+
+    def _receive(self, client):
+        io = client.connection._io
+        if io is None or not io._opened:
+            return
+        try:
+            try:
+                io._transport.set_timeout(seconds=1)
+                io._process_packets()
+            except socketIO_client.TimeoutError:
+                pass
+        except socketIO_client.ConnectionError as e:
+            print 'HeimdallrClient lost its connection: %s' % e
+            io._opened = False
+            try:
+                io.get_namespace().on_disconnect()
+            except socketIO_client.PacketError:
+                pass
+        except Exception as e:
+            print (
+                'HeimdallrClient listener failed. Original exception: %s' % e
+            )
+
+
+_default = {}
+_default_lock = Lock()
+
+
+def default_loop():
+    """ Get the process-wide :class:`ReceiveLoop`.
+
+    The loop is created on first use and recreated if it has been closed
+    or the process has forked.
+
+    Returns:
+        :class:`ReceiveLoop`: The shared loop
+    """
+
+    with _default_lock:
+        loop = _default.get('loop')
+        if loop is None or loop.closed or _default.get('pid') != os.getpid():
+            loop = _default['loop'] = ReceiveLoop()
+            _default['pid'] = os.getpid()
+        return loop
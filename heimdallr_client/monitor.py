@@ -0,0 +1,202 @@
+from collections import deque
+from threading import Event, Lock, Thread
+from time import time
+
+from clients import Provider
+from utils import timestamp
+
+__all__ = ['LinkMonitor']
+
+
+class LinkMonitor(object):
+    """
+    Measures the round-trip time to the Heimdallr server in the background.
+
+    Every ``interval`` seconds the monitor sends a probe and waits for the
+    server's reply. By default a provider sends a ``ping`` event, which
+    the server answers with ``pong``; other clients must pass their own
+    ``probe``. Replies carry no id, so they are matched to probes in the
+    order they were sent, and probes without a reply after ``timeout``
+    seconds count as lost. The last ``window`` results are summarized by
+    :meth:`stats`.
+
+    After every probe ``on_update`` is called with the monitor, e.g. to
+    widen a :class:`Latest <heimdallr_client.policies.Latest>` interval
+    when the link slows down. When the window is at least half full and
+    the median round trip exceeds ``max_rtt`` or the loss exceeds
+    ``max_loss``, ``on_degraded`` is called and the window is cleared.
+    By default that reconnects the client with ``connect_kwargs``, failing
+    over to another endpoint if the client has :attr:`endpoints
+    <heimdallr_client.clients.Client.endpoints>`.
+
+    Exceptions raised by the probe or the callbacks are printed and the
+    monitor goes on. The default ``on_degraded`` runs in the monitor's
+    thread; :meth:`connect <heimdallr_client.clients.Client.connect>`
+    takes the client off its receive loop or interrupts its :meth:`run
+    <heimdallr_client.clients.Client.run>` before replacing the socket.
+    The monitor stops when it is closed or when its client is closed.
+
+    Args:
+        client (:class:`Client <heimdallr_client.clients.Client>`):
+            Client whose link to measure
+        interval (float): Seconds between probes
+        window (int): Number of probes summarized
+        timeout (float): Seconds before a probe counts as lost
+        probe (function): Sends one probe
+        reply (str): Message name of the server's reply
+        max_rtt (float): Median round trip, in seconds, above which the
+            link is degraded
+        max_loss (float): Fraction of lost probes above which the link is
+            degraded
+        on_update (function): Called with the monitor after every probe
+        on_degraded (function): Called with the monitor when the link is
+            degraded
+        connect_kwargs (dict): Passed to :meth:`connect
+            <heimdallr_client.clients.Client.connect>` by the default
+            ``on_degraded``
+
+    **Usage:**
+
+    .. code-block:: python
+
+        monitor = LinkMonitor(provider, max_rtt=0.5, max_loss=0.2)
+        provider.run()
+        monitor.stats()  # {'p50': 0.031, 'jitter': 0.004, 'loss': 0.0, ...}
+    """
+
+    def __init__(self, client, interval=1.0, window=60, timeout=2.0,
+                 probe=None, reply='pong', max_rtt=None, max_loss=None,
+                 on_update=None, on_degraded=None, connect_kwargs=None):
+        if probe is None:
+            if not isinstance(client, Provider):
+                raise ValueError('A probe is needed for this client')
+            probe = self._ping
+        self.client = client
+        self.interval = interval
+        self.timeout = timeout
+        self.probe = probe
+        self.reply = reply
+        self.max_rtt = max_rtt
+        self.max_loss = max_loss
+        self.on_update = on_update
+        self.on_degraded = on_degraded or self._reconnect
+        self.connect_kwargs = connect_kwargs or {}
+        self.degraded = 0
+        self._samples = deque(maxlen=window)
+        self._outstanding = deque()
+        self._lock = Lock()
+        self._stop = Event()
+
+        client.on(reply, self._on_reply)
+        self._thread = Thread(target=self._run, name='heimdallr-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Stop probing. """
+
+        self._stop.set()
+        self.client.remove_listener(self.reply, self._on_reply)
+
+    def stats(self):
+        """ Summarize the window.
+
+        Returns:
+            dict: ``count`` of probes, ``loss`` fraction, and the ``mean``,
+            ``min``, ``max``, ``p50``, ``p90``, ``p99`` and ``jitter`` (mean
+            change between consecutive round trips) of the round trips in
+            seconds, which are ``None`` when no probe came back
+        """
+
+        with self._lock:
+            samples = list(self._samples)
+        rtts = [rtt for rtt in samples if rtt is not None]
+        stats = dict.fromkeys(
+            ['mean', 'min', 'max', 'p50', 'p90', 'p99', 'jitter']
+        )
+        stats['count'] = len(samples)
+        stats['loss'] = 0.0
+        if samples:
+            stats['loss'] = (len(samples) - len(rtts)) / float(len(samples))
+        if rtts:
+            ordered = sorted(rtts)
+            stats.update(
+                mean=sum(rtts) / len(rtts),
+                min=ordered[0],
+                max=ordered[-1],
+                jitter=sum(
+                    abs(b - a) for a, b in zip(rtts, rtts[1:])
+                ) / max(len(rtts) - 1, 1)
+            )
+            for percent in [50, 90, 99]:
+                index = min(int(len(ordered) * percent / 100.0),
+                            len(ordered) - 1)
+                stats['p%d' % percent] = ordered[index]
+        return stats
+
+    def _ping(self):
+        self.client._emit(
+            'event',
+            {'subtype': 'ping', 'data': None, 't': timestamp()},
+            lane='control'
+        )
+
+    def _reconnect(self, monitor):
+        if self.client.endpoints is not None:
+            self.client.failover(**self.connect_kwargs)
+        else:
+            self.client.connect(**self.connect_kwargs)
+
+    def _expire(self, now):
+        while self._outstanding and now - self._outstanding[0] > self.timeout:
+            self._outstanding.popleft()
+            self._samples.append(None)
+
+    def _on_reply(self, *args):
+        now = time()
+        with self._lock:
+            self._expire(now)
+            if self._outstanding:
+                self._samples.append(now - self._outstanding.popleft())
+
+    def _is_degraded(self):
+        if len(self._samples) < self._samples.maxlen // 2:
+            return False
+        stats = self.stats()
+        if self.max_loss is not None and stats['loss'] > self.max_loss:
+            return True
+        return self.max_rtt is not None and stats['p50'] is not None and \
+            stats['p50'] > self.max_rtt
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.client.closed:
+                return
+            with self._lock:
+                self._expire(time())
+                if self.client.ready:
+                    self._outstanding.append(time())
+            if self.client.ready:
+                self._call(self.probe)
+
+            if self.on_update is not None:
+                self._call(self.on_update, self)
+            if self._is_degraded():
+                self.degraded += 1
+                with self._lock:
+                    self._samples.clear()
+                    self._outstanding.clear()
+                self._call(self.on_degraded, self)
+
+    def _call(self, function, *args):
+        # An exception must not end the monitor thread
+        try:
+            function(*args)
+        except Exception as e:
+            print 'HeimdallrClient link monitor failed: %s' % e
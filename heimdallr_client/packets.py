@@ -0,0 +1,246 @@
+import json
+import re
+from json.decoder import scanstring
+
+__all__ = [
+    'Packet', 'EventPacket', 'SensorPacket', 'ControlPacket', 'decode_packet'
+]
+
+_decoder = json.JSONDecoder()
+_MISSING = object()
+_ENVELOPE = ('provider', 'subtype', 't')
+# A top-level field after ``data`` whose value can't contain ',"'
+_TAIL_FIELD = re.compile(
+    r',"([^"\\]+)":("[^"\\,]*"|true|false|null|-?[0-9][0-9.eE+-]*)'
+)
+
+
+class Packet(object):
+    """
+    A received Heimdallr packet that decodes its data on first access.
+
+    The envelope (``provider``, ``subtype`` and ``t``) is available as
+    attributes right away, while ``data`` is kept as JSON text until it
+    is read, so listeners that only look at the envelope never pay for
+    decoding it. Other top-level fields, like ``uuid`` and
+    ``persistent`` on control packets, are in ``fields``.
+
+    Packets also support read-only dict access (``packet['data']``,
+    ``packet.get('t')``, ``'provider' in packet``) so that listeners
+    written for plain dict packets keep working.
+
+    Args:
+        provider (str): UUID of the provider
+        subtype (str): The packet subtype
+        t (str): Timestamp of the packet
+        data: The packet data
+        fields (dict): Other top-level fields
+    """
+
+    __slots__ = (
+        'provider', 'subtype', 't', 'fields', '_data', '_text', '_start',
+        '_end'
+    )
+    packet_type = None
+
+    def __init__(self, provider=None, subtype=None, t=None, data=None,
+                 fields=None):
+        self.provider = provider
+        self.subtype = subtype
+        self.t = t
+        self.fields = fields
+        self._data = data
+        self._text = None
+
+    @classmethod
+    def from_dict(cls, packet):
+        """ Build a packet from a decoded dict.
+
+        Args:
+            packet (dict): Decoded packet
+
+        Returns:
+            :class:`Packet`: The packet
+        """
+
+        fields = dict(packet)
+        envelope = [fields.pop(key, None) for key in _ENVELOPE]
+        data = fields.pop('data', None)
+        return cls(*envelope, data=data, fields=fields or None)
+
+    @property
+    def data(self):
+        """ The packet data, decoded the first time it is read. """
+
+        if self._text is not None:
+            try:
+                self._data = json.loads(self._text[self._start:self._end])
+            except ValueError:
+                # The packet had fields after its data that the scan
+                # couldn't step over
+                self._data = json.loads(self._text).get('data')
+            self._text = None
+        return self._data
+
+    def get(self, key, default=None):
+        """ Get a field like :py:meth:`dict.get`. """
+
+        if key == 'data':
+            return self.data
+        if key in _ENVELOPE:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.fields is None:
+            return default
+        return self.fields.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def as_dict(self):
+        """ Convert the packet to a plain dict.
+
+        Returns:
+            dict: The packet's fields, envelope and data
+        """
+
+        packet = dict(self.fields or {})
+        for key in _ENVELOPE:
+            value = getattr(self, key)
+            if value is not None:
+                packet[key] = value
+        packet['data'] = self.data
+        return packet
+
+    def __eq__(self, other):
+        if isinstance(other, Packet):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s provider=%r subtype=%r t=%r>' % (
+            type(self).__name__, self.provider, self.subtype, self.t
+        )
+
+
+class EventPacket(Packet):
+    """ A received ``event`` packet. """
+
+    __slots__ = ()
+    packet_type = 'event'
+
+
+class SensorPacket(Packet):
+    """ A received ``sensor`` packet. """
+
+    __slots__ = ()
+    packet_type = 'sensor'
+
+
+class ControlPacket(Packet):
+    """ A received ``control`` packet. """
+
+    __slots__ = ()
+    packet_type = 'control'
+
+
+def _json_default(obj):
+    """ ``default`` for :py:func:`json.dumps` that encodes packets. """
+
+    if isinstance(obj, Packet):
+        return obj.as_dict()
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def _unicode(value):
+    return value.decode('utf-8') if isinstance(value, str) else value
+
+
+def _scan(cls, text):
+    """ Split the JSON text of a packet into its envelope and raw data.
+
+    Fields before ``data`` are decoded going forward from the start. The
+    end of ``data`` is found by stepping backward over the simple fields
+    that follow it, so the data itself is never scanned.
+    """
+
+    end = len(text) - 1
+    if text[0] != '{' or text[end] != '}':
+        raise ValueError('Not a JSON object')
+
+    fields = {}
+    index = 1
+    data_start = None
+    while index < end:
+        if text[index] != '"':
+            raise ValueError('Expected a key')
+        key, index = scanstring(text, index + 1)
+        if text[index] != ':':
+            raise ValueError('Expected a colon')
+        if key == 'data':
+            data_start = index + 1
+            break
+        fields[key], index = _decoder.raw_decode(text, index + 1)
+        if text[index] == ',':
+            index += 1
+        elif index != end:
+            raise ValueError('Expected a comma')
+
+    data = text_start = None
+    if data_start is not None:
+        while True:
+            position = text.rfind(',"', data_start, end)
+            match = position != -1 and \
+                _TAIL_FIELD.match(text, position, end)
+            if not match or match.end() != end:
+                break
+            key, value = match.groups()
+            if value[0] == '"':
+                fields[_unicode(key)] = _unicode(value[1:-1])
+            else:
+                fields[_unicode(key)] = json.loads(value)
+            end = position
+
+        first, last = text[data_start], text[end - 1]
+        if first == '{' and last == '}' or first == '[' and last == ']':
+            text_start = data_start
+        elif first == '"':
+            data, stop = scanstring(text, data_start + 1)
+            if stop != end:
+                raise ValueError('Unexpected data after string')
+        else:
+            data = json.loads(text[data_start:end])
+
+    envelope = [fields.pop(key, None) for key in _ENVELOPE]
+    packet = cls(*envelope, data=data, fields=fields or None)
+    if text_start is not None:
+        packet._text = text
+        packet._start = text_start
+        packet._end = end
+    return packet
+
+
+def decode_packet(packet_class, text):
+    """ Build a packet from the JSON text of a Heimdallr packet.
+
+    Args:
+        packet_class (type): :class:`Packet` subclass to build
+        text (str): UTF-8 encoded JSON text of the packet object
+
+    Returns:
+        :class:`Packet`: The packet, with its data left undecoded
+    """
+
+    try:
+        return _scan(packet_class, text)
+    except (ValueError, IndexError):
+        return packet_class.from_dict(json.loads(text))
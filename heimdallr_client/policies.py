@@ -0,0 +1,245 @@
+from copy import deepcopy
+from numbers import Number
+from threading import Lock, Timer
+from time import time
+
+__all__ = ['RatePolicy', 'TokenBucket', 'Downsample', 'Latest', 'Deadband']
+
+
+class RatePolicy(object):
+    """
+    Base class for rate policies used by :class:`Provider
+    <heimdallr_client.clients.Provider>` to thin out sensor packets.
+
+    A policy is given every sample of one subtype and decides which of
+    them are sent. Samples that aren't sent are counted in ``shed``.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.shed = 0
+        self._lock = Lock()
+
+    def admit(self, data, send):
+        """ Offer a sample to the policy.
+
+        Args:
+            data: The sensor packet data
+            send (function): Called with the data of each sample that
+                should be sent, either now or later
+        """
+
+        raise NotImplementedError
+
+    def stats(self):
+        """ Count the samples the policy has seen.
+
+        Returns:
+            dict: Number of samples ``sent`` and ``shed``
+        """
+
+        return {'sent': self.sent, 'shed': self.shed}
+
+
+class TokenBucket(RatePolicy):
+    """
+    Send at most ``rate`` samples per second on average, allowing
+    bursts of up to ``burst`` samples. Samples over the limit are
+    dropped.
+
+    Args:
+        rate (float): Samples per second
+        burst (int): Maximum number of samples sent back to back
+    """
+
+    def __init__(self, rate, burst=1):
+        super(TokenBucket, self).__init__()
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time()
+
+    def admit(self, data, send):
+        now = time()
+        with self._lock:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens < 1:
+                self.shed += 1
+                return
+            self._tokens -= 1
+            self.sent += 1
+        send(data)
+
+
+class Downsample(RatePolicy):
+    """
+    Send the first sample of every ``interval`` seconds and drop the
+    rest.
+
+    Args:
+        interval (float): Minimum number of seconds between samples
+    """
+
+    def __init__(self, interval):
+        super(Downsample, self).__init__()
+        self.interval = interval
+        self._last = None
+
+    def admit(self, data, send):
+        now = time()
+        with self._lock:
+            if self._last is not None and now - self._last < self.interval:
+                self.shed += 1
+                return
+            self._last = now
+            self.sent += 1
+        send(data)
+
+
+class Latest(RatePolicy):
+    """
+    Send the most recent sample every ``interval`` seconds.
+
+    A sample that arrives once the interval has passed is sent right
+    away. Otherwise it is held and sent when the interval ends, replacing
+    any sample that was already being held. Unlike :class:`Downsample`,
+    the last sample of a burst is never lost.
+
+    Args:
+        interval (float): Minimum number of seconds between samples
+    """
+
+    def __init__(self, interval):
+        super(Latest, self).__init__()
+        self.interval = interval
+        self._last = None
+        self._pending = None
+        self._timer = None
+
+    def admit(self, data, send):
+        now = time()
+        with self._lock:
+            if self._timer is not None:
+                self._pending = (data, send)
+                self.shed += 1
+                return
+            if self._last is None or now - self._last >= self.interval:
+                self._last = now
+                self.sent += 1
+            else:
+                self._pending = (data, send)
+                self._timer = Timer(self._last + self.interval - now,
+                                    self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        send(data)
+
+    def _flush(self):
+        with self._lock:
+            data, send = self._pending
+            self._pending = self._timer = None
+            self._last = time()
+            self.sent += 1
+        send(data)
+
+
+class Deadband(RatePolicy):
+    """
+    Drop samples that haven't changed significantly since the last one
+    that was sent.
+
+    Samples are compared field by field, through nested dicts and lists,
+    against the last sample that was sent. A number has changed when it
+    differs from the sent value by more than the larger of its
+    ``absolute`` threshold and its ``relative`` threshold times the
+    magnitude of the sent value. Numbers without any threshold, and all
+    other values, have changed when they are not equal. A change in the
+    shape of the data (keys, list lengths or types) always counts.
+
+    Thresholds for individual fields are given in ``fields`` keyed by
+    dotted path, e.g. ``'position.x'``. A path to a dict or list applies
+    to everything inside it and list items can be addressed by index,
+    e.g. ``'joints.0'``. The most specific path wins. A threshold is
+    either a number, which is taken as an absolute threshold, or a dict
+    with ``absolute`` and/or ``relative`` keys.
+
+    Args:
+        absolute (float): Default absolute threshold for numbers
+        relative (float): Default relative threshold for numbers
+        fields (dict): Thresholds by field path
+        max_silence (float): Send a sample anyway if none has been sent
+            for this many seconds
+
+    **Usage:**
+
+    .. code-block:: python
+
+        Deadband(
+            fields={'battery': 0.5, 'joints': {'relative': 0.01}},
+            max_silence=10
+        )
+    """
+
+    def __init__(self, absolute=None, relative=None, fields=None,
+                 max_silence=None):
+        super(Deadband, self).__init__()
+        self.max_silence = max_silence
+        self._default = (absolute or 0, relative or 0)
+        self._fields = {}
+        for path, threshold in (fields or {}).iteritems():
+            if isinstance(threshold, dict):
+                threshold = (
+                    threshold.get('absolute') or 0,
+                    threshold.get('relative') or 0
+                )
+            else:
+                threshold = (threshold, 0)
+            self._fields[tuple(path.split('.'))] = threshold
+        self._last = None
+        self._last_sent = None
+
+    def admit(self, data, send):
+        now = time()
+        with self._lock:
+            if self._last_sent is not None and (
+                self.max_silence is None or
+                now - self._last_sent < self.max_silence
+            ) and not self._changed(self._last, data, (), self._default):
+                self.shed += 1
+                return
+            self._last = deepcopy(data)
+            self._last_sent = now
+            self.sent += 1
+        send(data)
+
+    def _changed(self, old, new, path, threshold):
+        threshold = self._fields.get(path, threshold)
+
+        if isinstance(new, dict):
+            if not isinstance(old, dict) or len(old) != len(new):
+                return True
+            for key, value in new.iteritems():
+                if key not in old or self._changed(
+                    old[key], value, path + (str(key),), threshold
+                ):
+                    return True
+            return False
+
+        if isinstance(new, (list, tuple)):
+            if not isinstance(old, (list, tuple)) or len(old) != len(new):
+                return True
+            for i, value in enumerate(new):
+                if self._changed(old[i], value, path + (str(i),), threshold):
+                    return True
+            return False
+
+        if isinstance(new, Number) and not isinstance(new, bool) and \
+                isinstance(old, Number) and not isinstance(old, bool):
+            absolute, relative = threshold
+            return abs(new - old) > max(absolute, relative * abs(old))
+
+        return type(old) != type(new) or old != new
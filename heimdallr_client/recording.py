@@ -0,0 +1,294 @@
+import json
+import mmap
+import struct
+from collections import namedtuple
+from threading import Lock
+from time import time, sleep
+
+from packets import _json_default
+
+__all__ = ['Recorder', 'Replayer', 'Record', 'RECEIVED', 'SENT']
+
+RECEIVED = 0
+SENT = 1
+
+_MAGIC = 'HDLRLOG1'
+# Record length (excluding this field), time, direction, payload kind and
+# message name length
+_HEADER = struct.Struct('<IdBBH')
+# Record offset in the log and time
+_INDEX = struct.Struct('<Qd')
+_JSON = 0
+_BINARY = 1
+# Messages that belong to a connection rather than to the traffic on it
+_LIFECYCLE = frozenset([
+    'connect', 'reconnect', 'disconnect', 'authorize', 'auth-success'
+])
+_REDACTED = '<redacted>'
+
+Record = namedtuple('Record', ['time', 'direction', 'message_name', 'args'])
+
+
+def _default(obj):
+    """ ``default`` for :py:func:`json.dumps` that leaves out callables,
+    like socket.io acknowledgement callbacks.
+    """
+
+    if callable(obj):
+        return None
+    return _json_default(obj)
+
+
+class Recorder(object):
+    """
+    Writes the packets a client sends and receives to a log file.
+
+    The log is append-only. Each record is a fixed header (length, time,
+    direction, payload kind and message name length) followed by the
+    message name and the payload, which is either the JSON encoded
+    arguments of the message or raw bytes for binary stream data. Next to
+    the log, ``<path>.idx`` gets the offset and time of every record so
+    a :class:`Replayer` can seek by time.
+
+    Received packets are recorded when the client dispatches them to its
+    listeners, so only message names the client listens to are
+    recorded. Sent packets are recorded when the emit executor sends
+    them. The token of ``authorize`` messages is never written to the
+    log, and acknowledgement callbacks are left out.
+
+    Args:
+        path (str): Log file to append to
+        clients (list): Clients to start recording right away
+
+    **Usage:**
+
+    .. code-block:: python
+
+        with Recorder('traffic.log', [consumer]):
+            consumer.run(60)
+    """
+
+    def __init__(self, path, clients=()):
+        self.path = path
+        self.clients = []
+        self._lock = Lock()
+        self._log = open(path, 'ab')
+        self._index = open(path + '.idx', 'ab')
+        self._offset = self._log.tell()
+        if not self._offset:
+            self._log.write(_MAGIC)
+            self._offset = len(_MAGIC)
+        for client in clients:
+            self.attach(client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, client):
+        """ Start recording the traffic of ``client``.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Client to record
+        """
+
+        client._recorder = self
+        self.clients.append(client)
+
+    def close(self):
+        """ Stop recording and close the log. """
+
+        for client in self.clients:
+            if client._recorder is self:
+                client._recorder = None
+        self.clients = []
+        with self._lock:
+            self._log.close()
+            self._index.close()
+
+    def record(self, direction, message_name, args):
+        """ Append a packet to the log.
+
+        Args:
+            direction (int): :data:`RECEIVED` or :data:`SENT`
+            message_name (str): Name of the socket.io message
+            args (tuple): Arguments of the message
+        """
+
+        args = tuple(arg for arg in args if not callable(arg))
+        if message_name == 'authorize':
+            args = tuple(
+                dict(arg, token=_REDACTED)
+                if isinstance(arg, dict) and 'token' in arg else arg
+                for arg in args
+            )
+        if len(args) == 1 and isinstance(args[0], bytearray):
+            kind, payload = _BINARY, str(args[0])
+        else:
+            kind, payload = _JSON, json.dumps(
+                args, separators=(',', ':'), default=_default
+            )
+        name = message_name.encode('utf-8')
+        now = time()
+        header = _HEADER.pack(
+            _HEADER.size - 4 + len(name) + len(payload),
+            now, direction, kind, len(name)
+        )
+
+        with self._lock:
+            if self._log.closed:
+                return
+            self._log.write(header)
+            self._log.write(name)
+            self._log.write(payload)
+            self._index.write(_INDEX.pack(self._offset, now))
+            self._offset += len(header) + len(name) + len(payload)
+
+
+class Replayer(object):
+    """
+    Reads a log written by :class:`Recorder` and plays it back.
+
+    The log is memory-mapped rather than read into memory, so large logs
+    can be replayed or searched cheaply.
+
+    Args:
+        path (str): Log file to read
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._log = self._map(path)
+        self._index = self._map(path + '.idx')
+        if self._log is not None and self._log[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('%s is not a Heimdallr traffic log' % path)
+
+    @staticmethod
+    def _map(path):
+        try:
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            # Missing or empty file
+            return None
+
+    def close(self):
+        """ Unmap the log. """
+
+        for mapped in [self._log, self._index]:
+            if mapped is not None:
+                mapped.close()
+
+    def __len__(self):
+        if self._index is None:
+            return 0
+        return len(self._index) // _INDEX.size
+
+    def __iter__(self):
+        return self.records()
+
+    def _seek(self, t):
+        """ Offset of the first record at or after ``t``. """
+
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _INDEX.unpack_from(self._index, mid * _INDEX.size)[1] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self):
+            return len(self._log)
+        return _INDEX.unpack_from(self._index, lo * _INDEX.size)[0]
+
+    def records(self, since=None, until=None):
+        """ Iterate over the records in the log.
+
+        Args:
+            since (float): Skip records before this time
+            until (float): Stop at the first record after this time
+
+        Returns:
+            iterator: :class:`Record` tuples
+        """
+
+        log = self._log
+        if log is None:
+            return
+        offset = len(_MAGIC)
+        if since is not None and self._index is not None:
+            offset = self._seek(since)
+
+        while offset + _HEADER.size <= len(log):
+            length, t, direction, kind, name_length = \
+                _HEADER.unpack_from(log, offset)
+            end = offset + 4 + length
+            if end > len(log):
+                # Partially written record
+                return
+            if until is not None and t > until:
+                return
+            start = offset + _HEADER.size
+            name = log[start:start + name_length].decode('utf-8')
+            payload = log[start + name_length:end]
+            if kind == _BINARY:
+                args = (bytearray(payload),)
+            else:
+                args = tuple(json.loads(payload))
+            offset = end
+            if since is None or t >= since:
+                yield Record(t, direction, name, args)
+
+    def replay(self, client, speed=1.0, direction=RECEIVED, since=None,
+               until=None, message_names=None):
+        """ Feed recorded packets back into a client.
+
+        Received packets are dispatched to the client's listeners as if
+        they had just arrived. Sent packets are queued to be sent again,
+        e.g. to a local test server. Connection lifecycle messages like
+        ``connect``, ``authorize`` and ``auth-success`` are skipped.
+
+        Args:
+            client (:class:`Client <heimdallr_client.clients.Client>`):
+                Client to feed the packets into
+            speed (float): Playback speed relative to the recording.
+                ``None`` replays as fast as possible.
+            direction (int): Replay :data:`RECEIVED` or :data:`SENT`
+                packets
+            since (float): Skip records before this time
+            until (float): Stop at the first record after this time
+            message_names (list): Only replay these messages
+
+        Returns:
+            int: Number of packets replayed
+        """
+
+        started = time()
+        first = None
+        count = 0
+        for record in self.records(since, until):
+            if record.direction != direction or \
+                    record.message_name in _LIFECYCLE or \
+                    (message_names and
+                     record.message_name not in message_names):
+                continue
+
+            if speed:
+                if first is None:
+                    first = record.time
+                delay = (record.time - first) / speed - (time() - started)
+                if delay > 0:
+                    sleep(delay)
+
+            if direction == RECEIVED:
+                client.connection._find_packet_callback(
+                    record.message_name
+                )(*record.args)
+            else:
+                client._emit(record.message_name, *record.args)
+            count += 1
+
+        return count
@@ -1,2 +1,44 @@
 AUTH_SOURCE = 'heimdallr'
-URL = 'https://heimdallr.co'
\ No newline at end of file
+URL = 'https://heimdallr.co'
+EMIT_WORKERS = 2
+EMIT_QUANTUM = 16
+MAX_IN_FLIGHT = 64
+# Priority lanes for outgoing packets, highest priority first, with the
+# number of packets each lane may send per round
+EMIT_LANES = [('control', 8), ('event', 4), ('sensor', 2), ('stream', 1)]
+# Size in bytes of the shared-memory ring buffer of a local gateway, and the
+# number of local consumers that can read from it
+GATEWAY_CAPACITY = 4 * 1024 * 1024
+GATEWAY_MAX_READERS = 32
+# Seconds closing a client waits for a listener that its inbox is calling
+INBOX_CLOSE_TIMEOUT = 5
+# Subtype of the control and event packets used to measure clock offsets
+CLOCK_SYNC_SUBTYPE = 'clockSync'
+# Seconds a consumer waits for a provider to complete a control
+CONTROL_TIMEOUT = 60
+# Longest time in seconds a receive loop waits before looking at its clients
+# again when nothing wakes it
+LOOP_INTERVAL = 1.0
+# Seconds closing a client waits for its receive loop to let go of it
+LOOP_STOP_TIMEOUT = 5
+# Seconds an endpoint has to authorize a client before it is failed over, and
+# seconds a failed endpoint isn't tried again, doubled for every failure in a
+# row
+AUTH_TIMEOUT = 10
+ENDPOINT_COOLDOWN = 30
+# Consumer connections a cluster client keeps per node, and the providers a
+# consumer is subscribed to before another one is opened
+CLUSTER_MAX_CONSUMERS = 4
+CLUSTER_PROVIDERS_PER_CONSUMER = 256
+# Largest stream chunk in bytes a consumer decompresses
+STREAM_MAX_CHUNK = 64 * 1024 * 1024
+# Event data whose JSON is longer than this many characters is sent in
+# fragments of at most this size, with the subtype the fragments are sent as.
+# Off by default, since the server and consumers have to support fragments.
+FRAGMENT_SIZE = None
+FRAGMENT_SUBTYPE = 'fragment'
+# Seconds a consumer waits for the rest of a fragmented event, and the number
+# of events and characters it buffers while waiting
+FRAGMENT_TIMEOUT = 30
+FRAGMENT_MAX_EVENTS = 64
+FRAGMENT_MAX_BYTES = 16 * 1024 * 1024
@@ -0,0 +1,264 @@
+from multiprocessing import Process, Queue, cpu_count
+from Queue import Empty
+
+from clients import Consumer
+from hashring import HashRing
+
+__all__ = ['ShardedConsumer']
+
+
+def _run_worker(token, setup, consumer_factory, connect_kwargs, commands,
+                results, poll_interval):
+    """ Main loop of a :class:`ShardedConsumer` worker process. """
+
+    consumer = consumer_factory(token)
+    setup(consumer, results.put)
+    consumer.connect(**connect_kwargs)
+
+    while True:
+        try:
+            while True:
+                command = commands.get_nowait()
+                action = command[0]
+                if action == 'stop':
+                    consumer.close()
+                    return
+                elif action == 'subscribe':
+                    uuid, filter_ = command[1:]
+                    consumer.subscribe(uuid)
+                    if filter_:
+                        consumer.set_filter(uuid, dict(filter_))
+                elif action == 'filter':
+                    uuid, filter_ = command[1:]
+                    # An empty filter lifts the last one
+                    consumer.set_filter(uuid, dict(filter_ or {}))
+                elif action == 'unsubscribe':
+                    consumer.unsubscribe(command[1])
+        except Empty:
+            pass
+        consumer.run(seconds=poll_interval)
+
+
+class ShardedConsumer(object):
+    """
+    Spreads the providers a consumer follows across worker processes.
+
+    A single :class:`Consumer <heimdallr_client.clients.Consumer>` is
+    limited to one core by the GIL. A ``ShardedConsumer`` runs a pool of
+    worker processes, each with its own consumer connection, and assigns
+    every provider to one of them by consistent hashing of its UUID.
+    Adding or removing a worker only moves the providers whose hash
+    segment changes owner; they are unsubscribed on the old worker and
+    subscribed, with their filter, on the new one.
+
+    ``setup`` is called in each worker with that worker's consumer and a
+    function that puts a result on the shared :attr:`results` queue. It
+    should register the listeners that process packets.
+
+    Args:
+        token (str): Authentication token
+        setup (function): Called with the worker's consumer and a function
+            that reports results
+        workers (int): Number of worker processes. Defaults to the number
+            of cores.
+        connect_kwargs (dict): Passed to each consumer's
+            :meth:`connect <heimdallr_client.clients.Client.connect>`
+        consumer_factory (function): Creates the consumer of a worker from
+            the token
+        poll_interval (float): Seconds a worker runs its consumer between
+            checks for new assignments
+        replicas (int): Positions per worker on the hash ring
+
+    **Usage:**
+
+    .. code-block:: python
+
+        def setup(consumer, report):
+            consumer.on('sensor', lambda packet: report(process(packet)))
+
+        with ShardedConsumer(token, setup, workers=4) as sharded:
+            for uuid in uuids:
+                sharded.add_provider(uuid, {'sensor': ['imu']})
+            while True:
+                handle(sharded.results.get())
+    """
+
+    def __init__(self, token, setup, workers=None, connect_kwargs=None,
+                 consumer_factory=Consumer, poll_interval=0.1, replicas=100):
+        self.token = token
+        self.setup = setup
+        self.connect_kwargs = connect_kwargs or {}
+        self.consumer_factory = consumer_factory
+        self.poll_interval = poll_interval
+        self.results = Queue()
+        self._ring = HashRing(replicas=replicas)
+        self._workers = {}
+        self._filters = {}
+        self._assignment = {}
+        self._worker_count = 0
+
+        for _ in range(workers or cpu_count()):
+            self.add_worker()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def workers(self):
+        """ Names of the running workers. """
+
+        return sorted(self._workers)
+
+    def worker_for(self, uuid):
+        """ Find the worker that handles a provider.
+
+        Args:
+            uuid (str): UUID of the provider
+
+        Returns:
+            str: Name of the worker
+        """
+
+        return self._ring.get(uuid)
+
+    def assignment(self):
+        """ Map every worker to the providers it handles.
+
+        Returns:
+            dict: Lists of provider UUIDs by worker name
+        """
+
+        assignment = dict((name, []) for name in self._workers)
+        for uuid, name in self._assignment.iteritems():
+            assignment[name].append(uuid)
+        return assignment
+
+    def add_provider(self, uuid, filter_=None):
+        """ Subscribe to a provider on the worker it hashes to.
+
+        Adding a provider again with another filter sets the new filter
+        on its worker.
+
+        Args:
+            uuid (str): UUID of the provider
+            filter_ (dict): Filter to set for the provider, as for
+                :meth:`Consumer.set_filter
+                <heimdallr_client.clients.Consumer.set_filter>`
+        """
+
+        changed = uuid in self._filters and self._filters[uuid] != filter_
+        self._filters[uuid] = filter_
+        # Other providers only move when a worker is added or removed
+        self._place(uuid, filter_, changed)
+
+    def remove_provider(self, uuid):
+        """ Unsubscribe from a provider.
+
+        Args:
+            uuid (str): UUID of the provider
+        """
+
+        self._filters.pop(uuid, None)
+        name = self._assignment.pop(uuid, None)
+        if name is not None:
+            self._send(name, ('unsubscribe', uuid))
+
+    def add_worker(self):
+        """ Start another worker and move its share of providers to it.
+
+        Returns:
+            str: Name of the new worker
+        """
+
+        name = 'worker-%d' % self._worker_count
+        self._worker_count += 1
+        commands = Queue()
+        process = Process(
+            target=_run_worker,
+            name=name,
+            args=(
+                self.token, self.setup, self.consumer_factory,
+                self.connect_kwargs, commands, self.results,
+                self.poll_interval
+            )
+        )
+        process.daemon = True
+        process.start()
+        self._workers[name] = (process, commands)
+        self._ring.add(name)
+        self._rebalance()
+        return name
+
+    def remove_worker(self, name=None, timeout=5):
+        """ Stop a worker after moving its providers to the others.
+
+        A worker can't exit while it still has results to put on
+        :attr:`results`, so keep consuming results while workers stop.
+        Workers that don't stop within ``timeout`` are terminated.
+
+        Args:
+            name (str): Worker to stop. Defaults to the newest one.
+            timeout (float): Seconds to wait for the worker to exit
+        """
+
+        if name is None:
+            name = max(self._workers, key=lambda n: int(n.split('-')[1]))
+        self._ring.remove(name)
+        self._rebalance()
+        process, commands = self._workers.pop(name)
+        commands.put(('stop',))
+        self._join(process, timeout)
+
+    def close(self, timeout=5):
+        """ Stop every worker.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to exit
+                before it is terminated
+        """
+
+        for name, (process, commands) in self._workers.items():
+            commands.put(('stop',))
+        for name, (process, commands) in self._workers.items():
+            self._join(process, timeout)
+        self._workers = {}
+        self._ring = HashRing(replicas=self._ring.replicas)
+        self._assignment = {}
+
+    @staticmethod
+    def _join(process, timeout):
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    def _send(self, name, command):
+        self._workers[name][1].put(command)
+
+    def _rebalance(self):
+        for uuid, filter_ in self._filters.iteritems():
+            self._place(uuid, filter_)
+
+    def _place(self, uuid, filter_, changed=False):
+        """ Move a provider to the worker it hashes to, if it isn't there.
+
+        A provider that stays on its worker only has its filter sent
+        again if it ``changed``.
+        """
+
+        name = self._ring.get(uuid)
+        old = self._assignment.get(uuid)
+        if name == old:
+            if changed and name is not None:
+                self._send(name, ('filter', uuid, filter_))
+            return
+        if old in self._workers:
+            self._send(old, ('unsubscribe', uuid))
+        if name is None:
+            self._assignment.pop(uuid, None)
+        else:
+            self._send(name, ('subscribe', uuid, filter_))
+            self._assignment[uuid] = name
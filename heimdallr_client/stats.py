@@ -0,0 +1,106 @@
+import math
+from threading import Lock
+
+__all__ = ['Histogram']
+
+
+class Histogram(object):
+    """
+    A fixed-memory histogram of latencies in seconds.
+
+    Values are counted in logarithmic buckets, ``resolution`` buckets per
+    doubling, so percentiles are accurate to within about
+    ``2 ** (1.0 / resolution) - 1`` of the true value no matter how many
+    values are recorded. Recording is thread safe.
+
+    Args:
+        resolution (int): Buckets per doubling of the value
+        minimum (float): Values smaller than this share the first bucket
+    """
+
+    def __init__(self, resolution=4, minimum=1e-6):
+        self.resolution = resolution
+        self.minimum = minimum
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget every recorded value. """
+
+        with self._lock:
+            self._buckets = {}
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def record(self, value):
+        """ Count ``value`` in the histogram.
+
+        Args:
+            value (float): Latency in seconds
+        """
+
+        if value > self.minimum:
+            bucket = int(
+                math.log(value / self.minimum, 2) * self.resolution
+            ) + 1
+        else:
+            bucket = 0
+
+        with self._lock:
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    @property
+    def mean(self):
+        with self._lock:
+            return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """ Estimate the value below which ``percent`` of values fall.
+
+        Args:
+            percent (float): Percentile between 0 and 100
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile or
+            ``None`` if nothing has been recorded
+        """
+
+        with self._lock:
+            if not self.count:
+                return None
+            rank = percent / 100.0 * self.count
+            seen = 0
+            for bucket in sorted(self._buckets):
+                seen += self._buckets[bucket]
+                if seen >= rank:
+                    upper = self.minimum * 2 ** (
+                        float(bucket) / self.resolution
+                    )
+                    return min(max(upper, self.min), self.max)
+            return self.max
+
+    def snapshot(self):
+        """ Summarize the histogram.
+
+        Returns:
+            dict: ``count``, ``mean``, ``min``, ``max``, ``p50``, ``p90``
+            and ``p99`` of the recorded values
+        """
+
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)
+        }
@@ -0,0 +1,168 @@
+"""
+Per-chunk compression of binary stream data.
+
+``zlib`` is always available. ``lz4`` and ``zstd`` are used when the
+optional ``lz4`` and ``zstandard`` packages are installed, e.g. with
+``pip install py-heimdallr-client[streams]``.
+"""
+import struct
+import zlib
+
+from settings import STREAM_MAX_CHUNK
+
+__all__ = ['encode_chunk', 'decode_chunk', 'available_codecs']
+
+# Magic, framing version, codec id and length of the uncompressed data
+_HEADER = struct.Struct('<2sBBI')
+_MAGIC = 'HZ'
+_VERSION = 1
+# Stored as is, for chunks that don't get any smaller
+_RAW = 'raw'
+
+
+def _lz4():
+    import lz4.block
+    return (
+        lambda data, level: lz4.block.compress(
+            data, store_size=False,
+            **({} if level is None else
+               {'mode': 'high_compression', 'compression': level})
+        ),
+        lambda data, size: lz4.block.decompress(data, uncompressed_size=size)
+    )
+
+
+def _zstd():
+    import zstandard
+    return (
+        lambda data, level: zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compress(data),
+        lambda data, size: zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=size
+        )
+    )
+
+
+def _zlib():
+    return (
+        lambda data, level: zlib.compress(data, 6 if level is None else level),
+        # Stops at the size from the header, so a small chunk can't expand
+        # without bound
+        lambda data, size: zlib.decompressobj().decompress(data, max(size, 1))
+    )
+
+
+def _raw():
+    return lambda data, level: data, lambda data, size: data
+
+
+# Codec names by id, which is what goes on the wire; never reuse an id
+_CODEC_NAMES = {0: _RAW, 1: 'zlib', 2: 'lz4', 3: 'zstd'}
+_CODEC_IDS = dict((name, id_) for id_, name in _CODEC_NAMES.iteritems())
+_LOADERS = {_RAW: _raw, 'zlib': _zlib, 'lz4': _lz4, 'zstd': _zstd}
+_codecs = {}
+
+
+def _codec(name):
+    """ Get the ``(compress, decompress)`` functions of a codec.
+
+    Raises:
+        ValueError: If the codec is unknown or its package isn't installed
+    """
+
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in _LOADERS:
+            raise ValueError('Unknown stream codec %r' % name)
+        try:
+            codec = _codecs[name] = _LOADERS[name]()
+        except ImportError:
+            raise ValueError(
+                'The %s stream codec needs a package that is not installed'
+                % name
+            )
+    return codec
+
+
+def available_codecs():
+    """ List the codecs that can be used here.
+
+    Returns:
+        list: Codec names
+    """
+
+    available = []
+    for name in sorted(_CODEC_IDS, key=_CODEC_IDS.get):
+        try:
+            _codec(name)
+        except ValueError:
+            continue
+        if name != _RAW:
+            available.append(name)
+    return available
+
+
+def encode_chunk(data, codec, level=None):
+    """ Compress a chunk and frame it with a header naming the codec.
+
+    Chunks that don't get smaller are framed uncompressed, so a consumer
+    never pays for decompressing them.
+
+    Args:
+        data (str): The chunk
+        codec (str): ``'zlib'``, ``'lz4'`` or ``'zstd'``
+        level (int): Compression level, or ``None`` for the codec's
+            default
+
+    Returns:
+        str: The framed chunk
+
+    Raises:
+        ValueError: If the codec isn't available
+    """
+
+    data = str(data)
+    compressed = _codec(codec)[0](data, level)
+    if len(compressed) >= len(data):
+        codec, compressed = _RAW, data
+    return _HEADER.pack(
+        _MAGIC, _VERSION, _CODEC_IDS[codec], len(data)
+    ) + compressed
+
+
+def decode_chunk(data):
+    """ Undo :func:`encode_chunk`.
+
+    Data that isn't a framed chunk is returned unchanged.
+
+    Args:
+        data (str or bytearray): Received stream data
+
+    Returns:
+        The chunk, of the same type as ``data``
+
+    Raises:
+        ValueError: If the chunk uses a codec that isn't available here,
+            is corrupt or doesn't decompress to the size in its header
+    """
+
+    if len(data) < _HEADER.size or data[:2] != _MAGIC:
+        return data
+    magic, version, codec_id, size = _HEADER.unpack_from(buffer(data))
+    name = _CODEC_NAMES.get(codec_id)
+    if version != _VERSION or name is None:
+        return data
+    if size > STREAM_MAX_CHUNK:
+        raise ValueError('Stream chunk of %d bytes is too large' % size)
+    decompress = _codec(name)[1]
+    try:
+        chunk = decompress(str(data[_HEADER.size:]), size)
+    except Exception as e:
+        raise ValueError('Corrupt %s stream chunk: %s' % (name, e))
+    if len(chunk) != size:
+        raise ValueError(
+            '%s stream chunk has %d bytes instead of %d'
+            % (name, len(chunk), size)
+        )
+    return bytearray(chunk) if isinstance(data, bytearray) else chunk
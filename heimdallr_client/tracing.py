@@ -0,0 +1,219 @@
+from collections import deque
+from threading import Lock
+from time import time
+
+from packets import Packet
+from settings import CLOCK_SYNC_SUBTYPE
+from stats import Histogram
+
+__all__ = ['ClockOffset', 'LatencyTracer']
+
+# Stages of a packet's trip, from its timestamps
+_STAGES = (
+    # send_* call to the emit executor sending it, on the provider
+    ('queue', 'traceSent', 'traceEmitted'),
+    # Provider emit to consumer receive, across hosts
+    ('transit', 'traceEmitted', 'traceReceived'),
+    # Consumer receive to the listeners being called, e.g. in an inbox
+    ('dispatch', 'traceReceived', 'traceDispatched'),
+    ('total', 'traceSent', 'traceDispatched'),
+)
+# Timestamps taken with the provider's clock
+_PROVIDER_STAMPS = frozenset(['traceSent', 'traceEmitted'])
+
+
+def _stamp(packet, key, value):
+    if isinstance(packet, Packet):
+        if packet.fields is None:
+            packet.fields = {}
+        packet.fields[key] = value
+    else:
+        packet[key] = value
+
+
+class ClockOffset(object):
+    """
+    Estimates how far a remote clock is ahead of the local one.
+
+    Each sample is an NTP-style exchange: a request sent at local time
+    ``t0``, received at remote time ``t1``, answered at remote time
+    ``t2`` and the answer received at local time ``t3``. Of the last
+    ``window`` samples, the one with the shortest round trip is trusted,
+    since it had the least room for asymmetric delays.
+
+    Args:
+        window (int): Number of samples to choose from
+    """
+
+    def __init__(self, window=8):
+        self._samples = deque(maxlen=window)
+
+    def add(self, t0, t1, t2, t3):
+        """ Add an exchange.
+
+        Args:
+            t0 (float): Local time the request was sent
+            t1 (float): Remote time the request was received
+            t2 (float): Remote time the answer was sent
+            t3 (float): Local time the answer was received
+        """
+
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        self._samples.append((rtt, offset))
+
+    @property
+    def offset(self):
+        """ Seconds the remote clock is ahead, or ``0.0`` without samples.
+        """
+
+        if not self._samples:
+            return 0.0
+        return min(self._samples)[1]
+
+    @property
+    def rtt(self):
+        """ Shortest round trip in the window, or ``None``. """
+
+        if not self._samples:
+            return None
+        return min(self._samples)[0]
+
+
+class LatencyTracer(object):
+    """
+    Breaks down where time goes between a provider and a consumer.
+
+    Providers created with ``trace=True`` stamp their ``event`` and
+    ``sensor`` packets with the time ``send_*`` was called
+    (``traceSent``) and the time the emit executor sent them
+    (``traceEmitted``). The tracer stamps them on the consumer when they
+    are received (``traceReceived``) and when their listeners are called
+    (``traceDispatched``), and records the time between the stamps in
+    :attr:`latency` histograms by message name and subtype. Only
+    packets the consumer has listeners for are traced. The stages are:
+
+    * ``queue``: waiting in the provider's emit queue
+    * ``transit``: from the provider through the server to the consumer
+    * ``dispatch``: waiting on the consumer, e.g. in its inbox
+    * ``total``: from ``send_*`` to the listeners
+
+    Stages that span both hosts are corrected for the difference between
+    their clocks. :meth:`sync` measures it by sending the provider a
+    ``clockSync`` control, which tracing providers answer with an event
+    of the same subtype. Until a provider has been synced its clock is
+    assumed to match the consumer's. The server must relay the trace
+    fields and the provider's schemas must allow the ``clockSync``
+    subtype.
+
+    Args:
+        consumer (:class:`Consumer <heimdallr_client.clients.Consumer>`):
+            Consumer to trace
+        window (int): Clock sync samples kept per provider
+    """
+
+    def __init__(self, consumer, window=8):
+        self.consumer = consumer
+        self.window = window
+        self.offsets = {}
+        self.latency = {}
+        self._lock = Lock()
+        consumer._tracer = self
+        consumer.on('event', self._on_clock_sync, subtype=CLOCK_SYNC_SUBTYPE)
+
+    def close(self):
+        """ Stop tracing the consumer. """
+
+        if self.consumer._tracer is self:
+            self.consumer._tracer = None
+        self.consumer.remove_listener(
+            'event', self._on_clock_sync, subtype=CLOCK_SYNC_SUBTYPE
+        )
+
+    def sync(self, uuid):
+        """ Measure the clock offset of a provider.
+
+        Every call adds one sample to the provider's :class:`ClockOffset`
+        once the answer arrives, so call it periodically to follow drift.
+
+        Args:
+            uuid (str): UUID of the provider
+        """
+
+        self.consumer.send_control(uuid, CLOCK_SYNC_SUBTYPE, {'t0': time()})
+
+    def offset(self, uuid):
+        """ Seconds the clock of a provider is ahead of the consumer's.
+
+        Args:
+            uuid (str): UUID of the provider
+
+        Returns:
+            float: The estimated offset
+        """
+
+        estimator = self.offsets.get(uuid)
+        return 0.0 if estimator is None else estimator.offset
+
+    def stats(self):
+        """ Summarize the recorded latencies.
+
+        Returns:
+            dict: :meth:`Histogram.snapshot
+            <heimdallr_client.stats.Histogram.snapshot>` results by stage,
+            by ``(message_name, subtype)``
+        """
+
+        with self._lock:
+            return dict(
+                (key, dict(
+                    (stage, histogram.snapshot())
+                    for stage, histogram in stages.iteritems()
+                ))
+                for key, stages in self.latency.iteritems()
+            )
+
+    def received(self, message_name, args):
+        """ Called by the consumer when a packet arrives. """
+
+        packet = args[0] if args else None
+        if isinstance(packet, (dict, Packet)) and 'traceSent' in packet:
+            _stamp(packet, 'traceReceived', time())
+
+    def dispatched(self, message_name, args):
+        """ Called by the consumer just before a packet's listeners run. """
+
+        packet = args[0] if args else None
+        if not isinstance(packet, (dict, Packet)) or \
+                'traceReceived' not in packet:
+            return
+        _stamp(packet, 'traceDispatched', time())
+
+        offset = self.offset(packet.get('provider'))
+        key = (message_name, packet.get('subtype'))
+        with self._lock:
+            stages = self.latency.get(key)
+            if stages is None:
+                stages = self.latency[key] = dict(
+                    (stage, Histogram()) for stage, _, _ in _STAGES
+                )
+        for stage, start, end in _STAGES:
+            start_time, end_time = packet.get(start), packet.get(end)
+            if start_time is None or end_time is None:
+                continue
+            # Bring provider timestamps onto the consumer's clock
+            if start in _PROVIDER_STAMPS and end not in _PROVIDER_STAMPS:
+                start_time -= offset
+            stages[stage].record(end_time - start_time)
+
+    def _on_clock_sync(self, packet):
+        data = packet.get('data') or {}
+        t2 = packet.get('traceEmitted')
+        if 't0' not in data or 't1' not in data or t2 is None:
+            return
+        t3 = packet.get('traceReceived') or time()
+        uuid = packet.get('provider')
+        estimator = self.offsets.get(uuid)
+        if estimator is None:
+            estimator = self.offsets[uuid] = ClockOffset(self.window)
+        estimator.add(data['t0'], data['t1'], t2, t3)
@@ -1,13 +1,59 @@
+import calendar
 import inspect
-import requests
 import json
+import time
+from importlib import import_module
 from functools import partial
 from datetime import datetime
 from wrapt import decorator
 
+from futures import Future
 from settings import AUTH_SOURCE, URL
 
-__all__ = ['timestamp', 'on_ready', 'for_own_methods']
+__all__ = [
+    'timestamp', 'parse_timestamp', 'on_ready', 'for_own_methods',
+    'immediate', 'lazy_import'
+]
+
+
+class _LazyModule(object):
+    """ Module proxy returned by :func:`lazy_import`. """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self.__dict__['_module'] is None:
+            self.__dict__['_module'] = import_module(self.__dict__['_name'])
+        return self.__dict__['_module']
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+def lazy_import(name):
+    """ Defer importing a module until one of its attributes is used.
+
+    Heavy dependencies like ``requests`` and ``socketIO_client`` are only
+    needed once a client actually talks to the network. Importing them
+    through this proxy keeps ``import heimdallr_client`` cheap for
+    short-lived processes.
+
+    Args:
+        name (str): Absolute name of the module to import
+
+    Returns:
+        object: A proxy that imports the module on first attribute access
+    """
+
+    return _LazyModule(name)
+
+
+requests = lazy_import('requests')
 
 
 def timestamp():
@@ -20,6 +66,39 @@ def timestamp():
     return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
+_parsed_seconds = {}
+
+
+def parse_timestamp(t):
+    """ Converts an ISO 8601 UTC timestamp to seconds since the epoch.
+
+    Accepts the timestamps made by :func:`timestamp` as well as ones
+    with fractional seconds like ``2015-07-06T16:44:48.123Z``. Packets
+    sent in the same second share most of their timestamp, so the
+    expensive part of the parsing is cached.
+
+    Args:
+        t (str): ISO 8601 timestamp
+
+    Returns:
+        float: Seconds since the epoch
+    """
+
+    seconds = _parsed_seconds.get(t[:19])
+    if seconds is None:
+        if len(_parsed_seconds) > 1024:
+            _parsed_seconds.clear()
+        seconds = _parsed_seconds[t[:19]] = calendar.timegm(
+            time.strptime(t[:19], '%Y-%m-%dT%H:%M:%S')
+        )
+    fraction = t[19:].rstrip('Z')
+    return seconds + float(fraction) if fraction else float(seconds)
+
+
+# Keyword arguments that ask an ``on_ready`` method for a future
+_FUTURE_ARGS = ('ack', 'completion')
+
+
 @decorator
 def on_ready(method, self, args, kwargs):
     """ on_ready(method)
@@ -32,6 +111,13 @@ def on_ready(method, self, args, kwargs):
     methods will be called in the same order that they were
     originally called in.
 
+    Decorated methods return ``self`` so that calls can be chained.
+    The exception is methods called with ``ack=True`` or
+    ``completion=True``: the method is given a :class:`Future
+    <heimdallr_client.futures.Future>` for that argument instead and
+    the future is returned. If both are requested, an ``(ack,
+    completion)`` tuple is returned.
+
     Args:
         method (function): Class method to decorate
 
@@ -39,11 +125,23 @@ def on_ready(method, self, args, kwargs):
         function: The decorated function
     """
 
+    futures = []
+    for name in _FUTURE_ARGS:
+        if kwargs.get(name) is True:
+            kwargs[name] = future = Future()
+            futures.append(future)
+    if not futures:
+        result = self
+    elif len(futures) == 1:
+        result = futures[0]
+    else:
+        result = tuple(futures)
+
     if self.ready:
         method(*args, **kwargs)
     else:
         self.ready_callbacks.append(partial(method, *args, **kwargs))
-    return self
+    return result
 
 
 # From http://stackoverflow.com/a/30764825/4059062
@@ -55,6 +153,8 @@ def for_own_methods(method_decorator):
     methods in a class. The function decorator will only be applied
     to methods that are explicitly defined on the class. Any inherited
     methods that aren't overridden or altered will not be decorated.
+    Private and special methods (names starting with ``_``) and methods
+    marked with :func:`immediate` are left alone as well.
 
     Args:
         method_decorator (function): Method decorator to be applied to
@@ -66,7 +166,10 @@ def for_own_methods(method_decorator):
 
     def decorate(cls):
         def predicate(member):
-            return inspect.ismethod(member) and member.__name__ in cls.__dict__
+            return inspect.ismethod(member) and \
+                member.__name__ in cls.__dict__ and \
+                not member.__name__.startswith('_') and \
+                not getattr(member, '_immediate', False)
 
         for name, method in inspect.getmembers(cls, predicate):
             setattr(cls, name, method_decorator(method))
@@ -75,6 +178,23 @@ def for_own_methods(method_decorator):
     return decorate
 
 
+def immediate(method):
+    """ Keep :func:`for_own_methods` from decorating ``method``.
+
+    For public methods that must run and return their own result even
+    before the client is ready.
+
+    Args:
+        method (function): Method to leave undecorated
+
+    Returns:
+        function: ``method``
+    """
+
+    method._immediate = True
+    return method
+
+
 def post_schemas(token, uuids, packet_schemas):
     results = {}
     for uuid in uuids:
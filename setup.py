@@ -1,11 +1,17 @@
+import re
 from setuptools import setup, find_packages
 
 with open('README.rst') as f:
     long_description = f.read()
 
+with open('heimdallr_client/__init__.py') as f:
+    version = re.search(
+        r"^__version__ = '([^']+)'", f.read(), re.MULTILINE
+    ).group(1)
+
 setup(
     name='py-heimdallr-client',
-    version='0.0.2',
+    version=version,
     description='Python API for Heimdallr',
     long_description=long_description,
     url='https://github.com/ElementRobot/py-heimdallr-client',
@@ -29,6 +35,10 @@ setup(
         'wrapt',
         'pyasn1'
     ],
+    extras_require={
+        'aggregation': ['numpy'],
+        'streams': ['lz4', 'zstandard']
+    },
     test_suite='tests',
     tests_require=['coverage'],
     scripts=['bin/post-schemas']
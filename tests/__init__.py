@@ -1,12 +1,39 @@
 import os
+import sys
+import shutil
+import tempfile
 import unittest
 import json
-from subprocess import Popen, PIPE
-from threading import Event
+import struct
+from multiprocessing import Process, Queue
+from subprocess import Popen, PIPE, check_output
+from threading import Event, Thread, active_count, enumerate as threads
 from functools import partial
+from time import sleep, time
+from socket import socketpair
 from requests.packages import urllib3
 
-from heimdallr_client import Client, Provider, Consumer, HeimdallrClientException
+from heimdallr_client.gateway import Gateway, LocalConsumer, \
+    _RESERVED_OFFSET, _U64
+from heimdallr_client.loop import ReceiveLoop
+from heimdallr_client.cluster import ClusterClient
+from heimdallr_client.hashring import HashRing
+from heimdallr_client.sharding import ShardedConsumer
+from heimdallr_client import (
+    Client, Provider, Consumer, HeimdallrClientException, EmitExecutor,
+    Histogram, TokenBucket, Downsample, Latest, Deadband, PacketHistory,
+    Recorder, Replayer, RECEIVED, SENT, SensorPacket, ControlPacket,
+    EventPacket, decode_packet, HeimdallrTimeoutError, Future, EndpointPool,
+    ConflatingInbox
+)
+from heimdallr_client.clients import _socketio
+from heimdallr_client.controls import ControlRegistry, COMPLETED, \
+    IN_PROGRESS
+from heimdallr_client.fragments import split_event, Reassembler
+from heimdallr_client.streams import encode_chunk, decode_chunk, \
+    available_codecs
+from heimdallr_client.monitor import LinkMonitor
+from heimdallr_client.tracing import LatencyTracer
 
 # Turn off SubjectAltNameWarning
 urllib3.disable_warnings(urllib3.exceptions.SubjectAltNameWarning)
@@ -194,6 +221,23 @@ class ProviderTestCase(HeimdallrClientTestCase):
         self.trigger('ping')
         self.wait_for_packet()
 
+    def test_send_event_ack(self):
+        future = self.provider.send_event('test', ack=True)
+        future.add_done_callback(self.set_packet_received)
+        self.wait_for_packet()
+        self.assertEqual(future.result(), 'ack', 'Wrong acknowledgement')
+        self.assertEqual(
+            self.provider.ack_latency['event'].count,
+            1,
+            'Ack latency was not recorded'
+        )
+
+    def test_send_sensor_ack(self):
+        future = self.provider.send_sensor('test', ack=True)
+        future.add_done_callback(self.set_packet_received)
+        self.wait_for_packet()
+        self.assertEqual(future.result(), 'ack', 'Wrong acknowledgement')
+
     def test_completes_control(self):
         self.provider.on('completedControl', self.set_packet_received)
         self.provider.completed('test')
@@ -254,6 +298,12 @@ class ConsumerTestCase(HeimdallrClientTestCase):
         self.consumer.send_control(UUID, 'test')
         self.wait_for_packet()
 
+    def test_send_control_ack(self):
+        future = self.consumer.send_control(UUID, 'test', ack=True)
+        future.add_done_callback(self.set_packet_received)
+        self.wait_for_packet()
+        self.assertEqual(future.result(), 'ack', 'Wrong acknowledgement')
+
     def test_on_ready(self):
         self.heard_control = False
         consumer = Consumer('valid-token')
@@ -346,5 +396,1657 @@ class ConsumerTestCase(HeimdallrClientTestCase):
         self.wait_for_packet()
 
 
+class EmitExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.executor = EmitExecutor(workers=2)
+        self.sent = []
+        self.done = Event()
+
+    def tearDown(self):
+        self.executor.close()
+
+    def make_provider(self, packets):
+        provider = Provider('valid-token', executor=self.executor)
+        provider.ready = True
+
+        def emit(*args):
+            self.sent.append((provider, args))
+            if len(self.sent) == packets:
+                self.done.set()
+
+        provider.connection.emit = provider._raw_emit = emit
+        return provider
+
+    def test_shares_threads(self):
+        threads = active_count()
+        providers = [self.make_provider(100) for _ in range(100)]
+        self.assertEqual(active_count(), threads, 'Client started a thread')
+
+        for provider in providers:
+            provider.send_sensor('test')
+        self.done.wait(3)
+        self.assertEqual(len(self.sent), 100, 'Not every packet was sent')
+
+    def test_preserves_order(self):
+        provider = self.make_provider(50)
+        for i in range(50):
+            provider.send_sensor('test', i)
+        self.done.wait(3)
+        self.assertListEqual(
+            [args[1]['data'] for _, args in self.sent],
+            range(50),
+            'Order was not preserved'
+        )
+
+    def test_in_flight_window(self):
+        provider = self.make_provider(2)
+        provider.max_in_flight = 2
+        futures = [provider.send_sensor('test', i, ack=True) for i in range(5)]
+        self.done.wait(3)
+        sleep(0.1)
+        self.assertEqual(len(self.sent), 2, 'In-flight window was exceeded')
+
+        self.done.clear()
+        self.sent[0][1][-1]('ack')
+        self.assertEqual(futures[0].result(1), 'ack', 'Wrong acknowledgement')
+        sleep(0.1)
+        self.assertEqual(len(self.sent), 3, 'Window did not advance')
+        self.assertEqual(
+            provider.ack_latency['sensor'].count,
+            1,
+            'Ack latency was not recorded'
+        )
+
+        provider.close()
+        self.assertRaises(HeimdallrClientException, futures[1].result, 1)
+
+    def test_priority_lanes(self):
+        # Without workers the lanes are only drained by _emit_task
+        self.executor.close()
+        self.executor = EmitExecutor(workers=0)
+        provider = self.make_provider(0)
+        for i in range(20):
+            provider.send_stream('\x21')
+        provider.send_sensor('test')
+        provider.completed('test')
+        provider._emit_task(2)
+
+        self.assertListEqual(
+            [args[0] for _, args in self.sent],
+            ['event', 'sensor'],
+            'Control lane was not drained first'
+        )
+        self.assertEqual(self.sent[0][1][1]['subtype'], 'completed')
+
+        provider._emit_task(100)
+        self.assertEqual(len(self.sent), 22, 'Stream lane was not drained')
+        self.assertEqual(provider.lane_latency['stream'].count, 20)
+
+    def test_close(self):
+        with self.make_provider(1) as provider:
+            pass
+        provider.send_sensor('test')
+        self.done.wait(0.5)
+        self.assertListEqual(self.sent, [], 'Closed client sent a packet')
+
+        self.executor.close()
+        self.assertRaises(
+            HeimdallrClientException,
+            partial(self.executor.submit, provider)
+        )
+
+
+class AutoFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Consumer(
+            'valid-token',
+            executor=EmitExecutor(workers=0),
+            auto_filter=True,
+            filter_delay=0.01
+        )
+        self.consumer.ready = True
+        self.sent = []
+        self.consumer.connection.emit = lambda *args: self.sent.append(args)
+
+    def filters(self):
+        sleep(0.05)
+        self.consumer._emit_task(100)
+        filters = dict(
+            (packet['provider'], packet) for message_name, packet in self.sent
+            if message_name == 'setFilter'
+        )
+        self.sent = []
+        return filters
+
+    def test_subtype_listeners(self):
+        received = []
+        self.consumer.on('sensor', received.append, subtype='imu')
+        self.consumer.on('sensor', received.append, subtype='gps',
+                         provider='a')
+        dispatch = self.consumer.connection._find_packet_callback('sensor')
+        for provider in ['a', 'b']:
+            for subtype in ['imu', 'gps', 'odometry']:
+                dispatch({'provider': provider, 'subtype': subtype})
+        self.assertListEqual(
+            [(p['provider'], p['subtype']) for p in received],
+            [('a', 'imu'), ('a', 'gps'), ('b', 'imu')]
+        )
+
+        self.consumer.remove_listener('sensor', received.append, 'gps', 'a')
+        received[:] = []
+        dispatch({'provider': 'a', 'subtype': 'gps'})
+        self.assertListEqual(received, [])
+
+    def test_auto_filter(self):
+        listener = lambda packet: None
+        self.consumer.on('sensor', listener, subtype='imu')
+        self.consumer.subscribe('a').subscribe('b')
+        self.assertDictEqual(self.filters(), {
+            'a': {'provider': 'a', 'event': [], 'sensor': ['imu']},
+            'b': {'provider': 'b', 'event': [], 'sensor': ['imu']}
+        })
+
+        # Only the changed filter is sent again, once per batch
+        self.consumer.on('event', listener, subtype='battery', provider='b')
+        self.consumer.on('event', listener, subtype='status', provider='b')
+        self.assertDictEqual(self.filters(), {
+            'b': {'provider': 'b', 'event': ['battery', 'fragment', 'status'],
+                  'sensor': ['imu']}
+        })
+
+        # Listening to every subtype lifts the filter for that packet type
+        self.consumer.on('event', listener)
+        self.assertDictEqual(self.filters(), {
+            'a': {'provider': 'a', 'sensor': ['imu']},
+            'b': {'provider': 'b', 'sensor': ['imu']}
+        })
+
+        self.consumer.set_filter('a', {'sensor': []})
+        self.filters()
+        self.consumer.remove_listener('sensor', listener, subtype='imu')
+        self.assertDictEqual(self.filters(), {
+            'b': {'provider': 'b', 'sensor': []}
+        })
+
+        # Nothing left to filter lifts the filter that was sent
+        self.consumer.on('sensor', listener)
+        self.assertDictEqual(self.filters(), {'b': {'provider': 'b'}})
+        self.assertNotIn('b', self.consumer.auto_filters)
+
+
+class LazyPacketTestCase(unittest.TestCase):
+    def test_decode(self):
+        packet = decode_packet(
+            SensorPacket,
+            '{"provider":"a","subtype":"imu","data":{"x":[1,2]},'
+            '"t":"2015-07-06T16:44:48Z"}'
+        )
+        self.assertEqual(packet.provider, 'a')
+        self.assertEqual(packet.subtype, 'imu')
+        self.assertEqual(packet['t'], '2015-07-06T16:44:48Z')
+        self.assertIsNotNone(packet._text, 'Data was decoded eagerly')
+        self.assertEqual(packet.data, {'x': [1, 2]})
+        self.assertIsNone(packet._text)
+        self.assertRaises(AttributeError, setattr, packet, 'extra', 1)
+
+        for text, expected in [
+            ('{"subtype":"imu","data":[1,{"a":"}"}]}', [1, {'a': '}'}]),
+            ('{"data":"x,\\"y\\"","subtype":"imu"}', 'x,"y"'),
+            ('{"subtype":"imu","data":5,"t":"now"}', 5),
+            ('{"subtype":"imu"}', None),
+            # Fields after data that the scan can't step over
+            ('{"data":{"a":1},"meta":{"b":2}}', {'a': 1}),
+            ('{"data":{"a":1},"subtype":"x,"}', {'a': 1}),
+        ]:
+            self.assertEqual(decode_packet(SensorPacket, text).data, expected)
+
+        control = decode_packet(
+            ControlPacket,
+            '{"subtype":"move","data":{"x":1},"uuid":"u","persistent":true}'
+        )
+        self.assertDictEqual(control.as_dict(), {
+            'subtype': 'move', 'data': {'x': 1}, 'uuid': 'u',
+            'persistent': True
+        })
+        self.assertEqual(control, control.as_dict())
+
+    def test_receive(self):
+        consumer = Consumer(
+            'valid-token', executor=EmitExecutor(workers=0), lazy_packets=True
+        )
+        received = []
+        consumer.on('sensor', received.append)
+        consumer.on('checkedPacket', received.append)
+
+        class StubSocketIO(_socketio()['SocketIO']):
+            """ SocketIO that only processes packets it is handed. """
+
+            def __init__(self):
+                self._log_name = 'test'
+
+            def __del__(self):
+                pass
+
+        io = StubSocketIO()
+        io.placeholder = None
+        io._lazy_path = '/consumer'
+        io._namespace = consumer.connection
+        io._namespace_by_path = {
+            '': consumer.connection,
+            '/consumer': consumer.connection
+        }
+
+        io._process_packet((
+            4, '2/consumer,["sensor",{"provider":"a","subtype":"imu",'
+               '"data":{"x":1}}]'
+        ))
+        io._process_packet((4, '2/consumer,["checkedPacket","sensor"]'))
+        self.assertIsInstance(received[0], SensorPacket)
+        self.assertEqual(received[0]['data'], {'x': 1})
+        self.assertEqual(received[1], 'sensor')
+
+
+class ConflatingInboxTestCase(unittest.TestCase):
+    def test_conflation(self):
+        consumer = Consumer(
+            'valid-token', executor=EmitExecutor(workers=0),
+            conflate=['sensor']
+        )
+        started, release, done = Event(), Event(), Event()
+        received = []
+
+        @consumer.on('sensor')
+        def slow(packet):
+            started.set()
+            release.wait(3)
+            received.append((packet['provider'], packet['data']))
+            if len(received) == 3:
+                done.set()
+
+        dispatch = consumer.connection._find_packet_callback('sensor')
+        dispatch({'provider': 'a', 'subtype': 'imu', 'data': 0})
+        started.wait(3)
+        for i in range(1, 100):
+            for provider in ['a', 'b']:
+                dispatch({'provider': provider, 'subtype': 'imu', 'data': i})
+        self.assertLessEqual(len(consumer.inbox), 2)
+        release.set()
+        done.wait(3)
+
+        self.assertListEqual(received, [('a', 0), ('a', 99), ('b', 99)])
+        stats = consumer.inbox.stats()
+        self.assertEqual(stats['delivered'], 3)
+        self.assertDictEqual(stats['skipped'], {
+            ('sensor', 'a', 'imu'): 98,
+            ('sensor', 'b', 'imu'): 98
+        })
+        consumer.close()
+        self.assertIsNone(consumer.inbox._thread)
+
+    def test_close(self):
+        started, release = Event(), Event()
+        received = []
+
+        def deliver(message_name, packet):
+            received.append(packet)
+            started.set()
+            release.wait(3)
+
+        inbox = ConflatingInbox(deliver)
+        inbox.put('sensor', {'provider': 'a', 'data': 0})
+        started.wait(3)
+        # A listener that is still busy doesn't hold up closing for long
+        start = time()
+        inbox.close(0.05)
+        self.assertLess(time() - start, 1)
+
+        # Packets put in a closed inbox are dropped
+        inbox.put('sensor', {'provider': 'a', 'data': 1})
+        self.assertEqual(len(inbox), 0)
+        self.assertIsNone(inbox._thread)
+
+        inbox.open()
+        started.clear()
+        inbox.put('sensor', {'provider': 'a', 'data': 2})
+        release.set()
+        started.wait(3)
+        inbox.close()
+        self.assertListEqual([packet['data'] for packet in received], [0, 2])
+
+
+class LatencyTracerTestCase(unittest.TestCase):
+    def test_trace(self):
+        executor = EmitExecutor(workers=0)
+        provider = Provider('valid-token', executor=executor, trace=True)
+        consumer = Consumer('valid-token', executor=executor)
+        provider.ready = consumer.ready = True
+        tracer = LatencyTracer(consumer)
+        consumer.on('sensor', lambda packet: None)
+
+        def deliver(client, skew):
+            """ Hand a client's sent packets to the other client, with the
+            provider's clock ``skew`` seconds ahead. """
+
+            def emit(message_name, packet):
+                packet = json.loads(json.dumps(packet))
+                for key in ['traceSent', 'traceEmitted']:
+                    if key in packet:
+                        packet[key] += skew
+                if isinstance(packet.get('data'), dict) and \
+                        't1' in packet['data']:
+                    packet['data']['t1'] += skew
+                packet.setdefault('provider', UUID)
+                client.connection._find_packet_callback(message_name)(packet)
+
+            return emit
+
+        provider.connection.emit = deliver(consumer, 10)
+        consumer.connection.emit = deliver(provider, 0)
+
+        tracer.sync(UUID)
+        consumer._emit_task(10)
+        provider._emit_task(10)
+        self.assertAlmostEqual(tracer.offset(UUID), 10, delta=0.01)
+
+        provider.send_sensor('imu', {'x': 1})
+        sleep(0.01)
+        provider._emit_task(10)
+        stats = tracer.stats()[('sensor', 'imu')]
+        self.assertGreaterEqual(stats['queue']['min'], 0.01)
+        self.assertLess(stats['transit']['max'], 0.01)
+        self.assertAlmostEqual(stats['total']['max'], 0.01, delta=0.01)
+
+        tracer.close()
+        self.assertIsNone(consumer._tracer)
+
+
+class LinkMonitorTestCase(unittest.TestCase):
+    def test_monitor(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=1))
+        provider.ready = True
+        link = {'up': True}
+        degraded = Event()
+
+        def emit(message_name, packet):
+            if link['up'] and packet['subtype'] == 'ping':
+                sleep(0.005)
+                provider.connection._find_packet_callback('pong')()
+
+        provider.connection.emit = emit
+        monitor = LinkMonitor(
+            provider, interval=0.02, window=10, timeout=0.1, max_loss=0.5,
+            on_degraded=lambda monitor: degraded.set()
+        )
+        sleep(0.3)
+        stats = monitor.stats()
+        self.assertGreaterEqual(stats['count'], 5)
+        self.assertEqual(stats['loss'], 0)
+        self.assertGreaterEqual(stats['p50'], 0.005)
+        self.assertFalse(degraded.is_set())
+
+        link['up'] = False
+        self.assertTrue(degraded.wait(3), 'Lost link was not noticed')
+        self.assertEqual(monitor.degraded, 1)
+        monitor.close()
+        provider.close()
+
+    def test_probe_required(self):
+        consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        self.assertRaises(ValueError, LinkMonitor, consumer)
+
+    def test_callback_errors(self):
+        consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        updates = []
+
+        def on_update(monitor):
+            updates.append(monitor)
+            raise ValueError('Listener failed')
+
+        def probe():
+            raise IOError('Probe failed')
+
+        monitor = LinkMonitor(consumer, interval=0.01, probe=probe,
+                              on_update=on_update)
+        consumer.ready = True
+        sleep(0.2)
+        # The monitor went on after the exceptions
+        self.assertGreater(len(updates), 2)
+        self.assertTrue(monitor._thread.is_alive())
+        monitor.close()
+        consumer.close()
+
+
+class InlineEmitTestCase(unittest.TestCase):
+    class StubIO(object):
+        """ Looks like a connection over a websocket. """
+
+        _opened = True
+        connected = True
+
+        def __init__(self):
+            self._transport_instance = self._connection = self
+            self.lock = None
+            self.sent = []
+
+        def emit(self, event, *args, **kwargs):
+            self.sent.append((event, args[0]['data']))
+
+        def disconnect(self):
+            self.connected = False
+
+    def test_inline_emit(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0),
+                            inline_emit=True)
+        io = provider.connection._io = self.StubIO()
+        io.lock = Event()
+
+        # Deferred until the provider is authorized, then sent inline
+        provider.send_sensor('imu', 1)
+        self.assertListEqual(io.sent, [])
+        provider.connection._find_packet_callback('auth-success')()
+        self.assertListEqual(io.sent, [('sensor', 1)])
+        self.assertIs(io.lock, provider._write_lock)
+
+        # Queued while disconnected, and later packets queue behind it
+        io.connected = False
+        provider.send_sensor('imu', 2)
+        io.connected = True
+        provider.send_sensor('imu', 3).send_event('battery', 4)
+        self.assertListEqual(io.sent, [('sensor', 1), ('event', 4)])
+        provider._emit_task(100)
+        self.assertListEqual(io.sent, [
+            ('sensor', 1), ('event', 4), ('sensor', 2), ('sensor', 3)
+        ])
+        provider.send_sensor('imu', 5)
+        self.assertEqual(io.sent[-1], ('sensor', 5))
+        provider.close()
+
+
+class ChannelTestCase(unittest.TestCase):
+    def test_channel(self):
+        provider = Provider(
+            'valid-token', executor=EmitExecutor(workers=0),
+            rate_policies={'gps': Downsample(60)}
+        )
+        sent = []
+        provider.connection.emit = lambda *args: sent.append(args)
+        imu = provider.channel('sensor', 'imu')
+        gps = provider.channel('sensor', 'gps')
+        battery = provider.channel('event', 'battery')
+
+        # Deferred like send_sensor until the provider is ready
+        imu.send(0)
+        self.assertEqual(len(provider.ready_callbacks), 1)
+        provider.connection._find_packet_callback('auth-success')()
+        for i in range(1, 5):
+            imu(i)
+            gps.send(i)
+        battery.send(50)
+        provider._emit_task(100)
+
+        self.assertListEqual(
+            [(name, p['subtype'], p['data']) for name, p in sent],
+            [('event', 'battery', 50), ('sensor', 'imu', 0),
+             ('sensor', 'imu', 1), ('sensor', 'gps', 1)] +
+            [('sensor', 'imu', i) for i in range(2, 5)]
+        )
+        self.assertTrue(all(p['t'] for _, p in sent))
+        self.assertIsNot(sent[1][1], sent[2][1])
+        self.assertRaises(ValueError, provider.channel, 'control', 'move')
+        provider.close()
+
+
+class StreamCompressionTestCase(unittest.TestCase):
+    def test_codecs(self):
+        chunk = 'point cloud ' * 1000
+        self.assertIn('zlib', available_codecs())
+        for codec in available_codecs():
+            framed = encode_chunk(chunk, codec)
+            self.assertLess(len(framed), len(chunk) / 10)
+            self.assertEqual(decode_chunk(framed), chunk)
+            self.assertEqual(decode_chunk(bytearray(framed)),
+                             bytearray(chunk))
+
+        # Incompressible chunks are framed as they are
+        self.assertEqual(len(encode_chunk('\x00\xff', 'zlib')), 10)
+        self.assertEqual(decode_chunk(encode_chunk('\x00\xff', 'zlib')),
+                         '\x00\xff')
+        self.assertEqual(decode_chunk('HZ raw data'), 'HZ raw data')
+        self.assertRaises(ValueError, encode_chunk, chunk, 'brotli')
+
+    def test_undecodable(self):
+        framed = encode_chunk('\x00' * 1000000, 'zlib')
+        header = lambda codec_id, size: struct.pack(
+            '<2sBBI', 'HZ', 1, codec_id, size
+        )
+        for data in [
+            # Expands past the size in its header
+            header(1, 10) + framed[10:],
+            framed[:-4] + 'xxxx',
+            header(1, 0) + framed[10:],
+            # lz4 or zstd chunks, whether or not they are installed here
+            header(2, 5) + 'junk',
+            header(3, 5) + 'junk',
+        ]:
+            self.assertRaises(ValueError, decode_chunk, data)
+
+        consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        received = []
+        consumer.on('stream', received.append)
+        consumer.connection._find_packet_callback('stream')(
+            bytearray(header(2, 5) + 'junk')
+        )
+        self.assertListEqual(received, [])
+        consumer.close()
+
+    def test_stream(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0),
+                            stream_codec='zlib')
+        provider.ready = True
+        sent = []
+        provider.connection.emit = lambda *args: sent.append(args)
+        provider.send_stream('scan ' * 100).send_stream('\x00', codec='zlib')
+        provider._emit_task(10)
+
+        consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        received = []
+        consumer.on('stream', received.append)
+        dispatch = consumer.connection._find_packet_callback('stream')
+        for _, data in sent:
+            self.assertIsInstance(data, bytearray)
+            dispatch(data)
+        self.assertLess(len(sent[0][1]), 50)
+        self.assertListEqual(received, [bytearray('scan ' * 100), '\x00'])
+        provider.close()
+        consumer.close()
+
+
+class FragmentTestCase(unittest.TestCase):
+    def fragments(self, id_, data, size=8):
+        return [
+            {'provider': UUID, 'subtype': 'fragment',
+             't': 't%d' % fragment['index'], 'data': dict(fragment, id=id_)}
+            for fragment in split_event('map', data, size)
+        ]
+
+    def test_reassembly(self):
+        data = {'cells': range(20), 'name': u'caf\xe9'}
+        self.assertIsNone(split_event('map', data, 1000))
+        reassembler = Reassembler()
+        fragments = self.fragments('a', data)
+        fragments[0]['traceSent'] = 1.5
+        self.assertGreater(len(fragments), 4)
+        for fragment in fragments[:-1]:
+            self.assertIsNone(reassembler.feed(fragment))
+        # Repeated fragments are ignored
+        self.assertIsNone(reassembler.feed(fragments[0]))
+        packet = reassembler.feed(fragments[-1])
+        # The first fragment's envelope is kept
+        expected = {
+            'provider': UUID, 'subtype': 'map', 't': 't0', 'traceSent': 1.5,
+            'data': data
+        }
+        self.assertEqual(packet, expected)
+        other = {'subtype': 'status', 'data': None}
+        self.assertIs(reassembler.feed(other), other)
+        self.assertEqual((len(reassembler), reassembler.completed), (0, 1))
+
+        reassembler = Reassembler(lazy_packets=True)
+        for fragment in fragments:
+            packet = reassembler.feed(fragment)
+        self.assertIsInstance(packet, EventPacket)
+        self.assertEqual(packet.as_dict(), expected)
+
+    def test_bounds(self):
+        data = range(20)
+        reassembler = Reassembler(max_events=2, max_bytes=120)
+        for id_ in 'abc':
+            reassembler.feed(self.fragments(id_, data)[0])
+        # The oldest event made room for the newest
+        self.assertEqual((len(reassembler), reassembler.dropped), (2, 1))
+
+        # Events larger than the buffer are dropped outright
+        self.assertIsNone(reassembler.feed(self.fragments('d', range(60))[0]))
+        self.assertEqual(len(reassembler), 2)
+        self.assertEqual(reassembler.dropped, 2)
+
+        reassembler.timeout = 0
+        reassembler.feed({'subtype': 'status'})
+        self.assertEqual((len(reassembler), reassembler.dropped), (0, 4))
+
+        # The buffer is charged for the chunks that arrived
+        reassembler = Reassembler(max_bytes=60)
+        first, second = self.fragments('a', data), self.fragments('b', data)
+        for fragment in first[:4] + second[:3]:
+            reassembler.feed(fragment)
+        self.assertEqual((len(reassembler), reassembler.dropped), (2, 0))
+        reassembler.feed(second[3])
+        self.assertEqual((len(reassembler), reassembler.dropped), (1, 1))
+
+    def test_malformed(self):
+        reassembler = Reassembler()
+        fragment = self.fragments('a', range(20))[0]
+        for header in [{'count': 10 ** 9}, {'size': 10 ** 9, 'count': 5}]:
+            corrupt = dict(fragment, data=dict(fragment['data'], **header))
+            self.assertIsNone(reassembler.feed(corrupt))
+            self.assertEqual(len(reassembler), 0)
+
+        # Chunks that don't add up to the declared size drop the event
+        fragments = self.fragments('b', range(20))
+        fragments[-1]['data']['chunk'] += 'x' * 40
+        for fragment in fragments:
+            self.assertIsNone(reassembler.feed(fragment))
+        # The oversized header and the padded event
+        self.assertEqual((len(reassembler), reassembler.dropped), (0, 2))
+
+    def test_opt_in(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0))
+        provider.ready = True
+        provider.send_event('map', {'cells': range(100000)})
+        self.assertEqual(len(provider._emit_lanes['event']), 1)
+        provider.close()
+
+    def test_interleaving(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0),
+                            fragment_size=32)
+        provider.ready = True
+        sent = []
+        provider.connection.emit = lambda *args: sent.append(args)
+        acked = []
+        provider._raw_emit = lambda *args: acked.append(args)
+        data = {'cells': range(50)}
+        ack = provider.send_event('map', data, ack=True)
+        provider.send_sensor('imu', 1).send_event('status', 'ok')
+        provider._emit_task(100)
+
+        # Sensor packets don't wait for every fragment to be sent
+        names = [args[0] for args in sent]
+        self.assertEqual(names.index('sensor'), 4)
+        self.assertEqual(len(acked), 1)
+        self.assertEqual(acked[0][1]['data']['index'],
+                         acked[0][1]['data']['count'] - 1)
+        self.assertFalse(ack.done())
+
+        consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        received = []
+        consumer.on('event', lambda packet: received.append(
+            (packet['subtype'], packet['data'])
+        ))
+        dispatch = consumer.connection._find_packet_callback('event')
+        for args in sent + acked:
+            if args[0] == 'event':
+                dispatch(dict(args[1], provider=UUID))
+        self.assertListEqual(received, [('status', 'ok'), ('map', data)])
+        provider.close()
+        consumer.close()
+
+
+class ControlCompletionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        self.consumer.ready = True
+        self.sent = []
+        self.consumer.connection.emit = self.consumer._raw_emit = \
+            lambda *args: self.sent.append(args)
+
+    def controls(self):
+        self.consumer._emit_task(10000)
+        return [args[1] for args in self.sent if args[0] == 'control']
+
+    def test_completion(self):
+        futures = [
+            self.consumer.send_control('a', 'move', i, completion=True)
+            for i in range(1000)
+        ]
+        controls = self.controls()
+        self.assertEqual(len(self.consumer.controls), 1000)
+        self.assertEqual(len(set(c['persistent'] for c in controls)), 1000)
+
+        dispatch = self.consumer.connection._find_packet_callback('event')
+        for control in reversed(controls):
+            dispatch({'provider': 'a', 'subtype': 'completed',
+                      'data': control['persistent']})
+        self.assertEqual(len(self.consumer.controls), 0)
+        self.assertEqual(futures[0].result(0)['data'],
+                         controls[0]['persistent'])
+        self.assertEqual(
+            self.consumer.controls.latency['move'].snapshot()['count'], 1000
+        )
+
+    def test_timeout_and_close(self):
+        expired = self.consumer.send_control(
+            'a', 'move', completion=True, timeout=0.01
+        )
+        ack, pending = self.consumer.send_control(
+            'a', 'move', ack=True, completion=True
+        )
+        self.assertRaises(HeimdallrTimeoutError, expired.result, 1)
+        self.assertFalse(pending.done())
+        self.assertListEqual(
+            self.consumer.controls.pending('a'),
+            [self.controls()[1]['persistent']]
+        )
+        self.consumer.close()
+        self.assertIsInstance(pending.exception(0), HeimdallrClientException)
+
+
+class ControlRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.dir, 'controls.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def provider(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0))
+        provider.ready = True
+        provider.sent = []
+        provider.connection.emit = lambda *args: provider.sent.append(args)
+        return provider
+
+    def completed(self, provider):
+        provider._emit_task(100)
+        completed = [packet['data'] for message_name, packet in provider.sent
+                     if packet.get('subtype') == 'completed']
+        provider.sent = []
+        return completed
+
+    def test_dedupe(self):
+        provider = self.provider()
+        registry = ControlRegistry(provider, journal=self.journal)
+        calls = []
+        pending = Future()
+
+        @registry.on('move')
+        def move(packet):
+            calls.append(packet['data'])
+            if packet['data'] == 'slow':
+                return pending
+
+        dispatch = provider.connection._find_packet_callback('control')
+        for _ in range(3):
+            dispatch({'subtype': 'move', 'data': 1, 'persistent': 'a'})
+            dispatch({'subtype': 'move', 'data': 'slow', 'persistent': 'b'})
+            dispatch({'subtype': 'move', 'data': 2, 'persistent': False})
+        self.assertListEqual(calls, [1, 'slow', 2, 2, 2])
+        self.assertEqual(registry.duplicates, 4)
+        self.assertEqual(registry.state('b'), IN_PROGRESS)
+        # 'a' is completed again on every delivery after the first
+        self.assertListEqual(self.completed(provider), ['a', 'a', 'a'])
+
+        pending.set_result(None)
+        self.assertEqual(registry.state('b'), COMPLETED)
+        self.assertListEqual(self.completed(provider), ['b'])
+        registry.close()
+
+        # Completed controls survive a restart through the journal
+        provider = self.provider()
+        registry = ControlRegistry(provider, journal=self.journal)
+        registry.on('move', move)
+        dispatch = provider.connection._find_packet_callback('control')
+        dispatch({'subtype': 'move', 'data': 1, 'persistent': 'a'})
+        dispatch({'subtype': 'move', 'data': 3, 'persistent': 'c'})
+        self.assertListEqual(calls[5:], [3])
+        self.assertListEqual(self.completed(provider), ['a', 'c'])
+        registry.close()
+
+    def test_failure_and_capacity(self):
+        provider = self.provider()
+        registry = ControlRegistry(provider, capacity=2)
+        attempts = []
+
+        def move(packet):
+            attempts.append(packet['persistent'])
+            if len(attempts) == 1:
+                raise ValueError('Motor stalled')
+
+        registry.on('move', move)
+        dispatch = provider.connection._find_packet_callback('control')
+        self.assertRaises(
+            ValueError, dispatch, {'subtype': 'move', 'persistent': 'a'}
+        )
+        self.assertIsNone(registry.state('a'))
+        for uuid in ['a', 'b', 'c']:
+            dispatch({'subtype': 'move', 'persistent': uuid})
+        self.assertListEqual(attempts, ['a', 'a', 'b', 'c'])
+        self.assertEqual(len(registry), 2)
+        self.assertIsNone(registry.state('a'))
+
+
+class ReceiveLoopTestCase(unittest.TestCase):
+    class StubIO(object):
+        """ Delivers a sensor packet for every line written to a socket.
+        """
+
+        _opened = True
+        connected = False
+
+        def __init__(self, client):
+            self.client = client
+            self.remote, self.sock = socketpair()
+            self._transport = self._transport_instance = self
+            self._connection = self
+            self._file = self.sock.makefile('r', 0)
+
+        def set_timeout(self, seconds=None):
+            pass
+
+        def _process_packets(self):
+            data = json.loads(self._file.readline())
+            self.client.connection._find_packet_callback('sensor')(data)
+
+    def test_shared_loop(self):
+        loop = ReceiveLoop(interval=10)
+        received = []
+        clients = []
+        for name in ['a', 'b']:
+            consumer = Consumer('valid-token', executor=EmitExecutor(workers=0))
+            consumer.on('sensor', received.append)
+            consumer.connection._io = self.StubIO(consumer)
+            clients.append(consumer.start(loop))
+
+        for i, consumer in enumerate(clients):
+            consumer.connection._io.remote.sendall('%d\n' % i)
+        deadline = time() + 1
+        while len(received) < 2 and time() < deadline:
+            sleep(0.001)
+        self.assertListEqual(sorted(received), [0, 1])
+        self.assertEqual(
+            len([t for t in threads() if t.name == 'heimdallr-loop']), 1
+        )
+
+        # The loop is idle in a 10 second wait and lets go right away
+        start = time()
+        clients[0].stop()
+        self.assertLess(time() - start, 0.05)
+        clients[0].connection._io.remote.sendall('2\n')
+        clients[1].connection._io.remote.sendall('3\n')
+        sleep(0.05)
+        self.assertListEqual(sorted(received), [0, 1, 3])
+
+        start = time()
+        clients[1].close()
+        loop.close(1)
+        self.assertLess(time() - start, 0.05)
+        self.assertEqual(
+            len([t for t in threads() if t.name == 'heimdallr-loop']), 0
+        )
+
+
+    def test_dead_connection(self):
+        class DeadIO(self.StubIO):
+            """ A dropped connection whose server doesn't come back. """
+
+            _opened = False
+            released = Event()
+
+            @property
+            def _transport(self):
+                self.released.wait(5)
+                self._opened = True
+                return self
+
+            @_transport.setter
+            def _transport(self, value):
+                pass
+
+        loop = ReceiveLoop(interval=10)
+        received = []
+        dead = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        dead.connection._io = DeadIO(dead)
+        live = Consumer('valid-token', executor=EmitExecutor(workers=0))
+        live.on('sensor', received.append)
+        live.connection._io = self.StubIO(live)
+        dead.start(loop)
+        live.start(loop)
+
+        # The reconnect doesn't hold up the other client or closing
+        live.connection._io.remote.sendall('1\n')
+        deadline = time() + 1
+        while not received and time() < deadline:
+            sleep(0.001)
+        self.assertListEqual(received, [1])
+        self.assertEqual(
+            len([t for t in threads() if t.name == 'heimdallr-reconnect']), 1
+        )
+        start = time()
+        dead.close()
+        self.assertLess(time() - start, 0.05)
+        DeadIO.released.set()
+        live.close()
+        loop.close(1)
+
+
+class EndpointTestCase(unittest.TestCase):
+    class StubConsumer(Consumer):
+        # Seconds each URL takes to let a client in, or None to refuse
+        delays = {}
+
+        def _open(self, url, **kwargs):
+            delay = self.delays[url]
+            if delay is None:
+                raise HeimdallrClientException('Connection refused')
+            sleep(delay)
+            self._authorized.set()
+
+    def test_instance_config(self):
+        consumer = Consumer('valid-token', url='https://a:1',
+                            auth_source='other',
+                            executor=EmitExecutor(workers=0))
+        self.assertEqual(consumer._url, 'https://a:1')
+        self.assertEqual(consumer.connection._log_name, 'https://a:1')
+        self.assertEqual(consumer._auth_source, 'other')
+        self.assertNotEqual(Client._url, 'https://a:1')
+
+    def test_fastest_endpoint(self):
+        self.StubConsumer.delays = {'a': 0.03, 'b': 0.005, 'c': None}
+        consumer = self.StubConsumer(
+            'valid-token', executor=EmitExecutor(workers=0),
+            endpoints=['a', ('b', 'other'), 'c']
+        )
+        consumer.connect()
+        self.assertEqual(consumer.endpoint.url, 'b')
+        self.assertEqual(consumer._auth_source, 'other')
+        stats = consumer.endpoints.stats()
+        self.assertLess(stats['b']['latency'], stats['a']['latency'])
+        self.assertFalse(stats['c']['healthy'])
+        self.assertEqual(stats['c']['failures'], 1)
+
+        # Skips the failed endpoint and falls back to the slower one
+        consumer.failover()
+        self.assertEqual(consumer.endpoint.url, 'a')
+        self.assertEqual(consumer.connection._log_name, 'a')
+        self.assertListEqual(
+            [e.url for e in consumer.endpoints.candidates()], ['a', 'c', 'b']
+        )
+
+        # When every endpoint is down they are tried anyway
+        self.StubConsumer.delays = {'a': None, 'b': None, 'c': 0}
+        consumer.failover()
+        self.assertEqual(consumer.endpoint.url, 'c')
+        consumer.close()
+
+    def test_reconnect_started(self):
+        loop = ReceiveLoop(interval=10)
+        on_loop = []
+
+        class StubConsumer(self.StubConsumer):
+            def _open(self, url, **kwargs):
+                on_loop.append(self in loop.clients)
+                EndpointTestCase.StubConsumer._open(self, url, **kwargs)
+
+        StubConsumer.delays = {'a': 0, 'b': 0}
+        consumer = StubConsumer(
+            'valid-token', executor=EmitExecutor(workers=0),
+            endpoints=['a', 'b']
+        )
+        consumer.connect().start(loop)
+        on_loop[:] = []
+        consumer.failover()
+        # The loop let go of the client while it reconnected
+        self.assertListEqual(on_loop, [False])
+        self.assertIn(consumer, loop.clients)
+        consumer.close()
+        loop.close(1)
+
+    def test_reconnect_running(self):
+        class WaitingIO(object):
+            """ Waits until it is replaced or released. """
+
+            _replaced = False
+            connected = False
+
+            def __init__(self):
+                self.waits = 0
+                self.released = Event()
+
+            def wait(self, seconds=None, **kwargs):
+                self.waits += 1
+                while not self._replaced and not self.released.wait(0.001):
+                    pass
+
+        running = []
+
+        class StubConsumer(self.StubConsumer):
+            def _open(self, url, **kwargs):
+                running.append(self._run_thread is not None)
+                self.connection._io = WaitingIO()
+                EndpointTestCase.StubConsumer._open(self, url, **kwargs)
+
+        StubConsumer.delays = {'a': 0, 'b': 0}
+        consumer = StubConsumer(
+            'valid-token', executor=EmitExecutor(workers=0),
+            endpoints=['a', 'b']
+        )
+        consumer.connect()
+        old = consumer.connection._io
+        thread = Thread(target=consumer.run)
+        thread.start()
+        while not old.waits:
+            sleep(0.001)
+        consumer.failover()
+        new = consumer.connection._io
+        while not new.waits:
+            sleep(0.001)
+        new.released.set()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        # run() left the old socket before any other was opened
+        self.assertTrue(running)
+        self.assertFalse(any(running))
+        self.assertEqual(old.waits, 1)
+        consumer.close()
+
+    def test_pool(self):
+        self.assertRaises(ValueError, EndpointPool, [])
+        pool = EndpointPool(['a', 'b'], cooldown=0.02)
+        a, b = pool.endpoints
+        pool.succeeded(a, 1.0)
+        pool.succeeded(a, 2.0)
+        self.assertAlmostEqual(a.latency, 1.3)
+        self.assertListEqual(pool.unmeasured(), [b])
+        pool.failed(b)
+        pool.failed(b)
+        self.assertListEqual(pool.candidates(), [a, b])
+        self.assertFalse(b.healthy)
+        sleep(0.05)
+        self.assertTrue(b.healthy)
+
+
+class ClusterClientTestCase(unittest.TestCase):
+    class StubClient():
+        """ Records packets instead of connecting to ``url``. """
+
+        def _open(self, url, **kwargs):
+            self.opened = getattr(self, 'opened', []) + [url]
+            self.ready = True
+            while self.ready_callbacks:
+                self.ready_callbacks.pop(0)()
+
+        def _emit(self, *args, **kwargs):
+            self.sent = getattr(self, 'sent', []) + [args]
+
+    class StubProvider(StubClient, Provider):
+        pass
+
+    class StubConsumer(StubClient, Consumer):
+        pass
+
+    def cluster(self, nodes):
+        return ClusterClient(
+            'valid-token', nodes, max_consumers=2, providers_per_consumer=4,
+            provider_factory=self.StubProvider,
+            consumer_factory=self.StubConsumer
+        )
+
+    def placement(self, cluster, uuids):
+        return dict(
+            (uuid, cluster.consumer_for(uuid)._url) for uuid in uuids
+        )
+
+    def test_placement(self):
+        cluster = self.cluster(['n1', 'n2'])
+        listener = lambda packet: None
+        cluster.on('sensor', listener)
+        uuids = ['provider-%d' % i for i in range(40)]
+        for uuid in uuids:
+            cluster.subscribe(uuid, {'sensor': ['imu']})
+        for uuid in uuids:
+            consumer = cluster.consumer_for(uuid)
+            self.assertEqual(consumer._url, cluster.node_for(uuid))
+            self.assertIn(
+                ('setFilter', {'provider': uuid, 'sensor': ['imu']}),
+                consumer.sent
+            )
+            self.assertListEqual(consumer.callbacks['sensor'], [listener])
+        stats = cluster.stats()
+        self.assertEqual(sum(s['subscriptions'] for s in stats.values()), 40)
+        self.assertTrue(all(s['consumers'] == 2 for s in stats.values()))
+
+        provider = cluster.provider(uuids[0])
+        self.assertIs(cluster.provider(uuids[0]), provider)
+        self.assertListEqual(provider.opened, [cluster.node_for(uuids[0])])
+        cluster.close()
+
+    def test_rebalance(self):
+        cluster = self.cluster(['n1', 'n2'])
+        uuids = ['provider-%d' % i for i in range(40)]
+        for uuid in uuids:
+            cluster.subscribe(uuid)
+            cluster.provider(uuid)
+        before = self.placement(cluster, uuids)
+
+        moved = cluster.add_node('n3')
+        after = self.placement(cluster, uuids)
+        self.assertTrue(moved)
+        for uuid in uuids:
+            if uuid in moved:
+                self.assertEqual(after[uuid], 'n3')
+                self.assertEqual(cluster.provider(uuid).opened[-1], 'n3')
+            else:
+                self.assertEqual(after[uuid], before[uuid])
+
+        self.assertListEqual(cluster.remove_node('n3'), moved)
+        self.assertDictEqual(self.placement(cluster, uuids), before)
+        self.assertNotIn('n3', cluster.stats())
+        cluster.close()
+
+
+class RatePolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def admit(self, policy, samples):
+        for i in range(samples):
+            policy.admit(i, self.sent.append)
+
+    def test_token_bucket(self):
+        policy = TokenBucket(1, burst=3)
+        self.admit(policy, 10)
+        self.assertListEqual(self.sent, [0, 1, 2])
+        self.assertDictEqual(policy.stats(), {'sent': 3, 'shed': 7})
+
+    def test_downsample(self):
+        policy = Downsample(10)
+        self.admit(policy, 10)
+        self.assertListEqual(self.sent, [0])
+        self.assertDictEqual(policy.stats(), {'sent': 1, 'shed': 9})
+
+    def test_latest(self):
+        policy = Latest(0.1)
+        self.admit(policy, 10)
+        self.assertListEqual(self.sent, [0])
+        sleep(0.2)
+        self.assertListEqual(self.sent, [0, 9], 'Latest sample was not sent')
+        self.assertDictEqual(policy.stats(), {'sent': 2, 'shed': 8})
+
+    def test_deadband(self):
+        policy = Deadband(
+            absolute=1,
+            fields={'joints': {'relative': 0.1}, 'joints.0': 0}
+        )
+        samples = [
+            {'battery': 50, 'joints': [1, 10]},
+            {'battery': 50.5, 'joints': [1, 10.5]},
+            {'battery': 51.5, 'joints': [1, 10]},
+            {'battery': 50.5, 'joints': [1, 11.5]},
+            {'battery': 50.5, 'joints': [1.1, 10]},
+            {'battery': 50.5, 'joints': [1.1, 10], 'mode': 'idle'}
+        ]
+        for sample in samples:
+            policy.admit(sample, self.sent.append)
+        self.assertListEqual(
+            self.sent,
+            [samples[0], samples[2], samples[3], samples[4], samples[5]]
+        )
+
+    def test_deadband_max_silence(self):
+        policy = Deadband(absolute=10, max_silence=0.05)
+        self.admit(policy, 5)
+        sleep(0.1)
+        self.admit(policy, 1)
+        self.assertListEqual(self.sent, [0, 0])
+        self.assertDictEqual(policy.stats(), {'sent': 2, 'shed': 4})
+
+    def test_provider(self):
+        provider = Provider(
+            'valid-token',
+            executor=EmitExecutor(workers=0),
+            rate_policies={'test': Downsample(10)},
+            deadbands={'other': Deadband()}
+        )
+        provider.ready = True
+        for i in range(10):
+            provider.send_sensor('test', i)
+            provider.send_sensor('other', i // 5)
+            provider.send_sensor('unfiltered', i)
+        self.assertEqual(len(provider._emit_lanes['sensor']), 13)
+
+    def test_provider_deadband_after_policy(self):
+        provider = Provider(
+            'valid-token',
+            executor=EmitExecutor(workers=0),
+            rate_policies={'test': Downsample(0.02)},
+            deadbands={'test': Deadband(absolute=1)}
+        )
+        provider.ready = True
+        for value in [0, 10, 10, 10]:
+            provider.send_sensor('test', value)
+        sleep(0.03)
+        # The step to 10 wasn't sent, so it isn't the deadband's reference
+        provider.send_sensor('test', 10)
+        self.assertListEqual(
+            [args[1]['data'] for args, _, _ in provider._emit_lanes['sensor']],
+            [0, 10]
+        )
+        provider.close()
+
+
+try:
+    from heimdallr_client.aggregation import SensorAggregator
+except ImportError:
+    SensorAggregator = None
+
+
+@unittest.skipIf(SensorAggregator is None, 'NumPy is not installed')
+class SensorAggregatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Consumer(
+            'valid-token', executor=EmitExecutor(workers=0)
+        )
+        self.delivered = []
+        self.aggregator = SensorAggregator(
+            self.consumer,
+            lambda *args: self.delivered.append(args),
+            window=4,
+            interval=60,
+            percentiles=[50]
+        )
+
+    def packet(self, data, provider=UUID, subtype='test'):
+        return {'provider': provider, 'subtype': subtype, 'data': data}
+
+    def test_window_stats(self):
+        for i in range(6):
+            self.aggregator.add(self.packet({'x': i, 'pos': [i * 2]}))
+        self.aggregator.add(self.packet({'x': 1}, subtype='other'))
+
+        stats = self.aggregator.stats(UUID, 'test')
+        self.assertEqual(stats['count'], 4)
+        self.assertDictEqual(
+            stats['fields']['x'],
+            {'mean': 3.5, 'min': 2, 'max': 5, 'p50': 3.5}
+        )
+        self.assertEqual(stats['fields']['pos.0']['max'], 10)
+        self.assertIsNone(self.aggregator.stats(UUID, 'missing'))
+
+        # Reading the stats doesn't keep the next flush from delivering
+        self.aggregator.flush()
+        self.assertListEqual(
+            sorted(args[:2] for args in self.delivered),
+            [(UUID, 'other'), (UUID, 'test')]
+        )
+        self.assertEqual(self.delivered[0][2]['count'] +
+                         self.delivered[1][2]['count'], 5)
+        self.aggregator.flush()
+        self.assertEqual(len(self.delivered), 2)
+
+    def tearDown(self):
+        self.aggregator.close()
+        self.consumer.close()
+
+    def test_columns(self):
+        for i in range(3):
+            self.aggregator.add(self.packet(dict(
+                ('f%d' % field, i) for field in range(i * 3 + 1)
+            )))
+        stats = self.aggregator.stats(UUID, 'test')
+        self.assertEqual(len(stats['fields']), 7)
+        self.assertEqual(stats['fields']['f6']['mean'], 2)
+        self.assertEqual(stats['fields']['f0']['mean'], 1)
+
+    def test_delivers_on_cadence(self):
+        self.aggregator.add(self.packet({'x': 1}))
+        self.assertListEqual(self.delivered, [], 'Delivered per packet')
+        self.aggregator.close()
+
+        delivered = []
+        aggregator = SensorAggregator(
+            self.consumer, lambda *args: delivered.append(args[:2]),
+            interval=0.02
+        )
+        aggregator.add(self.packet({'x': 2}))
+        aggregator.add(self.packet({'x': 3}, subtype='other'))
+        # Delivered without waiting for another packet, and only once
+        sleep(0.1)
+        self.assertListEqual(
+            sorted(delivered), [(UUID, 'other'), (UUID, 'test')]
+        )
+
+        aggregator.close()
+        self.assertNotIn(aggregator.add, self.consumer.callbacks['sensor'])
+
+
+class PacketHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Consumer(
+            'valid-token', executor=EmitExecutor(workers=0)
+        )
+        self.history = PacketHistory(self.consumer, max_packets=5)
+        self.start = 1436201040
+
+    def add(self, seconds, data, subtype='test'):
+        self.history.add({
+            'provider': UUID,
+            'subtype': subtype,
+            't': '2015-07-06T16:44:%02dZ' % seconds,
+            'data': data
+        })
+
+    def test_history(self):
+        for i in range(10):
+            self.add(i, {'value': i})
+        self.add(10, 'other', subtype='other')
+
+        self.assertListEqual(
+            self.history.history(UUID, 'test'),
+            [(self.start + i, {'value': i}) for i in range(5, 10)],
+            'Oldest packets were not evicted'
+        )
+        self.assertListEqual(
+            [data['value'] for _, data in self.history.history(
+                UUID, 'test', since=self.start + 6, until=self.start + 8
+            )],
+            [6, 7, 8]
+        )
+        self.assertListEqual(
+            self.history.history(
+                UUID, 'test', since='2015-07-06T16:44:08.500Z'
+            ),
+            [(self.start + 9, {'value': 9})]
+        )
+        self.assertListEqual(self.history.history(UUID, 'missing'), [])
+        self.assertItemsEqual(
+            self.history.series(),
+            [(UUID, 'test'), (UUID, 'other')]
+        )
+
+    def test_out_of_order(self):
+        for i in [0, 2, 4, 6, 8, 5, 9, 1]:
+            self.add(i, i)
+        # 5 goes where it belongs and 1 is older than everything kept
+        self.assertListEqual(
+            self.history.history(UUID, 'test'),
+            [(self.start + i, i) for i in [4, 5, 6, 8, 9]]
+        )
+        self.assertListEqual(
+            self.history.history(UUID, 'test', since=self.start + 5,
+                                 until=self.start + 5),
+            [(self.start + 5, 5)]
+        )
+
+    def test_close(self):
+        self.history.close()
+        self.assertNotIn(self.history.add, self.consumer.callbacks['event'])
+        self.assertNotIn(self.history.add, self.consumer.callbacks['sensor'])
+
+
+class RecordingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'traffic.log')
+        self.received = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_provider(self):
+        provider = Provider('valid-token', executor=EmitExecutor(workers=0))
+        provider.ready = True
+        provider.connection.emit = lambda *args: None
+        provider.on('ping', lambda *args: self.received.append(args))
+        return provider
+
+    def test_record_and_replay(self):
+        provider = self.make_provider()
+        with Recorder(self.path, [provider]):
+            provider.connection._find_packet_callback('ping')({'ping': 'data'})
+            provider.send_sensor('test', {'value': 1})
+            provider.send_stream('\x21')
+            provider._emit_task(10)
+        self.assertIsNone(provider._recorder, 'Recorder was not detached')
+
+        replayer = Replayer(self.path)
+        records = list(replayer)
+        self.assertEqual(len(replayer), 3)
+        self.assertListEqual(
+            [(r.direction, r.message_name) for r in records],
+            [(RECEIVED, 'ping'), (SENT, 'sensor'), (SENT, 'stream')]
+        )
+        self.assertEqual(records[1].args[0]['data'], {'value': 1})
+        self.assertEqual(records[2].args, (bytearray('\x21'),))
+        self.assertListEqual(
+            list(replayer.records(since=records[1].time)),
+            records[1:]
+        )
+
+        other = self.make_provider()
+        self.assertEqual(replayer.replay(other, speed=None), 1)
+        self.assertListEqual(self.received, [({'ping': 'data'},)] * 2)
+
+        self.assertEqual(replayer.replay(other, speed=10, direction=SENT), 2)
+        self.assertEqual(len(other._emit_lanes['sensor']), 1)
+        self.assertEqual(len(other._emit_lanes['stream']), 1)
+        replayer.close()
+
+    def test_secrets_and_callbacks(self):
+        provider = self.make_provider()
+        with Recorder(self.path, [provider]):
+            provider._emit(
+                'authorize', {'token': 'secret', 'authSource': 'heimdallr'}
+            )
+            provider._emit_task(10)
+            provider.connection._find_packet_callback('ping')(
+                {'ping': 'data'}, lambda *args: None
+            )
+
+        replayer = Replayer(self.path)
+        self.assertListEqual([record.args for record in replayer], [
+            ({'token': '<redacted>', 'authSource': 'heimdallr'},),
+            ({'ping': 'data'},)
+        ])
+        with open(self.path, 'rb') as f:
+            self.assertNotIn('secret', f.read())
+        other = self.make_provider()
+        self.assertEqual(replayer.replay(other, direction=SENT), 0)
+        replayer.close()
+
+
+class ShardTestConsumer(Consumer):
+    """ Consumer that makes up sensor packets for its subscriptions. """
+
+    def connect(self, **kwargs):
+        self.subscriptions = set()
+
+        def emit(message_name, packet):
+            if message_name == 'subscribe':
+                self.subscriptions.add(packet['provider'])
+            elif message_name == 'unsubscribe':
+                self.subscriptions.discard(packet['provider'])
+
+        self.connection.emit = emit
+        self.ready = True
+        while self.ready_callbacks:
+            self.ready_callbacks.pop(0)()
+        return self
+
+    def run(self, seconds=None, **kwargs):
+        for uuid in list(self.subscriptions):
+            self.connection._find_packet_callback('sensor')(
+                {'provider': uuid, 'subtype': 'test', 'data': 1}
+            )
+        sleep(seconds)
+        return self
+
+
+def shard_setup(consumer, report):
+    consumer.on('sensor', lambda packet: report(
+        (os.getpid(), packet['provider'])
+    ))
+
+
+class ShardedConsumerTestCase(unittest.TestCase):
+    def test_hash_ring(self):
+        ring = HashRing(['a', 'b', 'c'])
+        keys = ['provider-%d' % i for i in range(1000)]
+        before = dict((key, ring.get(key)) for key in keys)
+        self.assertSetEqual(set(before.values()), set(['a', 'b', 'c']))
+
+        ring.add('d')
+        moved = [key for key in keys if ring.get(key) != before[key]]
+        self.assertTrue(0 < len(moved) < 500, 'Too many keys moved')
+        for key in moved:
+            self.assertEqual(ring.get(key), 'd', 'Key moved between old nodes')
+
+        ring.remove('d')
+        for key in keys:
+            self.assertEqual(ring.get(key), before[key])
+
+    def test_sharding(self):
+        uuids = ['provider-%d' % i for i in range(20)]
+        with ShardedConsumer(
+            'valid-token',
+            shard_setup,
+            workers=2,
+            consumer_factory=ShardTestConsumer,
+            poll_interval=0.01
+        ) as sharded:
+            for uuid in uuids:
+                sharded.add_provider(uuid, {'sensor': ['test']})
+
+            pids = {}
+            while len(pids) < len(uuids):
+                pid, uuid = sharded.results.get(timeout=3)
+                pids.setdefault(uuid, set()).add(pid)
+            self.assertEqual(len(set.union(*pids.values())), 2)
+            for uuid in uuids:
+                self.assertEqual(len(pids[uuid]), 1, 'Provider was shared')
+
+            before = sharded.assignment()
+            name = sharded.add_worker()
+            after = sharded.assignment()
+            for worker in before:
+                self.assertTrue(set(after[worker]) <= set(before[worker]))
+            self.assertTrue(after[name], 'New worker got no providers')
+
+            sharded.remove_worker(name)
+            self.assertDictEqual(sharded.assignment(), before)
+
+    def test_filter_change(self):
+        with ShardedConsumer(
+            'valid-token',
+            shard_setup,
+            workers=1,
+            consumer_factory=ShardTestConsumer,
+            poll_interval=0.01
+        ) as sharded:
+            sent = []
+            sharded._send = lambda name, command: sent.append(command)
+            sharded.add_provider('a', {'sensor': ['test']})
+            sharded.add_provider('a', {'sensor': ['test']})
+            sharded.add_provider('a', {'event': ['map']})
+            sharded.add_provider('a')
+        self.assertListEqual(sent, [
+            ('subscribe', 'a', {'sensor': ['test']}),
+            ('filter', 'a', {'event': ['map']}),
+            ('filter', 'a', None)
+        ])
+
+
+def read_gateway(name, ready, results):
+    local = LocalConsumer(name)
+    local.on('sensor', lambda packet: results.put(packet['data']))
+    ready.put(True)
+    local.run(seconds=3)
+
+
+class GatewayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.consumer = Consumer(
+            'valid-token', executor=EmitExecutor(workers=0)
+        )
+        self.name = 'test-%d' % os.getpid()
+
+    def receive(self, packet):
+        self.consumer.connection._find_packet_callback('sensor')(packet)
+
+    def test_fan_out(self):
+        with Gateway(self.consumer, self.name) as gateway:
+            ready, results = Queue(), Queue()
+            process = Process(
+                target=read_gateway, args=(self.name, ready, results)
+            )
+            process.start()
+            ready.get(timeout=3)
+            self.assertEqual(len(gateway.readers()), 1)
+
+            for i in range(100):
+                self.receive({'provider': UUID, 'subtype': 'test', 'data': i})
+            self.assertListEqual(
+                [results.get(timeout=3) for _ in range(100)],
+                range(100)
+            )
+            process.terminate()
+            process.join()
+
+    def test_wrap_and_overrun(self):
+        received = []
+        with Gateway(self.consumer, self.name, capacity=1024):
+            local = LocalConsumer(self.name)
+            local.on('sensor', lambda packet: received.append(packet['data']))
+            for i in range(100):
+                self.receive({'data': i})
+                if i % 5 == 4:
+                    local.read()
+            self.assertListEqual(received, range(100))
+            self.assertEqual(local.overruns, 0)
+
+            for i in range(200):
+                self.receive({'data': i})
+            self.assertEqual(local.read(), 0)
+            self.assertEqual(local.overruns, 1)
+            self.receive({'data': 'latest'})
+            local.read()
+            self.assertEqual(received[-1], 'latest')
+
+            # A record the gateway is overwriting isn't delivered
+            self.receive({'data': 'torn'})
+            _U64.pack_into(
+                local._map, _RESERVED_OFFSET,
+                _U64.unpack_from(local._map, _RESERVED_OFFSET)[0] + 1024
+            )
+            self.assertEqual(local.read(), 0)
+            self.assertEqual(local.overruns, 2)
+            self.receive({'data': 'next'})
+            local.read()
+            self.assertListEqual(received[-2:], ['latest', 'next'])
+            local.close()
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.mean, 0.5005)
+        for percent in [50, 90, 99]:
+            self.assertAlmostEqual(
+                histogram.percentile(percent) / (percent / 100.0),
+                1,
+                delta=0.2
+            )
+        self.assertEqual(histogram.percentile(100), 1)
+
+
+class ImportTestCase(unittest.TestCase):
+    def test_import_is_lazy(self):
+        output = check_output([
+            sys.executable,
+            '-c',
+            'import sys, heimdallr_client; print " ".join(sys.modules)'
+        ], cwd=os.path.dirname(DIR))
+        modules = output.split()
+
+        for name in ['requests', 'socketIO_client', 'pkg_resources', 'uuid']:
+            self.assertNotIn(name, modules, '%s imported eagerly' % name)
+        for name in ['channels', 'controls', 'fragments', 'monitor',
+                     'streams', 'tracing']:
+            name = 'heimdallr_client.' + name
+            self.assertNotIn(name, modules, '%s imported eagerly' % name)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -31,12 +31,15 @@ io.of('/provider').on('connect', function (socket) {
             return;
         }
         socket.emit('auth-success');
-    }).on('event', function (packet) {
+    }).on('event', function (packet, ack) {
         validator.validatePacket('event', packet, function (err) {
             if (err) {
                 socket.emit('err', err);
                 return;
             }
+            if (ack) {
+                ack('ack');
+            }
             socket.emit('heardEvent', packet);
             if (packet.subtype === 'ping') {
                 socket.emit('pong');
@@ -44,12 +47,15 @@ io.of('/provider').on('connect', function (socket) {
                 socket.emit('completedControl');
             }
         });
-    }).on('sensor', function (packet) {
+    }).on('sensor', function (packet, ack) {
         validator.validatePacket('sensor', packet, function (err) {
             if (err) {
                 socket.emit('err', err);
                 return;
             }
+            if (ack) {
+                ack('ack');
+            }
             socket.emit('heardSensor', packet);
         });
     }).on('stream', function (data) {
@@ -81,12 +87,15 @@ io.of('/consumer').on('connect', function (socket) {
             return;
         }
         socket.emit('auth-success');
-    }).on('control', function (packet) {
+    }).on('control', function (packet, ack) {
         validator.validatePacket('control', packet, function (err) {
             if (err) {
                 socket.emit('err', err);
                 return;
             }
+            if (ack) {
+                ack('ack');
+            }
             socket.emit('heardControl', packet);
             if (packet.subtype === 'ping') {
                 socket.emit('pong');